@@ -0,0 +1,372 @@
+# analysis_store.py
+
+"""
+Persistent, queryable store of document analyses.
+
+Every analyzed document version is kept in SQLite with its chunks (clause hashes, text and
+result, zlib-compressed), so it also serves as the document version store for incremental
+re-analysis, across restarts and workers. The findings of each chunk are indexed when it is
+saved. An inverted index maps each (field, normalized term) to the findings that carry it:
+red flag types, risk levels, vague terms, external references and jurisdictions. A full-text
+index (SQLite FTS5, when available) covers the findings' descriptions. Portfolio questions such
+as "which contracts have an unlimited-liability red flag" are then a few index lookups, with no
+LLM call.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from versioning import DocumentVersion, StoredChunk
+
+# Query field -> (result field, entry keys whose values are indexed). 'risk_level' indexes the chunk itself.
+INDEXED_FIELDS = {
+    "red_flag": ("red_flags", ("type",)),
+    "vague_term": ("vague_terms", ("term",)),
+    "external_reference": ("external_references", ("reference",)),
+    "jurisdiction": ("jurisdictional_risks", ("jurisdictions", "jurisdiction")),
+    "risk_level": ("risk_level", ()),
+}
+MATCH_MODES = ("exact", "prefix", "contains")
+# Term queries matching at most this many findings start from those findings; broader ones scan the most recent documents.
+SELECTIVE_TERM_POSTINGS = 2000
+TERM_SEPARATOR_PATTERN = re.compile(r"[^0-9a-z§]+")
+
+
+def normalize_term(term: str) -> str:
+    """'Unlimited-Liability', 'unlimited_liability' and 'unlimited liability' all become 'unlimited liability'."""
+    return TERM_SEPARATOR_PATTERN.sub(" ", term.lower()).strip()
+
+
+def _escape_like(value: str) -> str:
+    """Escapes LIKE wildcards so user input matches literally (with ESCAPE '\\')."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: Optional[bytes]) -> Any:
+    return json.loads(zlib.decompress(blob)) if blob is not None else None
+
+
+def _entry_text(entry: Any) -> str:
+    """The free text of a finding, for the full-text index."""
+    if isinstance(entry, dict):
+        return " ".join(_entry_text(value) for key, value in entry.items() if key not in ("start", "end"))
+    if isinstance(entry, list):
+        return " ".join(_entry_text(value) for value in entry)
+    return entry if isinstance(entry, str) else ""
+
+
+def extract_findings(result: Mapping[str, Any]) -> List[Tuple[str, List[str], Any]]:
+    """The indexed findings of a chunk result, as (query field, normalized terms, entry)."""
+    findings = []
+    for query_field, (result_field, keys) in INDEXED_FIELDS.items():
+        if query_field == "risk_level":
+            if isinstance(result.get("risk_level"), str):
+                entry = {"risk_level": result["risk_level"], "simplified_explanation": result.get("simplified_explanation", "")}
+                findings.append((query_field, [normalize_term(result["risk_level"])], entry))
+            continue
+        entries = result.get(result_field)
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            terms = []
+            for key in keys:
+                values = entry.get(key)
+                for value in values if isinstance(values, list) else [values]:
+                    if isinstance(value, str) and normalize_term(value):
+                        terms.append(normalize_term(value))
+            findings.append((query_field, sorted(set(terms)), entry))
+    return findings
+
+
+class AnalysisStore:
+    """
+    SQLite analysis store (path=":memory:" keeps it in process only). Implements save/get like
+    versioning.DocumentVersionStore, plus query() over the indexed findings. risk_order ranks
+    risk levels, to record each document's overall risk level (its highest chunk risk level).
+    Documents older than ttl_seconds (0: no expiry) and the oldest past max_documents are deleted,
+    with their chunks and index entries, when a new version is saved.
+    Saving compresses, writes and indexes a whole document, so callers on an event loop run the
+    store's methods in a thread (blocking; see rate_limiter.run_blocking).
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, risk_order: Mapping[str, int], max_documents: int = 100000, ttl_seconds: float = 0):
+        self.path = path
+        self.risk_order = dict(risk_order)
+        self.max_documents = max_documents
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " document_id TEXT PRIMARY KEY, prompt_type TEXT NOT NULL, name TEXT, previous_document_id TEXT,"
+            " superseded INTEGER NOT NULL DEFAULT 0, risk_level TEXT, chunk_count INTEGER NOT NULL, created_at REAL NOT NULL,"
+            " clause_pairs BLOB);"
+            "CREATE INDEX IF NOT EXISTS documents_risk_level ON documents (risk_level);"
+            "CREATE INDEX IF NOT EXISTS documents_created_at ON documents (created_at);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " document_id TEXT NOT NULL, chunk_index INTEGER NOT NULL, start INTEGER NOT NULL, clauses BLOB NOT NULL,"
+            " text BLOB NOT NULL, result BLOB, PRIMARY KEY (document_id, chunk_index));"
+            "CREATE TABLE IF NOT EXISTS findings ("
+            " finding_id INTEGER PRIMARY KEY AUTOINCREMENT, document_id TEXT NOT NULL, chunk_index INTEGER NOT NULL,"
+            " field TEXT NOT NULL, entry TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS findings_document ON findings (document_id);"
+            "CREATE TABLE IF NOT EXISTS terms (term_id INTEGER PRIMARY KEY AUTOINCREMENT, field TEXT NOT NULL, term TEXT NOT NULL,"
+            " UNIQUE (field, term));"
+            "CREATE TABLE IF NOT EXISTS postings (term_id INTEGER NOT NULL, finding_id INTEGER NOT NULL, PRIMARY KEY (term_id, finding_id))"
+            " WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_finding ON postings (finding_id);"
+        )
+        try:
+            # Contentless: only the index is kept, the text is already in findings.entry
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS findings_text USING fts5(text, content='')")
+            self.full_text = True
+        except sqlite3.OperationalError: # SQLite built without FTS5: text queries scan the findings instead
+            self.full_text = False
+
+    # --- Document version store interface ---
+
+    def save(self, prompt_type: str, chunks: List[StoredChunk], previous_document_id: Optional[str] = None,
+             name: Optional[str] = None, clause_pairs: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """Stores a document version with its chunks and indexes the findings of every chunk that has a result."""
+        document_id = uuid.uuid4().hex
+        levels = [chunk.result.get("risk_level") for chunk in chunks if chunk.result]
+        known = [level for level in levels if level in self.risk_order]
+        risk_level = max(known, key=self.risk_order.get) if known else (levels[0] if levels else None)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO documents (document_id, prompt_type, name, previous_document_id, risk_level, chunk_count, created_at,"
+                    " clause_pairs) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (document_id, prompt_type, name, previous_document_id, risk_level, len(chunks), time.time(),
+                     _pack(clause_pairs or {})),
+                )
+                if previous_document_id:
+                    self._conn.execute("UPDATE documents SET superseded = 1 WHERE document_id = ?", (previous_document_id,))
+                for index, chunk in enumerate(chunks):
+                    self._conn.execute(
+                        "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                        (document_id, index, chunk.start, _pack([chunk.clause_hashes, chunk.clause_labels]),
+                         zlib.compress(chunk.text.encode("utf-8")), _pack(chunk.result) if chunk.result is not None else None),
+                    )
+                    if chunk.result:
+                        self._index_chunk(document_id, index, chunk.result)
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return document_id
+
+    def _index_chunk(self, document_id: str, chunk_index: int, result: Mapping[str, Any]) -> None:
+        for query_field, terms, entry in extract_findings(result):
+            finding_id = self._conn.execute(
+                "INSERT INTO findings (document_id, chunk_index, field, entry) VALUES (?, ?, ?, ?)",
+                (document_id, chunk_index, query_field, json.dumps(entry)),
+            ).lastrowid
+            for term in terms:
+                self._conn.execute("INSERT OR IGNORE INTO terms (field, term) VALUES (?, ?)", (query_field, term))
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO postings SELECT term_id, ? FROM terms WHERE field = ? AND term = ?",
+                    (finding_id, query_field, term),
+                )
+            if self.full_text:
+                self._conn.execute("INSERT INTO findings_text (rowid, text) VALUES (?, ?)", (finding_id, _entry_text(entry)))
+
+    def _evict(self) -> None:
+        """Deletes expired documents and the oldest past max_documents (other workers may share the file, so it is counted here)."""
+        doomed = []
+        if self.ttl_seconds:
+            doomed += [row[0] for row in self._conn.execute(
+                "SELECT document_id FROM documents WHERE created_at < ?", (time.time() - self.ttl_seconds,))]
+        excess = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] - len(doomed) - self.max_documents
+        if excess > 0:
+            doomed += [row[0] for row in self._conn.execute(
+                f"SELECT document_id FROM documents WHERE document_id NOT IN ({', '.join('?' * len(doomed))})"
+                " ORDER BY created_at LIMIT ?", doomed + [excess])]
+        if not doomed:
+            return
+        for document_id in doomed:
+            findings = self._conn.execute("SELECT finding_id, entry FROM findings WHERE document_id = ?", (document_id,)).fetchall()
+            if self.full_text:
+                # A contentless full-text index can only forget a row given the text it indexed.
+                self._conn.executemany("INSERT INTO findings_text (findings_text, rowid, text) VALUES ('delete', ?, ?)",
+                                       [(finding_id, _entry_text(json.loads(entry))) for finding_id, entry in findings])
+            self._conn.executemany("DELETE FROM postings WHERE finding_id = ?", [(finding_id,) for finding_id, _ in findings])
+            for table in ("findings", "chunks", "documents"):
+                self._conn.execute(f"DELETE FROM {table} WHERE document_id = ?", (document_id,))
+        self._conn.execute("DELETE FROM terms WHERE term_id NOT IN (SELECT term_id FROM postings)")
+        self.evictions += len(doomed)
+
+    def get(self, document_id: str) -> Optional[DocumentVersion]:
+        with self._lock:
+            document = self._conn.execute(
+                "SELECT prompt_type, previous_document_id, created_at, name, clause_pairs FROM documents WHERE document_id = ?",
+                (document_id,)
+            ).fetchone()
+            if document is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT start, clauses, text, result FROM chunks WHERE document_id = ? ORDER BY chunk_index", (document_id,)
+            ).fetchall()
+        chunks = []
+        for start, clauses, text, result in rows:
+            clause_hashes, clause_labels = _unpack(clauses)
+            chunks.append(StoredChunk(clause_hashes, clause_labels, zlib.decompress(text).decode("utf-8"), _unpack(result), start))
+        prompt_type, previous_document_id, created_at, name, clause_pairs = document
+        return DocumentVersion(document_id, prompt_type, chunks, previous_document_id, created_at, name, _unpack(clause_pairs) or {})
+
+    # --- Queries ---
+
+    def query(self, field: Optional[str] = None, term: Optional[str] = None, match: str = "exact",
+              text: Optional[str] = None, risk_levels: Optional[Iterable[str]] = None, prompt_type: Optional[str] = None,
+              include_superseded: bool = False, limit: int = 100) -> Dict[str, Any]:
+        """
+        Finds documents by their indexed findings. `field` (one of INDEXED_FIELDS) with `term` matches
+        findings whose normalized term equals, starts with or contains the normalized query term
+        (`match`); `text` is a full-text query over the findings' descriptions (of `field` only, if
+        given). Documents can be filtered by overall risk level and prompt type; superseded versions
+        (re-analyzed since) are left out unless include_superseded. Returns at most `limit` documents,
+        most recent first, each with its matching findings.
+        """
+        if field is not None and field not in INDEXED_FIELDS:
+            raise ValueError(f"Unknown field: '{field}'. Indexed fields are: {', '.join(INDEXED_FIELDS)}")
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: '{match}'. Use one of: {', '.join(MATCH_MODES)}")
+        if term is not None and field is None:
+            raise ValueError("A term query needs a field.")
+
+        document_filters, params = [], []
+        if not include_superseded:
+            document_filters.append("d.superseded = 0")
+        if risk_levels:
+            levels = list(risk_levels)
+            document_filters.append(f"d.risk_level IN ({', '.join('?' * len(levels))})")
+            params.extend(levels)
+        if prompt_type:
+            document_filters.append("d.prompt_type = ?")
+            params.append(prompt_type)
+
+        finding_filters, finding_params = [], []
+        if term is not None:
+            normalized = normalize_term(term)
+            if match == "exact":
+                term_condition, term_param = "term = ?", normalized
+            else:
+                escaped = _escape_like(normalized)
+                term_condition = "term LIKE ? ESCAPE '\\'"
+                term_param = f"{escaped}%" if match == "prefix" else f"%{escaped}%"
+        elif field is not None:
+            finding_filters.append("f.field = ?")
+            finding_params.append(field)
+        if text:
+            if self.full_text:
+                finding_filters.append("f.finding_id IN (SELECT rowid FROM findings_text WHERE findings_text MATCH ?)")
+                # Each word must appear, in any order; quoting keeps user input from being read as FTS syntax.
+                finding_params.append(" ".join('"' + word.replace('"', '""') + '"' for word in text.split()))
+            else:
+                finding_filters.append("f.entry LIKE ? ESCAPE '\\'")
+                finding_params.append(f"%{_escape_like(text)}%")
+
+        started = time.perf_counter()
+        where = " AND ".join(document_filters) or "1"
+        with self._lock:
+            selective = bool(text)
+            if term is not None:
+                term_ids = [row[0] for row in self._conn.execute(
+                    f"SELECT term_id FROM terms WHERE field = ? AND {term_condition}", (field, term_param))]
+                id_list = ", ".join(str(term_id) for term_id in term_ids) or "NULL"
+                postings = self._conn.execute(f"SELECT COUNT(*) FROM postings WHERE term_id IN ({id_list})").fetchone()[0]
+                if postings <= SELECTIVE_TERM_POSTINGS:
+                    selective = True
+                    finding_filters.append(f"f.finding_id IN (SELECT finding_id FROM postings WHERE term_id IN ({id_list}))")
+                else:
+                    finding_filters.append(
+                        f"EXISTS (SELECT 1 FROM postings p WHERE p.finding_id = f.finding_id AND p.term_id IN ({id_list}))")
+            if finding_filters:
+                # The limit applies to the documents, so only the findings of the `limit` most recent matching ones
+                # are read. Selective filters collect the documents of their few matching findings; broad ones check
+                # the most recent documents for a matching finding until `limit` are found.
+                matches = " AND ".join(finding_filters)
+                if selective:
+                    document_match = f"d.document_id IN (SELECT f.document_id FROM findings f WHERE {matches})"
+                else:
+                    document_match = f"EXISTS (SELECT 1 FROM findings f WHERE f.document_id = d.document_id AND {matches})"
+                rows = self._conn.execute(
+                    "WITH selected AS (SELECT d.document_id FROM documents d"
+                    f" WHERE {where} AND {document_match} ORDER BY d.created_at DESC LIMIT ?)"
+                    " SELECT d.document_id, d.name, d.prompt_type, d.risk_level, d.created_at, d.previous_document_id,"
+                    " f.chunk_index, f.field, f.entry, c.start"
+                    " FROM selected s JOIN documents d ON d.document_id = s.document_id"
+                    " JOIN findings f ON f.document_id = s.document_id"
+                    " JOIN chunks c ON c.document_id = f.document_id AND c.chunk_index = f.chunk_index"
+                    f" WHERE {matches} ORDER BY d.created_at DESC, f.finding_id",
+                    params + finding_params + [limit] + finding_params,
+                ).fetchall()
+            else:
+                rows = [
+                    row + (None, None, None, None) for row in self._conn.execute(
+                        "SELECT d.document_id, d.name, d.prompt_type, d.risk_level, d.created_at, d.previous_document_id"
+                        f" FROM documents d WHERE {where} ORDER BY d.created_at DESC LIMIT ?",
+                        params + [limit],
+                    )
+                ]
+
+        documents: Dict[str, Dict[str, Any]] = {}
+        for document_id, name, document_prompt_type, risk_level, created_at, previous_id, chunk_index, finding_field, entry, start in rows:
+            if document_id not in documents:
+                documents[document_id] = {
+                    "document_id": document_id,
+                    "name": name,
+                    "prompt_type": document_prompt_type,
+                    "risk_level": risk_level,
+                    "created_at": created_at,
+                    "previous_document_id": previous_id,
+                    "matches": [],
+                }
+            if finding_field is not None:
+                documents[document_id]["matches"].append(
+                    {"field": finding_field, "chunk_index": chunk_index, "chunk_start": start, "finding": json.loads(entry)}
+                )
+        return {
+            "documents": list(documents.values()),
+            "total_documents": len(documents),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def terms(self, field: str, prefix: str = "", limit: int = 100) -> List[Dict[str, Any]]:
+        """The indexed terms of a field with their number of findings, most frequent first."""
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Unknown field: '{field}'. Indexed fields are: {', '.join(INDEXED_FIELDS)}")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.term, COUNT(*) AS findings FROM terms t JOIN postings p ON p.term_id = t.term_id"
+                " WHERE t.field = ? AND t.term LIKE ? ESCAPE '\\' GROUP BY t.term_id ORDER BY findings DESC, t.term LIMIT ?",
+                (field, _escape_like(normalize_term(prefix)) + "%", limit),
+            ).fetchall()
+        return [{"term": term, "findings": count} for term, count in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("documents", "chunks", "findings", "terms", "postings")
+            }
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return {"path": self.path, **counts, "bytes": page_count * page_size, "full_text_index": self.full_text,
+                "max_documents": self.max_documents, "ttl_seconds": self.ttl_seconds, "evictions": self.evictions}
@@ -0,0 +1,224 @@
+# benchmark.py
+
+"""
+End-to-end benchmark of the analysis API.
+
+Sends generated contracts of several sizes through the text and upload endpoints at several
+concurrency levels and reports p50/p95/p99 latency and documents per second per scenario.
+By default the app runs in-process on the simulated LLM backend with the result cache and
+near-duplicate reuse disabled and its stores kept in memory, so no quota is spent, nothing is
+carried over between runs and every request does the full amount of work (--with-cache opts in
+to reuse, still in memory only). Use --url to benchmark a running deployment instead. Requires httpx (pip install httpx).
+
+    python benchmark.py
+    python benchmark.py --sizes 5000,50000 --concurrency 1,8 --requests 40
+    python benchmark.py --output current.json --baseline baseline.json --max-regression 0.2
+
+With --baseline the run exits with status 1 if any scenario's p95 latency or throughput
+regressed by more than --max-regression compared to the baseline results.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+CLAUSE_BODIES = [
+    "The Supplier shall use commercially reasonable efforts to deliver the Services promptly and in accordance with industry standards.",
+    "Subject to Section {ref}, either party may terminate this Agreement upon material breach by the other party.",
+    "Notwithstanding Clause {ref}, the Customer shall indemnify the Supplier against all claims arising under applicable laws.",
+    "Each party shall comply with the General Data Protection Regulation and 15 U.S.C. § 78j to the extent applicable.",
+    "The liability of the Supplier shall not exceed the fees paid in the twelve months preceding the claim, except as provided in Section {ref}.",
+    "The Chairman of the Board shall resolve disputes in his sole discretion, acting in good faith.",
+    "Payment is due within thirty days of invoice; late payments accrue interest at a reasonable rate.",
+]
+
+
+def make_contract(target_chars: int, seed: int) -> str:
+    """Generates a numbered contract of roughly target_chars characters with cross-references."""
+    rng = random.Random(seed)
+    sections = [f"MASTER SERVICES AGREEMENT (benchmark document {seed})\n"]
+    length = len(sections[0])
+    number = 1
+    while length < target_chars:
+        sentences = [rng.choice(CLAUSE_BODIES).format(ref=rng.randint(1, max(1, number - 1))) for _ in range(rng.randint(3, 8))]
+        section = f"Section {number}. Provision {number}\n" + " ".join(sentences) + "\n\n"
+        sections.append(section)
+        length += len(section)
+        number += 1
+    return "".join(sections)
+
+
+def make_docx(text: str) -> bytes:
+    import docx
+    document = docx.Document()
+    for paragraph in text.split("\n"):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def send(client: httpx.AsyncClient, path: str, text: str, upload: Optional[bytes], prompt_type: str) -> httpx.Response:
+    if path == "text":
+        return await client.post("/analyze-document-text", json={"text": text, "prompt_type": prompt_type})
+    files = {"file": ("benchmark.docx", upload, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+    return await client.post("/upload-and-analyze", files=files)
+
+
+async def run_scenario(client: httpx.AsyncClient, path: str, size: int, concurrency: int, requests: int,
+                       prompt_type: str) -> Dict[str, Any]:
+    # Every request gets its own document, so nothing is shared between requests.
+    documents = [make_contract(size, seed=size * 1000 + index) for index in range(requests)]
+    uploads = [make_docx(text) for text in documents] if path == "upload" else [None] * requests
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    next_request = iter(range(requests))
+
+    async def worker():
+        for index in next_request:
+            started = time.perf_counter()
+            try:
+                response = await send(client, path, documents[index], uploads[index], prompt_type)
+                outcome = None if response.status_code == 200 else str(response.status_code)
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            if outcome is None:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "path": path,
+        "size_chars": size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "docs_per_second": len(latencies) / elapsed if elapsed else None,
+    }
+
+
+def _format(value: Optional[float], digits: int = 0) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_header() -> None:
+    print(f"{'path':<7}{'size':>9}{'conc':>6}{'reqs':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'docs/s':>9}")
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(f"{result['path']:<7}{result['size_chars']:>9}{result['concurrency']:>6}{result['requests']:>6}"
+          f"{sum(result['errors'].values()):>8}{_format(result['p50_ms']):>10}{_format(result['p95_ms']):>10}"
+          f"{_format(result['p99_ms']):>10}{_format(result['docs_per_second'], 2):>9}", flush=True)
+
+
+def find_regressions(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float) -> List[str]:
+    """Compares p95 latency and throughput of each scenario with the same scenario in the baseline."""
+    previous = {(entry["path"], entry["size_chars"], entry["concurrency"]): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        entry = previous.get((result["path"], result["size_chars"], result["concurrency"]))
+        if entry is None:
+            continue
+        scenario = f"{result['path']} size={result['size_chars']} concurrency={result['concurrency']}"
+        if entry["p95_ms"] and result["p95_ms"] and result["p95_ms"] > entry["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{scenario}: p95 {entry['p95_ms']:.0f} ms -> {result['p95_ms']:.0f} ms")
+        if entry["docs_per_second"] and (result["docs_per_second"] or 0) < entry["docs_per_second"] * (1 - max_regression):
+            regressions.append(f"{scenario}: {entry['docs_per_second']:.2f} -> {result['docs_per_second'] or 0:.2f} docs/s")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the legal document analysis API.")
+    parser.add_argument("--url", help="Benchmark a running deployment instead of the in-process app")
+    parser.add_argument("--paths", default="text,upload", help="Comma-separated endpoints to benchmark: text, upload")
+    parser.add_argument("--sizes", default="5000,50000,200000", help="Comma-separated document sizes in characters")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--prompt-type", default="detailed_analysis", help="prompt_type for the text endpoint")
+    parser.add_argument("--with-cache", action="store_true",
+                        help="Keep the result cache and near-duplicate reuse enabled (in-process only)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative regression (default 0.2 = 20%%)")
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    app_module = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=None)
+    else:
+        # Configure the app before importing it: simulated LLM, no reuse of earlier results, no client-side quota.
+        os.environ.setdefault("LLM_BACKEND", "simulated")
+        os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+        os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+        # Stores in memory only, so a run never reuses (or leaves behind) files of an earlier one.
+        os.environ["RESULT_CACHE_PATH"] = ""
+        os.environ["SIMILARITY_INDEX_PATH"] = ":memory:"
+        os.environ["ANALYSIS_STORE_PATH"] = ":memory:"
+        os.environ["SHARED_STATE_BACKEND"] = "local"
+        if not args.with_cache:
+            os.environ["RESULT_CACHE_ENABLED"] = "false"
+            os.environ["SIMILARITY_REUSE_ENABLED"] = "false"
+        import main as app_module
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://benchmark", timeout=None)
+
+    results = []
+    print_header()
+    try:
+        for path in args.paths.split(","):
+            for size in (int(value) for value in args.sizes.split(",")):
+                for concurrency in (int(value) for value in args.concurrency.split(",")):
+                    result = await run_scenario(client, path, size, concurrency, args.requests, args.prompt_type)
+                    results.append(result)
+                    print_result(result)
+    finally:
+        await client.aclose()
+        if app_module is not None:
+            app_module.text_extractor.shutdown()
+
+    if app_module is not None and hasattr(app_module.llm_backend, "counters"):
+        print(f"\nLLM backend ({app_module.llm_backend.name}): {app_module.llm_backend.counters}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,273 @@
+# cache.py
+
+"""
+Content-addressed cache for LLM analysis results.
+
+Entries are keyed on a hash of the normalized input text, the prompt type, the exact prompt
+template and the model name, so a changed template or model never serves a stale result.
+Two tiers are used: a bounded in-process LRU and an optional persistent SQLite tier with a
+TTL and size-based (least recently used) eviction. When several worker processes share the SQLite
+tier (shared=True), the in-process tier is turned off so an invalidation or discard in one worker
+is seen by all of them, and the size budget is recomputed from the file before evicting.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace so re-uploads that differ only in line wrapping share a cache entry."""
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def template_fingerprint(prompt_template: str) -> str:
+    """Short stable hash of a prompt template, stored alongside entries for invalidation."""
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(text: str, prompt_type: str, prompt_template: str, model_name: str,
+                   extra: Optional[Dict[str, str]] = None) -> str:
+    """Builds the content address for an LLM call. `extra` holds any other filled-in placeholders."""
+    extra_items = sorted((key, normalize_text(value)) for key, value in (extra or {}).items())
+    material = json.dumps([normalize_text(text), prompt_type, prompt_template, model_name, extra_items])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheTier:
+    """
+    Persistent cache tier. Entries expire after ttl_seconds; the least recently used are evicted past max_bytes.
+    With shared=True other processes write to the same file, so the total size isn't tracked locally.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int, shared: bool = False):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, prompt_type TEXT, template_hash TEXT, model_name TEXT,"
+            " value TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_prompt_type ON llm_cache (prompt_type, template_hash)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str, touch: bool = True) -> Optional[Tuple[str, str, str]]:
+        """
+        Returns (value, prompt_type, template_hash) for a live entry, or None. touch=False only reads:
+        the entry's recency isn't updated and an expired entry is left for eviction to remove.
+        """
+        now = time.time()
+        if not touch:
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT value, prompt_type, template_hash FROM llm_cache WHERE key = ? AND created_at >= ?",
+                    (key, now - self.ttl_seconds),
+                ).fetchone()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, created_at, prompt_type, template_hash FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, size, created_at, prompt_type, template_hash = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            return value, prompt_type, template_hash
+
+    def set(self, key: str, value: str, prompt_type: str, template_hash: str, model_name: str) -> int:
+        """Stores an entry and returns how many entries were evicted to stay under max_bytes."""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, prompt_type, template_hash, model_name, value, size, now, now),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            return self._evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._total_bytes -= row[0]
+
+    def _evict(self) -> int:
+        evicted = 0
+        if self.shared:
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        # Drop expired entries first, then the least recently used until under the size budget.
+        expired = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache WHERE created_at < ?",
+            (time.time() - self.ttl_seconds,),
+        ).fetchone()
+        if expired[0]:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._total_bytes -= expired[1]
+            evicted += expired[0]
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                evicted += 1
+        return evicted
+
+    def invalidate(self, prompt_type: Optional[str] = None,
+                   keep_template_hashes: Optional[Iterable[str]] = None) -> int:
+        """
+        Deletes entries for prompt_type (or all prompt types). If keep_template_hashes is given,
+        only entries whose template is no longer in that set are deleted.
+        """
+        conditions, params = [], []
+        if prompt_type is not None:
+            conditions.append("prompt_type = ?")
+            params.append(prompt_type)
+        keep = list(keep_template_hashes or [])
+        if keep:
+            conditions.append(f"template_hash NOT IN ({', '.join('?' * len(keep))})")
+            params.extend(keep)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            count, size = self._conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache{where}", params).fetchone()
+            self._conn.execute(f"DELETE FROM llm_cache{where}", params)
+            self._total_bytes -= size
+            return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"path": self.path, "entries": entries, "bytes": self._total_bytes, "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds}
+
+
+class ResultCache:
+    """
+    Two-tier cache for raw LLM outputs: a bounded in-memory LRU in front of an optional SQLite tier.
+    Disk hits are promoted into the memory tier. shared=True (the SQLite file is used by several
+    worker processes) turns the memory tier off. With a disk tier, calls block on SQLite, so callers
+    on the event loop go through rate_limiter.run_blocking.
+    """
+
+    def __init__(self, memory_max_entries: int = 1024, disk_path: Optional[str] = None,
+                 ttl_seconds: float = 7 * 24 * 3600, disk_max_bytes: int = 256 * 1024 * 1024, shared: bool = False):
+        if shared and not disk_path:
+            raise ValueError("A shared result cache needs a disk path.")
+        self.memory_max_entries = 0 if shared else memory_max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (value, prompt_type, template_hash, stored_at)
+        self._memory: "OrderedDict[str, Tuple[str, str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = SQLiteCacheTier(disk_path, ttl_seconds, disk_max_bytes, shared) if disk_path else None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def blocking(self) -> bool:
+        return self.disk is not None
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[3] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+        disk_entry = self.disk.get(key) if self.disk else None
+        with self._lock:
+            if disk_entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            value, prompt_type, template_hash = disk_entry
+            self._remember(key, (value, prompt_type, template_hash, time.time()))
+            return value
+
+    def peek(self, key: str) -> Optional[str]:
+        """Like get, but without counting the lookup, promoting a disk hit or writing to the disk tier (for polling)."""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and time.time() - entry[3] <= self.ttl_seconds:
+            return entry[0]
+        disk_entry = self.disk.get(key, touch=False) if self.disk else None
+        return disk_entry[0] if disk_entry else None
+
+    def set(self, key: str, value: str, prompt_type: str, template_hash: str, model_name: str) -> None:
+        with self._lock:
+            self._remember(key, (value, prompt_type, template_hash, time.time()))
+            self.counters["stores"] += 1
+        if self.disk:
+            evicted = self.disk.set(key, value, prompt_type, template_hash, model_name)
+            with self._lock:
+                self.counters["evictions"] += evicted
+
+    def discard(self, key: str) -> None:
+        """Removes one entry from both tiers, e.g. an output that turned out to be unusable."""
+        with self._lock:
+            self._memory.pop(key, None)
+        if self.disk:
+            self.disk.delete(key)
+
+    def _remember(self, key: str, entry: Tuple[str, str, str, float]) -> None:
+        if not self.memory_max_entries:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def invalidate(self, prompt_type: Optional[str] = None,
+                   keep_template_hashes: Optional[Iterable[str]] = None) -> int:
+        """Removes matching entries from both tiers and returns the number of entries removed."""
+        keep = set(keep_template_hashes) if keep_template_hashes is not None else None
+        with self._lock:
+            doomed = [
+                key for key, (_, entry_type, entry_hash, _) in self._memory.items()
+                if (prompt_type is None or entry_type == prompt_type) and not (keep and entry_hash in keep)
+            ]
+            for key in doomed:
+                del self._memory[key]
+        # The disk tier holds every stored entry, so its count is authoritative when enabled.
+        removed = self.disk.invalidate(prompt_type, keep) if self.disk else len(doomed)
+        with self._lock:
+            self.counters["invalidations"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": {"entries": memory_entries, "max_entries": self.memory_max_entries},
+            "disk": self.disk.stats() if self.disk else None,
+        }
@@ -0,0 +1,107 @@
+# cascade.py
+
+"""
+Tiered model cascade for 'detailed_analysis'.
+
+Most clauses of a contract are low-risk boilerplate, so in cascade mode every chunk is first
+screened with the short 'risk_identification' prompt on a cheap, fast model, and only chunks rated
+at or above the escalation threshold get the full 'detailed_analysis' prompt on the stronger
+model. CascadeStats keeps the escalation rate and estimates the cost and LLM time the skipped
+detailed calls would have taken, from the tokens and latency of the calls that were made.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+
+
+def should_escalate(risk_level: Optional[str], threshold: str, order: Mapping[str, int]) -> bool:
+    """True if a screened risk level is at or above the threshold; unknown levels always escalate."""
+    if risk_level not in order:
+        return True
+    return order[risk_level] >= order[threshold]
+
+
+@dataclass
+class TierUsage:
+    """Calls, estimated tokens and summed call latency of one cascade tier."""
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    seconds: float = 0.0
+
+    def record(self, input_tokens: int, output_tokens: int, seconds: float) -> None:
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.seconds += seconds
+
+    def cost(self, price_per_million_tokens: float) -> float:
+        return (self.input_tokens + self.output_tokens) * price_per_million_tokens / 1_000_000
+
+    def describe(self, model_name: str, price_per_million_tokens: float) -> Dict[str, Any]:
+        return {
+            "model": model_name,
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "llm_seconds": round(self.seconds, 3),
+            "estimated_cost": round(self.cost(price_per_million_tokens), 6),
+        }
+
+
+class CascadeStats:
+    """
+    Running cascade statistics. Costs use the configured price per million tokens of each model;
+    the savings compare against sending every chunk to the escalation model, with the skipped
+    calls valued at the average output tokens and latency of the escalated calls.
+    """
+
+    def __init__(self, screening_model: str, escalation_model: str, screening_price: float,
+                 escalation_price: float, threshold: str, default_output_tokens: int):
+        self.screening_model = screening_model
+        self.escalation_model = escalation_model
+        self.screening_price = screening_price
+        self.escalation_price = escalation_price
+        self.threshold = threshold
+        self.default_output_tokens = default_output_tokens
+        self.screening = TierUsage()
+        self.escalation = TierUsage()
+        self.skipped_chunks = 0
+        self.skipped_input_tokens = 0 # Input tokens of the detailed prompts that were never sent
+
+    def record_screening(self, input_tokens: int, output_tokens: int, seconds: float) -> None:
+        self.screening.record(input_tokens, output_tokens, seconds)
+
+    def record_escalation(self, input_tokens: int, output_tokens: int, seconds: float) -> None:
+        self.escalation.record(input_tokens, output_tokens, seconds)
+
+    def record_skipped(self, detailed_input_tokens: int) -> None:
+        self.skipped_chunks += 1
+        self.skipped_input_tokens += detailed_input_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        screened = self.screening.calls
+        escalated = self.escalation.calls
+        if escalated:
+            mean_output_tokens = self.escalation.output_tokens / escalated
+            mean_seconds: Optional[float] = self.escalation.seconds / escalated
+        else:
+            mean_output_tokens, mean_seconds = self.default_output_tokens, None
+        skipped_cost = (self.skipped_input_tokens + self.skipped_chunks * mean_output_tokens) * self.escalation_price / 1_000_000
+        actual_cost = self.screening.cost(self.screening_price) + self.escalation.cost(self.escalation_price)
+        baseline_cost = self.escalation.cost(self.escalation_price) + skipped_cost
+        return {
+            "threshold": self.threshold,
+            "chunks_screened": screened,
+            "chunks_escalated": escalated,
+            "escalation_rate": round(escalated / screened, 4) if screened else None,
+            "screening": self.screening.describe(self.screening_model, self.screening_price),
+            "escalation": self.escalation.describe(self.escalation_model, self.escalation_price),
+            "estimated_cost": round(actual_cost, 6),
+            "estimated_baseline_cost": round(baseline_cost, 6),
+            "estimated_cost_saved": round(baseline_cost - actual_cost, 6),
+            # Summed over calls, not wall time: concurrent chunks overlap
+            "estimated_llm_seconds_saved": (
+                round(self.skipped_chunks * mean_seconds - self.screening.seconds, 3) if mean_seconds is not None else None
+            ),
+        }
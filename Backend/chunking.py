@@ -0,0 +1,222 @@
+# chunking.py
+
+"""
+Clause-aware chunking for long legal documents.
+
+Documents are first split into clauses on section/clause headings (e.g. "Section 7.2",
+"ARTICLE IV", "3.1", "Clause 4") and the clauses are then packed greedily into chunks that
+stay under a character budget, so every chunk handed to the LLM ends on a clause boundary.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Default chunk budget in characters (~3k tokens for typical English legal text).
+DEFAULT_MAX_CHUNK_CHARS = 12000
+
+# A clause heading at the start of a line: either a keyword heading ("Section 7.2", "ARTICLE IV",
+# "§ 12") or a bare outline number ("1.", "7.2", "3)") followed by heading text.
+CLAUSE_HEADING_PATTERN = re.compile(
+    r"^[ \t]*(?:"
+    r"(?:article|section|clause|schedule|exhibit|annex|§)[ \t]*(?P<keyword_label>[0-9]{1,3}(?:\.[0-9]{1,3})*[a-z]?|[ivxlc]{1,6})\b"
+    r"|(?P<number_label>[0-9]{1,3}(?:\.[0-9]{1,3})+|[0-9]{1,3}[.)])[ \t]+(?=\S)"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Fallback split points when a document has no recognisable headings or a clause is too long.
+PARAGRAPH_BREAK_PATTERN = re.compile(r"\n[ \t]*\n")
+SENTENCE_BREAK_PATTERN = re.compile(r"(?<=[.;:])\s+(?=[A-Z(\"'])")
+
+
+@dataclass
+class Clause:
+    """A single clause of a document, addressed by character offsets into the original text."""
+    label: Optional[str]
+    text: str
+    start: int
+    end: int
+
+
+@dataclass
+class Chunk:
+    """A run of consecutive clauses that fits within the chunk budget."""
+    index: int
+    text: str
+    start: int
+    end: int
+    clauses: List[Clause] = field(default_factory=list)
+
+
+def _normalize_label(raw_label: str) -> str:
+    return raw_label.rstrip(".)").upper()
+
+
+def _split_span(text: str, start: int, end: int, pattern: "re.Pattern") -> List[int]:
+    """Returns the offsets inside text[start:end] where pattern matches end (i.e. new pieces begin)."""
+    return [start + match.end() for match in pattern.finditer(text[start:end])]
+
+
+def _split_oversized(text: str, clause: Clause, max_chars: int) -> List[Clause]:
+    """
+    Splits a clause longer than max_chars on paragraph, then sentence boundaries.
+    Falls back to a hard cut only when a single sentence exceeds the budget.
+    """
+    pieces = [clause]
+    for pattern in (PARAGRAPH_BREAK_PATTERN, SENTENCE_BREAK_PATTERN, None):
+        if all(len(piece.text) <= max_chars for piece in pieces):
+            break
+        next_pieces = []
+        for piece in pieces:
+            if len(piece.text) <= max_chars:
+                next_pieces.append(piece)
+                continue
+            if pattern is None:
+                cuts = list(range(piece.start + max_chars, piece.end, max_chars))
+            else:
+                cuts = _split_span(text, piece.start, piece.end, pattern)
+            # Greedily merge the pieces between cut points back up to the budget.
+            boundaries = [piece.start] + cuts + [piece.end]
+            current_start = piece.start
+            previous = piece.start
+            for boundary in boundaries[1:]:
+                if boundary - current_start > max_chars and previous > current_start:
+                    next_pieces.append(Clause(piece.label, text[current_start:previous], current_start, previous))
+                    current_start = previous
+                previous = boundary
+            next_pieces.append(Clause(piece.label, text[current_start:piece.end], current_start, piece.end))
+        pieces = next_pieces
+    return pieces
+
+
+def split_into_clauses(text: str, max_chars: int = DEFAULT_MAX_CHUNK_CHARS) -> List[Clause]:
+    """
+    Splits a document into clauses on section/clause headings.
+    Text before the first heading (title, recitals, preamble) becomes an unlabeled clause.
+    Documents without headings are split on blank lines instead.
+    """
+    if not text.strip():
+        return []
+
+    headings = list(CLAUSE_HEADING_PATTERN.finditer(text))
+    if headings:
+        starts = [(match.start(), _normalize_label(match.group("keyword_label") or match.group("number_label")))
+                  for match in headings]
+    else:
+        starts = [(0, None)] + [(offset, None) for offset in _split_span(text, 0, len(text), PARAGRAPH_BREAK_PATTERN)]
+
+    if starts[0][0] > 0:
+        starts.insert(0, (0, None))
+
+    clauses = []
+    for position, (start, label) in enumerate(starts):
+        end = starts[position + 1][0] if position + 1 < len(starts) else len(text)
+        if not text[start:end].strip():
+            continue
+        clause = Clause(label, text[start:end], start, end)
+        if len(clause.text) > max_chars:
+            clauses.extend(_split_oversized(text, clause, max_chars))
+        else:
+            clauses.append(clause)
+    return clauses
+
+
+def pack_clauses(text: str, clauses: List[Clause], max_chars: int = DEFAULT_MAX_CHUNK_CHARS) -> List[Chunk]:
+    """Packs consecutive clauses greedily into chunks of at most max_chars characters."""
+    chunks: List[Chunk] = []
+    current: List[Clause] = []
+
+    def flush():
+        if current:
+            start, end = current[0].start, current[-1].end
+            chunks.append(Chunk(len(chunks), text[start:end], start, end, list(current)))
+            current.clear()
+
+    for clause in clauses:
+        # Only clauses that are contiguous in the source text can share a chunk.
+        contiguous = not current or current[-1].end == clause.start
+        if current and (not contiguous or clause.end - current[0].start > max_chars):
+            flush()
+        current.append(clause)
+    flush()
+    return chunks
+
+
+def split_into_chunks(text: str, max_chars: int = DEFAULT_MAX_CHUNK_CHARS) -> List[Chunk]:
+    """Splits a document into clause-aligned chunks of at most max_chars characters."""
+    return pack_clauses(text, split_into_clauses(text, max_chars), max_chars)
+
+
+class StreamingChunker:
+    """
+    Builds clause-aligned chunks incrementally from a stream of text segments (pages, paragraphs),
+    so analysis of the first chunks can start while the rest of the document is still being extracted.
+    Chunk offsets refer to the full document text, which is available as `text` once finished.
+    """
+
+    def __init__(self, max_chars: int = DEFAULT_MAX_CHUNK_CHARS):
+        self.max_chars = max_chars
+        self._parts: List[str] = []
+        # Segments after the last cut point, joined only when a cut is attempted
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._buffer_start = 0
+        self._next_cut_chars = 2 * max_chars
+        self._emitted = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, segment: str) -> List[Chunk]:
+        """Adds a segment and returns any chunks that can no longer grow."""
+        self._parts.append(segment)
+        self._pending.append(segment)
+        self._pending_chars += len(segment)
+        # Wait until the buffer holds at least one full chunk ahead of its tail.
+        if self._pending_chars < self._next_cut_chars:
+            return []
+        buffer = self._buffer()
+        clauses = split_into_clauses(buffer, self.max_chars)
+        # The last clause may still be growing, and the last chunk before it may still absorb it,
+        # so both stay buffered until more text arrives or finish() is called.
+        packed = pack_clauses(buffer, clauses[:-1], self.max_chars)
+        if len(packed) < 2:
+            # Nothing to cut yet: try again once the buffer has grown by half, so it isn't re-split on every segment.
+            self._next_cut_chars = self._pending_chars + max(self.max_chars, self._pending_chars // 2)
+            return []
+        ready = [self._shift(chunk) for chunk in packed[:-1]]
+        self._advance(self._buffer_start + packed[-1].start)
+        return self._emit(ready)
+
+    def finish(self) -> List[Chunk]:
+        """Flushes the remaining buffered text as chunks."""
+        buffer = self._buffer()
+        ready = [self._shift(chunk) for chunk in split_into_chunks(buffer, self.max_chars)]
+        self._advance(self._buffer_start + len(buffer))
+        return self._emit(ready)
+
+    def _buffer(self) -> str:
+        """The text after the last cut point."""
+        if len(self._pending) > 1:
+            self._pending = ["".join(self._pending)]
+        return self._pending[0] if self._pending else ""
+
+    def _shift(self, chunk: Chunk) -> Chunk:
+        offset = self._buffer_start
+        clauses = [Clause(clause.label, clause.text, clause.start + offset, clause.end + offset) for clause in chunk.clauses]
+        return Chunk(chunk.index, chunk.text, chunk.start + offset, chunk.end + offset, clauses)
+
+    def _advance(self, document_offset: int) -> None:
+        remainder = self._buffer()[document_offset - self._buffer_start:]
+        self._pending = [remainder] if remainder else []
+        self._pending_chars = len(remainder)
+        self._buffer_start = document_offset
+        self._next_cut_chars = 2 * self.max_chars
+
+    def _emit(self, chunks: List[Chunk]) -> List[Chunk]:
+        for chunk in chunks:
+            chunk.index = self._emitted
+            self._emitted += 1
+        return chunks
@@ -0,0 +1,109 @@
+# clause_graph.py
+
+"""
+Clause index and cross-reference graph of a document.
+
+Clauses are indexed by their section numbering, and every explicit reference between clauses
+("subject to Section 7.2", "notwithstanding Clause 4") becomes an edge. The pairwise prompts
+then only run on clause pairs that are actually connected, instead of on all O(n²) pairs.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from chunking import Clause
+from preanalysis import iter_clause_references
+
+# Relations that change what another clause means are analyzed first when pairs are capped.
+RELATION_PRIORITY = {"notwithstanding": 0, "except": 1, "subject_to": 2, "pursuant_to": 3, "references": 4}
+
+
+@dataclass
+class ClauseEdge:
+    """A reference from the `source` clause to the `target` clause (both clause labels)."""
+    source: str
+    target: str
+    relation: str
+    reference: str # The reference as written, e.g. "Section 7.2"
+    start: int
+    end: int
+
+
+@dataclass
+class ClauseGraph:
+    clauses: Dict[str, Clause]
+    edges: List[ClauseEdge] = field(default_factory=list)
+    dangling_references: int = 0 # References to clause numbers that don't exist in the document
+
+    def clause_text(self, label: str) -> str:
+        return self.clauses[label].text
+
+    def connected_pairs(self, max_pairs: Optional[int] = None) -> List[ClauseEdge]:
+        """One edge per connected (unordered) clause pair, strongest relations first."""
+        pairs: Dict[frozenset, ClauseEdge] = {}
+        for edge in self.edges:
+            key = frozenset((edge.source, edge.target))
+            current = pairs.get(key)
+            if current is None or RELATION_PRIORITY[edge.relation] < RELATION_PRIORITY[current.relation]:
+                pairs[key] = edge
+        ordered = sorted(pairs.values(), key=lambda edge: (RELATION_PRIORITY[edge.relation], edge.start))
+        return ordered if max_pairs is None else ordered[:max_pairs]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clauses": len(self.clauses),
+            "references": len(self.edges),
+            "connected_pairs": len(self.connected_pairs()),
+            "dangling_references": self.dangling_references,
+        }
+
+
+def index_clauses(clauses: List[Clause]) -> Dict[str, Clause]:
+    """
+    Maps clause labels to clauses. Pieces of an oversized clause (which share a label) are joined
+    back together; when numbering restarts (e.g. in a schedule), the first occurrence wins.
+    """
+    index: Dict[str, Clause] = {}
+    previous: Optional[Clause] = None
+    for clause in clauses:
+        if clause.label is None:
+            previous = None
+            continue
+        if previous is not None and previous.label == clause.label and previous.end == clause.start:
+            previous = Clause(clause.label, previous.text + clause.text, previous.start, clause.end)
+            index[clause.label] = previous
+        elif clause.label not in index:
+            previous = index[clause.label] = clause
+        else:
+            previous = None
+    return index
+
+
+def _resolve(index: Dict[str, Clause], label: str) -> Optional[str]:
+    """Finds the indexed clause for a reference, falling back to parent clauses ("7.2A" -> "7.2" -> "7")."""
+    candidate = label
+    while candidate:
+        if candidate in index:
+            return candidate
+        if candidate[-1].isalpha() and candidate[:-1] and candidate[-2].isdigit():
+            candidate = candidate[:-1]
+        elif "." in candidate:
+            candidate = candidate.rsplit(".", 1)[0]
+        else:
+            return None
+    return None
+
+
+def build_clause_graph(text: str, clauses: List[Clause]) -> ClauseGraph:
+    """Builds the clause index and reference graph of a document from its clauses (see chunking.split_into_clauses)."""
+    graph = ClauseGraph(index_clauses(clauses))
+    for reference in iter_clause_references(text):
+        if reference.source is None or reference.source not in graph.clauses:
+            continue
+        target = _resolve(graph.clauses, reference.target)
+        if target is None:
+            graph.dangling_references += 1
+        elif target != reference.source:
+            graph.edges.append(ClauseEdge(reference.source, target, reference.relation, reference.text,
+                                          reference.start, reference.end))
+    return graph
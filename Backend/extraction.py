@@ -0,0 +1,215 @@
+# extraction.py
+
+"""
+Off-event-loop text extraction for uploaded PDF and DOCX files.
+
+Parsing runs in a pool of worker processes so a large document never blocks the API event loop.
+Workers push extracted pages (PDF) or paragraphs (DOCX) back through a queue in small batches,
+so callers can start chunking and analyzing a document before extraction has finished.
+Each worker process has its address space capped, so a pathological file fails with a clear
+error instead of bloating the API process. Uploads spooled to disk are memory-mapped (PDF) or read
+in place (DOCX) by the worker rather than copied to it, the queue is bounded so a slow consumer applies back-pressure, and the
+extracted text per document can be capped.
+"""
+
+import asyncio
+import errno
+import io
+import logging
+import mmap
+import multiprocessing
+import queue
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Optional, Union
+
+try:
+    import resource # Unix only; the memory cap is skipped where it is unavailable
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be parsed."""
+
+
+class ExtractionMemoryError(ExtractionError):
+    """Raised when a worker exceeds its memory cap while parsing a document."""
+
+
+def file_kind(filename: str) -> Optional[str]:
+    """Returns 'pdf' or 'docx' for supported filenames, otherwise None."""
+    lowered = (filename or "").lower()
+    for extension in SUPPORTED_EXTENSIONS:
+        if lowered.endswith(extension):
+            return extension[1:]
+    return None
+
+
+def _limit_worker_memory(max_memory_bytes: int) -> None:
+    """Process pool initializer: caps the worker's address space."""
+    if resource is not None and max_memory_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+
+@contextmanager
+def _open_document(source: Union[bytes, str], mapped: bool = True) -> Iterator:
+    """
+    A seekable binary stream over the document: a memory map of a spooled file (or the open file
+    itself unless mapped), or the bytes themselves.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        yield io.BytesIO(source)
+        return
+    with open(source, "rb") as document_file:
+        if document_file.seek(0, io.SEEK_END) == 0:
+            yield io.BytesIO(b"") # Empty files can't be mapped
+            return
+        if not mapped:
+            document_file.seek(0)
+            yield document_file
+            return
+        with mmap.mmap(document_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            yield view
+
+
+def _put(output_queue, stop_event, item) -> bool:
+    """Puts on the bounded queue, giving up once the consumer has gone away."""
+    while not stop_event.is_set():
+        try:
+            output_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _extract_into_queue(kind: str, source: Union[bytes, str], output_queue, stop_event, batch_size: int,
+                        max_text_chars: Optional[int]) -> None:
+    """
+    Worker entry point: parses the document (bytes, or the path of a spooled upload) and puts
+    ('segments', [text, ...]) batches on the queue, followed by ('done', None) or
+    ('error', (error_type, message)).
+    """
+    try:
+        # zipfile (DOCX) needs seekable(), which mmap only has from Python 3.13; it reads members by offset anyway.
+        with _open_document(source, mapped=kind == "pdf") as stream:
+            batch = []
+            text_chars = 0
+            if kind == "pdf":
+                from PyPDF2 import PdfReader
+                segments = (page.extract_text() or "" for page in PdfReader(stream).pages)
+            else:
+                import docx
+                segments = (paragraph.text for paragraph in docx.Document(stream).paragraphs)
+            for segment in segments:
+                text_chars += len(segment) + 1
+                if max_text_chars is not None and text_chars > max_text_chars:
+                    _put(output_queue, stop_event, ("error", ("memory", f"Extracted text exceeds the limit of {max_text_chars} characters per document.")))
+                    return
+                batch.append(segment)
+                if len(batch) >= batch_size:
+                    if not _put(output_queue, stop_event, ("segments", batch)):
+                        return
+                    batch = []
+            if batch and not _put(output_queue, stop_event, ("segments", batch)):
+                return
+            _put(output_queue, stop_event, ("done", None))
+    except MemoryError:
+        _put(output_queue, stop_event, ("error", ("memory", "Document exceeded the extraction worker memory limit.")))
+    except OSError as e:
+        error_type = "memory" if e.errno == errno.ENOMEM else "parse"
+        _put(output_queue, stop_event, ("error", (error_type, f"{type(e).__name__}: {e}")))
+    except Exception as e:
+        _put(output_queue, stop_event, ("error", ("parse", f"{type(e).__name__}: {e}")))
+
+
+class TextExtractor:
+    """Streams document text out of a lazily started, memory-capped process pool."""
+
+    def __init__(self, max_workers: int = 2, max_memory_mb: int = 1024, batch_size: int = 4,
+                 poll_interval: float = 0.5, max_text_chars: Optional[int] = None, queue_batches: int = 16):
+        self.max_workers = max_workers
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_text_chars = max_text_chars
+        self.queue_batches = queue_batches # Batches a worker may get ahead of its consumer
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 'spawn' avoids forking the threaded API process; workers only import this module.
+            context = multiprocessing.get_context("spawn")
+            pool_kwargs = {"max_workers": self.max_workers, "mp_context": context,
+                           "initializer": _limit_worker_memory, "initargs": (self.max_memory_bytes,)}
+            if sys.version_info >= (3, 11):
+                # Recycle workers so fragmentation from one huge document doesn't stick around.
+                pool_kwargs["max_tasks_per_child"] = 50
+            manager = context.Manager()
+            self._pool = ProcessPoolExecutor(**pool_kwargs)
+            self._manager = manager
+        return self._pool
+
+    async def stream(self, filename: str, source: Union[bytes, str]) -> AsyncIterator[str]:
+        """
+        Yields the pages or paragraphs of a document as soon as a worker has extracted them.
+        source is the document's bytes or, to keep it out of memory, the path of a spooled upload.
+        """
+        kind = file_kind(filename)
+        if kind is None:
+            raise ExtractionError(f"Unsupported file type: {filename}")
+
+        loop = asyncio.get_running_loop()
+        pool = self._ensure_pool()
+        output_queue = self._manager.Queue(self.queue_batches)
+        stop_event = self._manager.Event()
+        future = loop.run_in_executor(pool, _extract_into_queue, kind, source, output_queue, stop_event,
+                                      self.batch_size, self.max_text_chars)
+
+        try:
+            while True:
+                try:
+                    message, payload = await loop.run_in_executor(None, output_queue.get, True, self.poll_interval)
+                except queue.Empty:
+                    # A worker killed outright (e.g. by the OS) never reports back, so watch the future too.
+                    if future.done():
+                        self._raise_worker_failure(future)
+                        raise ExtractionError("Extraction worker exited without producing a result.")
+                    continue
+                if message == "segments":
+                    for segment in payload:
+                        yield segment
+                elif message == "error":
+                    error_type, detail = payload
+                    raise (ExtractionMemoryError if error_type == "memory" else ExtractionError)(detail)
+                else:
+                    break
+            await future
+        finally:
+            # Lets a worker blocked on the full queue give up when the consumer stops early.
+            stop_event.set()
+
+    def _raise_worker_failure(self, future) -> None:
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            # The pool is unusable after a worker crash; start a fresh one on the next request.
+            self._pool = None
+            raise ExtractionMemoryError("Extraction worker crashed, most likely by exceeding its memory limit.")
+        if error is not None:
+            raise ExtractionError(str(error))
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
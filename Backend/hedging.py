@@ -0,0 +1,176 @@
+# hedging.py
+
+"""
+Tail-latency control for LLM calls.
+
+A few very slow provider responses dominate the p99 of an analysis, so a call that is still
+running longer than a high percentile of recent call latencies gets a duplicate ("hedged") request,
+and whichever answers first wins while the other is cancelled (hedged_call). LatencyTracker keeps
+the recent latencies the hedge delay is taken from, HedgeStats counts how often hedges fire and
+estimates the time they saved, and the number of hedges is capped at a share of all calls so a
+slow provider isn't hit with twice the load.
+
+CircuitBreaker stops sending calls to a model that keeps timing out or failing: after
+failure_threshold consecutive failures it opens and calls fail fast for reset_seconds, then a
+single probe call is let through and closes it again if it succeeds.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Sliding window of the latencies of recent successful calls, per key (model and prompt type)."""
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def keys(self) -> List[str]:
+        return list(self._samples)
+
+    def percentile(self, key: str, percentile: float) -> Optional[float]:
+        """The given percentile (0-100) of the key's recent latencies; None until min_samples are recorded."""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def expected_remaining(self, key: str, elapsed: float) -> float:
+        """
+        Expected remaining time of a call that has been running for `elapsed` seconds: the mean of the
+        recent latencies longer than that, minus elapsed (0 if none was that slow).
+        """
+        slower = [seconds for seconds in self._samples.get(key, ()) if seconds > elapsed]
+        return sum(slower) / len(slower) - elapsed if slower else 0.0
+
+
+class HedgeStats:
+    """Hedging counters and the share of calls hedges are allowed to take (budget)."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.seconds_saved = 0.0
+
+    def try_hedge(self) -> bool:
+        """Counts a hedge about to be fired, if the budget allows one."""
+        if self.hedged >= self.budget * self.calls:
+            return False
+        self.hedged += 1
+        return True
+
+    def record_win(self, seconds_saved: float) -> None:
+        self.hedge_wins += 1
+        self.seconds_saved += seconds_saved
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedges_fired": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "hedge_win_rate": round(self.hedge_wins / self.hedged, 4) if self.hedged else None,
+            "estimated_seconds_saved": round(self.seconds_saved, 3),
+            "budget": self.budget,
+        }
+
+
+async def hedged_call(call: Callable[[bool], Awaitable[T]], hedge_delay: Optional[float],
+                      try_hedge: Callable[[], bool]) -> Tuple[T, Optional[str]]:
+    """
+    Awaits call(False); if it hasn't finished after hedge_delay seconds (None: never hedge) and
+    try_hedge() agrees, starts the duplicate call(True) and returns the first successful result,
+    cancelling the other call. If one of them fails, the other is still waited for. Returns the result and the
+    hedge outcome: None (no hedge fired), 'primary' or 'hedge' (whichever won).
+    Cancelling the hedged call (e.g. on a deadline) cancels both calls.
+    """
+    primary = asyncio.ensure_future(call(False))
+    tasks = {primary: "primary"}
+    try:
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if not done and try_hedge():
+                tasks[asyncio.ensure_future(call(True))] = "hedge"
+        if len(tasks) == 1:
+            return await primary, None
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), tasks[task]
+                if error is None or tasks[task] == "primary":
+                    error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. States: 'closed' (calls flow), 'open' (calls fail fast
+    until reset_seconds have passed) and 'half_open' (one probe call is in flight; its outcome
+    closes or re-opens the circuit). A probe that never reports back (e.g. it was cancelled) is
+    replaced by a new one after another reset_seconds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.changed_at = 0.0 # When the circuit last opened or let a probe through
+        self.counters = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may be made now; in the open state, the first call after reset_seconds becomes the probe."""
+        if self.state == "closed":
+            return True
+        if time.monotonic() - self.changed_at >= self.reset_seconds:
+            self.state = "half_open"
+            self.changed_at = time.monotonic()
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def record_success(self) -> None:
+        self.counters["successes"] += 1
+        self.consecutive_failures = 0
+        self.state = "closed"
+
+    def record_failure(self) -> bool:
+        """Counts a failed call; returns True if this failure opened the circuit."""
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+            self.state = "open"
+            self.changed_at = time.monotonic()
+            self.counters["opened"] += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_seconds": (
+                round(max(0.0, self.reset_seconds - (time.monotonic() - self.changed_at)), 2) if self.state == "open" else 0.0
+            ),
+            **self.counters,
+        }
@@ -0,0 +1,132 @@
+# jobs.py
+
+"""
+Asynchronous analysis jobs.
+
+Submitting a job returns a job id immediately; a fixed pool of worker tasks picks jobs off a
+priority queue (interactive text before bulk uploads) and runs them in the background. The LLM
+calls a job makes inherit the job's priority, so the shared rate limiter also serves them in
+priority order. Finished jobs are kept for a bounded time so clients can poll for results.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from rate_limiter import llm_priority
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    priority: int
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Any = None
+    error: Optional[Dict[str, Any]] = None
+
+    def describe(self) -> Dict[str, Any]:
+        """Public view of the job, without its result payload."""
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "error": self.error,
+        }
+
+
+# A job body receives its Job (to report progress) and returns the job result.
+JobRunner = Callable[[Job], Awaitable[Any]]
+
+
+class JobScheduler:
+    """Runs submitted jobs on max_concurrent_jobs worker tasks, highest priority (lowest value) first."""
+
+    def __init__(self, max_concurrent_jobs: int = 4, max_retained_jobs: int = 1000,
+                 retention_seconds: float = 3600):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_retained_jobs = max_retained_jobs
+        self.retention_seconds = retention_seconds
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._sequence = itertools.count()
+        # Created on first use so they bind to the server's running event loop.
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+
+    def submit(self, kind: str, priority: int, runner: JobRunner) -> Job:
+        self._ensure_workers()
+        self._expire()
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, priority=priority)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait((priority, next(self._sequence), job, runner))
+        logger.info(f"Queued {kind} job {job.job_id} (priority {priority}, {self._queue.qsize()} queued)")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _ensure_workers(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.max_concurrent_jobs:
+            self._workers.append(asyncio.ensure_future(self._work()))
+
+    def _expire(self) -> None:
+        """Forgets finished jobs older than the retention period, and the oldest ones past max_retained_jobs."""
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            finished = job.status in (JOB_SUCCEEDED, JOB_FAILED)
+            if finished and (job.finished_at < cutoff or len(self._jobs) > self.max_retained_jobs):
+                del self._jobs[job_id]
+
+    async def _work(self) -> None:
+        while True:
+            _, _, job, runner = await self._queue.get()
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            # LLM calls made by this job queue behind higher-priority (interactive) calls.
+            token = llm_priority.set(job.priority)
+            try:
+                job.result = await runner(job)
+                job.status = JOB_SUCCEEDED
+            except HTTPException as e:
+                job.error = {"status_code": e.status_code, "detail": e.detail}
+                job.status = JOB_FAILED
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {e}", exc_info=True)
+                job.error = {"status_code": 500, "detail": f"Job failed: {e}"}
+                job.status = JOB_FAILED
+            finally:
+                llm_priority.reset(token)
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queued": self._queue.qsize() if self._queue else 0, "workers": len(self._workers), "jobs": counts}
@@ -0,0 +1,220 @@
+# llm_backends.py
+
+"""
+LLM backends behind a common interface.
+
+The API only needs "send a prompt, get JSON text back", so the model provider is hidden behind
+LLMBackend. GeminiBackend talks to Google Gemini; SimulatedBackend is a local stand-in for load
+tests and benchmarks that replays recorded responses or synthesizes schema-valid JSON, with
+configurable latency, jitter and error/429 rates. RecordingBackend wraps a real backend and
+records its responses for later replay.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from rate_limiter import estimate_tokens
+
+
+class LLMBackendError(Exception):
+    """Raised when the backend fails to produce a response."""
+
+
+class LLMRateLimitError(LLMBackendError):
+    """Raised when the provider rejects a call because the quota is exhausted (HTTP 429)."""
+
+
+class LLMRequestError(LLMBackendError):
+    """Raised when a call fails in a way retrying won't fix, e.g. the provider rejects the request as invalid."""
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    total_tokens: Optional[int] = None # Prompt plus output tokens, when the backend reports them
+
+
+class LLMBackend(ABC):
+    """Interface of LLM backends: turns a prompt into a JSON response."""
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, prompt: str, model_name: str) -> LLMResponse:
+        """
+        Sends the prompt to model_name. Raises LLMRateLimitError on a 429, LLMRequestError on failures
+        that retrying won't fix and LLMBackendError on other (transient) failures.
+        """
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str):
+        # Imported here so the simulated backend works without the Google SDK or credentials.
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+        from google.auth import exceptions as auth_exceptions
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._rate_limited = google_exceptions.TooManyRequests # Includes ResourceExhausted
+        # 5xx (including deadline exceeded and service unavailable), aborted calls, exhausted client retries
+        # and connection failures are worth retrying; anything else is a problem with the request itself.
+        self._transient = (google_exceptions.ServerError, google_exceptions.Aborted, google_exceptions.RetryError,
+                           auth_exceptions.TransportError, ConnectionError, asyncio.TimeoutError)
+        self._models: Dict[str, Any] = {}
+
+    def _model(self, model_name: str):
+        if model_name not in self._models:
+            self._models[model_name] = self._genai.GenerativeModel(model_name)
+        return self._models[model_name]
+
+    async def generate(self, prompt: str, model_name: str) -> LLMResponse:
+        try:
+            response = await self._model(model_name).generate_content_async(
+                prompt,
+                generation_config=self._genai.GenerationConfig(response_mime_type="application/json")
+            )
+            text = response.text # Raises ValueError when the response was blocked and has no text
+        except self._rate_limited as e:
+            raise LLMRateLimitError(str(e)) from e
+        except self._transient as e:
+            raise LLMBackendError(f"{type(e).__name__}: {e}") from e
+        except Exception as e:
+            raise LLMRequestError(f"{type(e).__name__}: {e}") from e
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(text, getattr(usage, "total_token_count", None))
+
+
+def prompt_digest(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+# Sample entries for every list field of the analysis schemas, used to synthesize responses.
+SYNTHETIC_LIST_ENTRIES = {
+    "inter_clause_dependencies": {"clause_id": "Section 2", "dependency_type": "modifies", "description": "Simulated dependency."},
+    "red_flags": {"type": "loophole", "description": "Simulated red flag."},
+    "compounding_risks": {"description": "Simulated compounding risk.", "clauses_involved": ["Section 1", "Section 2"]},
+    "structural_elements": {"type": "conditional_logic", "description": "Simulated structural element."},
+    "exception_clauses": {"clause_text": "unless otherwise agreed", "assessment": "Simulated assessment."},
+    "jurisdictional_risks": {"clause_text": "governing law", "jurisdictions": ["California", "Delaware"], "potential_divergence": "Simulated divergence."},
+    "vague_terms": {"term": "reasonable", "explanation": "Simulated vague term."},
+    "biased_language": {"phrase": "he", "suggestion": "they", "reason": "Simulated bias."},
+    "external_references": {"reference": "15 U.S.C. § 78j", "status": "clear", "context": "Simulated reference."},
+}
+RISK_LEVELS = ("High", "Medium", "Low", "Neutral")
+
+
+def synthesize_response(prompt: str) -> str:
+    """
+    Builds a deterministic, schema-valid JSON response for a prompt: every analysis key the prompt
+    asks for is filled in, and prose prompts (summaries, pairwise clauses) get a summary object.
+    """
+    rng = random.Random(prompt_digest(prompt))
+    requested = [key for key in SYNTHETIC_LIST_ENTRIES if f'"{key}"' in prompt or f"'{key}'" in prompt]
+    if "risk_level" not in prompt or not requested:
+        return json.dumps({"summary": f"Simulated response to a {len(prompt)}-character prompt."})
+    response: Dict[str, Any] = {
+        "risk_level": rng.choice(RISK_LEVELS),
+        "simplified_explanation": f"Simulated analysis of a {len(prompt)}-character prompt.",
+    }
+    for key in requested:
+        response[key] = [dict(SYNTHETIC_LIST_ENTRIES[key]) for _ in range(rng.randint(0, 2))]
+    return json.dumps(response)
+
+
+class SimulatedBackend(LLMBackend):
+    """
+    Local stand-in for a real LLM. Responses are replayed from a JSONL file of recorded
+    {"prompt_sha256", "response"} records when available, and synthesized otherwise.
+    Each call sleeps latency_ms plus an exponentially distributed jitter (mean jitter_ms), which
+    gives a realistic latency tail, and fails with the configured error and 429 rates.
+    With malformed_rate, that share of responses is damaged the way real model output sometimes
+    is (Markdown fences, a trailing comma, or cut off part-way), to exercise output repair.
+    """
+    name = "simulated"
+
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 400, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, replay_path: Optional[str] = None, seed: Optional[int] = None,
+                 malformed_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+        self._recorded: Dict[str, str] = {}
+        if replay_path and os.path.exists(replay_path):
+            with open(replay_path, encoding="utf-8") as replay_file:
+                for line in replay_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._recorded[record["prompt_sha256"]] = record["response"]
+        self.counters = {"calls": 0, "replayed": 0, "synthesized": 0, "errors": 0, "rate_limited": 0, "malformed": 0}
+
+    async def generate(self, prompt: str, model_name: str) -> LLMResponse:
+        self.counters["calls"] += 1
+        jitter = self._random.expovariate(1.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0
+        await asyncio.sleep((self.latency_ms + jitter) / 1000.0)
+
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            self.counters["rate_limited"] += 1
+            raise LLMRateLimitError("Simulated 429: quota exhausted")
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.counters["errors"] += 1
+            raise LLMBackendError("Simulated backend error")
+
+        text = self._recorded.get(prompt_digest(prompt))
+        if text is None:
+            text = synthesize_response(prompt)
+            self.counters["synthesized"] += 1
+        else:
+            self.counters["replayed"] += 1
+        if self._random.random() < self.malformed_rate:
+            self.counters["malformed"] += 1
+            text = self._damage(text)
+        return LLMResponse(text, estimate_tokens(prompt) + estimate_tokens(text))
+
+    def _damage(self, text: str) -> str:
+        defect = self._random.choice(("fence", "trailing_comma", "truncation"))
+        if defect == "fence":
+            return f"```json\n{text}\n```"
+        if defect == "trailing_comma" and text.endswith("}"):
+            return text[:-1] + ",}"
+        return text[:int(len(text) * self._random.uniform(0.5, 0.9))]
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls through to another backend and appends each response to a JSONL replay file."""
+
+    def __init__(self, backend: LLMBackend, record_path: str):
+        self.backend = backend
+        self.name = f"{backend.name}+recording"
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    async def generate(self, prompt: str, model_name: str) -> LLMResponse:
+        response = await self.backend.generate(prompt, model_name)
+        record = json.dumps({"prompt_sha256": prompt_digest(prompt), "model": model_name, "response": response.text})
+        with self._lock, open(self.record_path, "a", encoding="utf-8") as record_file:
+            record_file.write(record + "\n")
+        return response
+
+
+def create_llm_backend(kind: str, api_key: str, simulated_options: Optional[Dict[str, Any]] = None,
+                       record_path: Optional[str] = None) -> LLMBackend:
+    """Builds the configured backend: 'gemini' or 'simulated', optionally recording its responses."""
+    if kind == "gemini":
+        backend: LLMBackend = GeminiBackend(api_key)
+    elif kind == "simulated":
+        backend = SimulatedBackend(**(simulated_options or {}))
+    else:
+        raise ValueError(f"Unknown LLM backend: '{kind}'. Available backends are: gemini, simulated")
+    return RecordingBackend(backend, record_path) if record_path else backend
@@ -1,20 +1,59 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Header, Query
 from pydantic import BaseModel, ValidationError # Import ValidationError
 import re
 import os
-from typing import List, Dict, Any, Union # Import Union
+from typing import List, Dict, Any, Union, Optional, AsyncIterator, Tuple, Set # Import Union
 import logging
-import io # Added for file handling
-import google.generativeai as genai
 import json # JSON responses from LLM
-from PyPDF2 import PdfReader # For PDF processing
-import docx # For DOCX processing
+import asyncio # For concurrent chunk analysis
+import time
+import socket
 
 # Import CORSMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 
 # Import PROMPT_TEMPLATES from the new prompts.py file
 from prompts import PROMPT_TEMPLATES
+# Clause-aware chunking for long documents
+from chunking import split_into_clauses, pack_clauses, Chunk, Clause, StreamingChunker
+# Quota-aware LLM rate limiting and background analysis jobs
+from rate_limiter import LLMRateLimiter, PRIORITY_INTERACTIVE, PRIORITY_BULK, estimate_tokens, backoff_delay, run_blocking
+from jobs import JobScheduler, Job, JOB_SUCCEEDED, JOB_FAILED
+# Quota and in-flight calls shared between worker processes (or kept in this one)
+from shared_state import create_shared_state, RequestCoalescer
+# Off-event-loop PDF/DOCX text extraction
+from extraction import TextExtractor, ExtractionError, ExtractionMemoryError, file_kind
+# Content-addressed cache for LLM results
+from cache import ResultCache, make_cache_key, template_fingerprint
+# Document versions for incremental re-analysis
+from versioning import (DocumentVersionStore, DocumentVersion, StoredChunk, plan_reanalysis, clause_hash, drop_stale_cross_clause_entries,
+                        CROSS_CLAUSE_FIELDS, pair_key)
+# Pluggable LLM backends (Gemini, or a simulated stand-in for load tests)
+from llm_backends import create_llm_backend, LLMBackendError, LLMRateLimitError, LLMRequestError
+# Per-call deadlines, hedged requests and circuit breaking against slow or failing LLM calls
+from hedging import LatencyTracker, HedgeStats, CircuitBreaker, hedged_call
+# Per-stage latency histograms, request traces and the /metrics exposition
+from metrics import (registry, stage_timer, record_stage, TracingMiddleware, LLM_INPUT_TOKENS, LLM_OUTPUT_TOKENS, DOCUMENT_SIZE,
+                     PREPROCESSING_TOKENS_SAVED, LLM_OUTPUTS, CASCADE_CHUNKS, SIMILARITY_LOOKUPS, LLM_CALL_FAILURES, LLM_HEDGES,
+                     LLM_HEDGE_SECONDS_SAVED, LLM_CIRCUIT_EVENTS, LLM_FALLBACKS)
+# Size-limited, disk-spooled uploads and the memory budget for documents being analyzed
+from uploads import (spool_upload, SpooledUpload, UploadTooLargeError, MemoryBudget, RequestSizeLimitMiddleware,
+                     max_text_chars, MULTIPART_OVERHEAD_BYTES)
+# Strips running headers/footers, page numbers, hyphenation and whitespace before prompting
+from preprocessing import DocumentPreprocessor, preprocess_document, split_pages, map_result_offsets
+# Local (no LLM) detection of vague terms, biased language, citations and clause references
+from preanalysis import preanalyze, apply_local_findings, strip_local_findings, shift_offsets, RELATION_DEPENDENCY_TYPES
+# Clause reference graph that selects which clause pairs get the pairwise prompts
+from clause_graph import build_clause_graph, ClauseGraph, ClauseEdge
+# Repairs malformed LLM JSON and coerces near-miss fields before validation
+from output_parsing import OutputSchema, OutputRepairError, parse_json
+# Cheap screening pass that escalates only risky chunks to the detailed prompt
+from cascade import CascadeStats, should_escalate
+# MinHash/LSH index of analyzed chunks, for reusing the analysis of near-duplicate boilerplate
+from similarity import SimilarityIndex, SimilarMatch, minhash_signature
+# Persistent analysis store with inverted indexes over findings
+from analysis_store import AnalysisStore
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,7 +61,123 @@ logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 LLM_API_KEY = os.getenv("LLM_API_KEY", "YOUR_LLM_API_KEY_HERE")
-LLM_MODEL_NAME = "gemini-2.5-flash"
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gemini-2.5-flash")
+# 'gemini', or 'simulated' for load tests and benchmarks without spending quota
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+# Simulated backend: base latency, mean extra (exponential) latency, failure and malformed-output rates, optional replay file
+LLM_SIMULATED_LATENCY_MS = float(os.getenv("LLM_SIMULATED_LATENCY_MS", "800"))
+LLM_SIMULATED_JITTER_MS = float(os.getenv("LLM_SIMULATED_JITTER_MS", "400"))
+LLM_SIMULATED_ERROR_RATE = float(os.getenv("LLM_SIMULATED_ERROR_RATE", "0"))
+LLM_SIMULATED_RATE_LIMIT_RATE = float(os.getenv("LLM_SIMULATED_RATE_LIMIT_RATE", "0"))
+LLM_SIMULATED_MALFORMED_RATE = float(os.getenv("LLM_SIMULATED_MALFORMED_RATE", "0"))
+LLM_SIMULATED_REPLAY_PATH = os.getenv("LLM_SIMULATED_REPLAY_PATH")
+# If set, every LLM response is appended to this JSONL file (replayable by the simulated backend)
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH")
+# Long documents are split into clause-aligned chunks of at most this many characters
+MAX_CHUNK_CHARS = int(os.getenv("MAX_CHUNK_CHARS", "12000"))
+# Upper bound on concurrent LLM calls made while analyzing the chunks of a single document
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# How much of the original document is passed to the overall summary prompt as context
+SUMMARY_SNIPPET_CHARS = 2000
+
+# Result cache: bounded in-memory LRU plus an optional on-disk SQLite tier (set RESULT_CACHE_PATH="" to disable it)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3")
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Worker mode: 'local' keeps the LLM quota and in-flight call coalescing in this process; 'sqlite' shares them between
+# all workers on a host through SHARED_STATE_PATH (and has the result cache and similarity index files shared safely)
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "local")
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.sqlite3")
+# How long an in-flight LLM call holds its cache key before another worker may take it over (renewed while the call runs)
+COALESCE_LEASE_SECONDS = float(os.getenv("COALESCE_LEASE_SECONDS", "30"))
+# Number of analyzed document versions kept for incremental re-analysis when the analysis store is disabled
+DOCUMENT_VERSION_STORE_SIZE = int(os.getenv("DOCUMENT_VERSION_STORE_SIZE", "256"))
+# Persist every analyzed document version with its chunk results in SQLite, indexed for /analyses/query
+# (set ANALYSIS_STORE_PATH="" to keep it in memory only)
+ANALYSIS_STORE_ENABLED = os.getenv("ANALYSIS_STORE_ENABLED", "true").lower() == "true"
+ANALYSIS_STORE_PATH = os.getenv("ANALYSIS_STORE_PATH", "analysis_store.sqlite3")
+# Retention of the analysis store: the oldest documents past ANALYSIS_STORE_MAX_DOCUMENTS are deleted, and so are
+# documents older than ANALYSIS_STORE_TTL_SECONDS (0 keeps them until the size limit)
+ANALYSIS_STORE_MAX_DOCUMENTS = int(os.getenv("ANALYSIS_STORE_MAX_DOCUMENTS", "100000"))
+ANALYSIS_STORE_TTL_SECONDS = float(os.getenv("ANALYSIS_STORE_TTL_SECONDS", "0"))
+# Extraction process pool: number of workers, per-worker address space cap, and pages/paragraphs per message
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "2"))
+EXTRACTION_WORKER_MAX_MEMORY_MB = int(os.getenv("EXTRACTION_WORKER_MAX_MEMORY_MB", "1024"))
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "4"))
+# LLM quota: requests and tokens per minute the limiter paces calls to, plus retry policy for 429 responses
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_ESTIMATED_OUTPUT_TOKENS = int(os.getenv("LLM_ESTIMATED_OUTPUT_TOKENS", "1024"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "2"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+# Deadline of a single LLM call (including its hedge); calls that time out or fail upstream (5xx) are retried
+# LLM_ERROR_RETRIES times with jittered exponential back-off
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", "60"))
+LLM_ERROR_RETRIES = int(os.getenv("LLM_ERROR_RETRIES", "2"))
+LLM_ERROR_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_ERROR_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_ERROR_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_ERROR_BACKOFF_MAX_SECONDS", "8"))
+# Hedged requests: a call still running after the LLM_HEDGE_PERCENTILE latency of recent calls (per model and prompt
+# type, once LLM_HEDGE_MIN_SAMPLES are known) gets a duplicate request; at most LLM_HEDGE_BUDGET of all calls are hedged
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+# Circuit breaker: after LLM_CIRCUIT_FAILURE_THRESHOLD consecutive failed calls, a model's calls fail fast for LLM_CIRCUIT_RESET_SECONDS
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+# While the LLM is unavailable, chunks fall back to the most similar indexed analysis (down to
+# LLM_FALLBACK_SIMILARITY_THRESHOLD) or else to the local findings alone, instead of failing the request
+LLM_DEGRADED_FALLBACK = os.getenv("LLM_DEGRADED_FALLBACK", "true").lower() == "true"
+LLM_FALLBACK_SIMILARITY_THRESHOLD = float(os.getenv("LLM_FALLBACK_SIMILARITY_THRESHOLD", "0.6"))
+# Cascade mode for 'detailed_analysis': every chunk is screened with the short 'risk_identification' prompt on a
+# cheap model and only chunks rated CASCADE_ESCALATION_THRESHOLD or higher get the detailed prompt on the stronger model
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+CASCADE_SCREENING_MODEL = os.getenv("CASCADE_SCREENING_MODEL", "gemini-2.5-flash-lite")
+CASCADE_ESCALATION_MODEL = os.getenv("CASCADE_ESCALATION_MODEL", LLM_MODEL_NAME)
+CASCADE_ESCALATION_THRESHOLD = os.getenv("CASCADE_ESCALATION_THRESHOLD", "Medium")
+# Prices per million tokens, only used to estimate the cost saved by the cascade
+CASCADE_SCREENING_PRICE_PER_MTOK = float(os.getenv("CASCADE_SCREENING_PRICE_PER_MTOK", "0.1"))
+CASCADE_ESCALATION_PRICE_PER_MTOK = float(os.getenv("CASCADE_ESCALATION_PRICE_PER_MTOK", "0.3"))
+# Near-duplicate reuse: chunks whose estimated similarity to a previously analyzed chunk is at least SIMILARITY_THRESHOLD
+# reuse its analysis (set SIMILARITY_INDEX_PATH="" to keep the index in memory only)
+SIMILARITY_REUSE_ENABLED = os.getenv("SIMILARITY_REUSE_ENABLED", "true").lower() == "true"
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", "similarity_index.sqlite3")
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.9"))
+SIMILARITY_MAX_ENTRIES = int(os.getenv("SIMILARITY_MAX_ENTRIES", "50000"))
+# Optionally confirm a reuse with a cheap 'risk_identification' call: it is kept only if the risk level agrees
+SIMILARITY_VERIFY = os.getenv("SIMILARITY_VERIFY", "false").lower() == "true"
+SIMILARITY_VERIFY_MODEL = os.getenv("SIMILARITY_VERIFY_MODEL", CASCADE_SCREENING_MODEL)
+# Extra LLM calls (with strict output instructions) for a chunk whose output can't be repaired or validated
+LLM_OUTPUT_RETRIES = int(os.getenv("LLM_OUTPUT_RETRIES", "1"))
+# Background jobs: concurrently running jobs and how long finished jobs stay available for polling
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "4"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Find vague terms, biased language, external references and clause cross-references locally,
+# and only ask the LLM for the judgment-heavy fields of 'detailed_analysis'
+LOCAL_PREANALYSIS_ENABLED = os.getenv("LOCAL_PREANALYSIS_ENABLED", "true").lower() == "true"
+# Pairwise clause prompts, run only on clause pairs connected by an explicit reference (at most this many per document)
+PAIRWISE_ANALYSIS_ENABLED = os.getenv("PAIRWISE_ANALYSIS_ENABLED", "true").lower() == "true"
+PAIRWISE_MAX_PAIRS = int(os.getenv("PAIRWISE_MAX_PAIRS", "20"))
+# Token-reduction preprocessing of documents before prompting; streamed PDFs are chunked only after
+# this many pages have been read, since running headers and footers are learned from them
+PREPROCESSING_ENABLED = os.getenv("PREPROCESSING_ENABLED", "true").lower() == "true"
+PREPROCESSING_SAMPLE_PAGES = int(os.getenv("PREPROCESSING_SAMPLE_PAGES", "4"))
+# Uploads: per-file size limit (checked from Content-Length before the body is read, and again while the
+# file is spooled to UPLOAD_SPOOL_DIR) and the request body limit for all other endpoints (batches, JSON)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_MB", "200")) * 1024 * 1024
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+# Each upload reserves UPLOAD_REQUEST_MEMORY_MB of UPLOAD_MEMORY_BUDGET_MB while it is analyzed and its extracted
+# text is capped to fit, so at most budget // per-request uploads are in memory at once; the rest wait
+UPLOAD_MEMORY_BUDGET_BYTES = int(os.getenv("UPLOAD_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024
+UPLOAD_REQUEST_MEMORY_BYTES = int(os.getenv("UPLOAD_REQUEST_MEMORY_MB", "64")) * 1024 * 1024
+# Requests slower than this are logged with their per-stage timing breakdown
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "10"))
+# If set, the /admin endpoints require this value in the X-Admin-Key header
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
@@ -39,20 +194,36 @@ origins = [
     # Add other origins if your frontend might run on different ports/domains
 ]
 
+# Rejects oversized uploads before their body is read; added first so 413 responses still get CORS headers
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    default_limit=REQUEST_MAX_BYTES,
+    path_limits={path: UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES
+                 for path in ("/upload-and-analyze", "/upload-and-analyze/stream", "/jobs/upload-and-analyze")},
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, PUT, DELETE, OPTIONS, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Trace-Id", "Server-Timing"],  # Lets the frontend read the per-request trace id
 )
 
+# Trace id and Server-Timing header per request, plus request latency histograms
+app.add_middleware(TracingMiddleware, slow_request_seconds=SLOW_REQUEST_SECONDS)
+
 # --- Models for Request and Response ---
 
 # UPDATED: DocumentText now includes prompt_type
 class DocumentText(BaseModel):
     text: str
     prompt_type: str = "risk_identification" # Default value
+    previous_document_id: Optional[str] = None # Re-analyze only what changed since this earlier version
+    fast_mode: bool = False # Only run the local detectors (no LLM call)
+    drop_boilerplate: bool = False # Also drop blank signature fields and "signature page follows"/"exhibit to follow" lines
+    name: Optional[str] = None # Label stored with the analysis, e.g. the contract's title
 
 # This model matches the original 'risk_identification' output structure
 class RiskAnalysisResult(BaseModel):
@@ -61,19 +232,36 @@ class RiskAnalysisResult(BaseModel):
     inter_clause_dependencies: List[Dict[str, str]]
 
 # NEW: This model matches the 'detailed_analysis' output structure
+# Locally detected entries also carry integer 'start'/'end' offsets, hence Any for those fields.
 class DetailedAnalysisResult(BaseModel):
     risk_level: str
     simplified_explanation: str
-    inter_clause_dependencies: List[Dict[str, str]]
-    vague_terms: List[Dict[str, str]]
-    biased_language: List[Dict[str, str]]
+    inter_clause_dependencies: List[Dict[str, Any]]
+    vague_terms: List[Dict[str, Any]]
+    biased_language: List[Dict[str, Any]]
     red_flags: List[Dict[str, str]]
     compounding_risks: List[Dict[str, Any]]
     structural_elements: List[Dict[str, str]]
-    external_references: List[Dict[str, str]]
+    external_references: List[Dict[str, Any]]
     exception_clauses: List[Dict[str, str]]
     jurisdictional_risks: List[Dict[str, Any]] # Adjusted to Any for internal dict values
 
+# One document of a batch analysis request
+class BatchDocument(BaseModel):
+    name: Optional[str] = None # Caller-chosen label, echoed back in the results
+    text: str
+
+class BatchAnalysisRequest(BaseModel):
+    documents: List[BatchDocument]
+    prompt_type: str = "detailed_analysis"
+    include_summary: bool = False # One extra 'overall_summary' LLM call per multi-clause document
+    drop_boilerplate: bool = False # See DocumentText.drop_boilerplate
+
+# Request body for the cache invalidation admin endpoint
+class CacheInvalidationRequest(BaseModel):
+    prompt_type: Optional[str] = None # Limit invalidation to one prompt type (all types if omitted)
+    stale_only: bool = True # Only drop entries whose template no longer exists in PROMPT_TEMPLATES
+
 # The main response model for /analyze-document-text endpoint will be Dict[str, Any]
 # to allow for dynamic JSON outputs based on prompt_type.
 # Specific validation will happen inside the endpoint logic.
@@ -81,90 +269,1044 @@ class DetailedAnalysisResult(BaseModel):
 # if the output structures are somewhat distinct but manageable within a single union.
 
 # --- LLM and Prompt Configuration ---
-genai.configure(api_key=LLM_API_KEY)
-model = genai.GenerativeModel(LLM_MODEL_NAME)
+llm_backend = create_llm_backend(
+    LLM_BACKEND,
+    LLM_API_KEY,
+    simulated_options={
+        "latency_ms": LLM_SIMULATED_LATENCY_MS,
+        "jitter_ms": LLM_SIMULATED_JITTER_MS,
+        "error_rate": LLM_SIMULATED_ERROR_RATE,
+        "rate_limit_rate": LLM_SIMULATED_RATE_LIMIT_RATE,
+        "malformed_rate": LLM_SIMULATED_MALFORMED_RATE,
+        "replay_path": LLM_SIMULATED_REPLAY_PATH,
+    },
+    record_path=LLM_RECORD_PATH,
+)
+logger.info(f"Using LLM backend: {llm_backend.name}")
+
+# Quota buckets and in-flight call leases, kept in this process or shared by all workers on the host
+SHARED_WORKERS = SHARED_STATE_BACKEND != "local"
+llm_quota, llm_leases = create_shared_state(SHARED_STATE_BACKEND, SHARED_STATE_PATH, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+logger.info(f"Using shared state backend: {SHARED_STATE_BACKEND}")
+
+# Shared by every LLM call in this process (and, with shared state, every worker), so concurrent requests together stay within quota
+llm_rate_limiter = LLMRateLimiter(requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE, quota=llm_quota)
+
+# Identical LLM calls in flight at the same time are made once
+llm_coalescer = RequestCoalescer(llm_leases, owner=f"{socket.gethostname()}:{os.getpid()}", lease_seconds=COALESCE_LEASE_SECONDS)
+
+# Recent call latencies (for the hedge delay), hedge counters and one circuit breaker per model
+llm_latencies = LatencyTracker(min_samples=LLM_HEDGE_MIN_SAMPLES)
+hedge_stats = HedgeStats(budget=LLM_HEDGE_BUDGET)
+llm_circuits: Dict[str, CircuitBreaker] = {}
+
+# Background analysis jobs (submit, then poll for status/result)
+job_scheduler = JobScheduler(max_concurrent_jobs=JOB_MAX_CONCURRENCY, retention_seconds=JOB_RETENTION_SECONDS)
+
+# --- Result Cache ---
+result_cache = ResultCache(
+    memory_max_entries=RESULT_CACHE_MAX_ENTRIES,
+    disk_path=RESULT_CACHE_PATH or None,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    disk_max_bytes=RESULT_CACHE_MAX_BYTES,
+    shared=SHARED_WORKERS,
+) if RESULT_CACHE_ENABLED else None
+
+# Near-duplicate chunk index, persisted across requests and restarts
+similarity_index = SimilarityIndex(
+    SIMILARITY_INDEX_PATH or ":memory:",
+    threshold=SIMILARITY_THRESHOLD,
+    max_entries=SIMILARITY_MAX_ENTRIES,
+    shared=SHARED_WORKERS and bool(SIMILARITY_INDEX_PATH),
+) if SIMILARITY_REUSE_ENABLED else None
+
+# Maps each exact template string back to its prompt type, so cache entries can be tagged and invalidated per type.
+TEMPLATE_PROMPT_TYPES = {
+    template: prompt_type
+    for prompt_type, templates in PROMPT_TEMPLATES.items()
+    for template in templates
+}
+
+# PDF/DOCX parsing runs in worker processes so it never blocks the event loop
+text_extractor = TextExtractor(
+    max_workers=EXTRACTION_MAX_WORKERS,
+    max_memory_mb=EXTRACTION_WORKER_MAX_MEMORY_MB,
+    batch_size=EXTRACTION_BATCH_SIZE,
+    max_text_chars=max_text_chars(UPLOAD_REQUEST_MEMORY_BYTES),
+)
+
+# Memory reserved by in-flight uploads for their extracted documents
+upload_memory = MemoryBudget(UPLOAD_MEMORY_BUDGET_BYTES)
+
+@app.on_event("shutdown")
+def shutdown_text_extractor():
+    text_extractor.shutdown()
+
+# Reduced 'detailed_analysis' prompt whose missing fields are completed by the local pre-analysis
+LOCAL_PREANALYSIS_TEMPLATE = PROMPT_TEMPLATES["detailed_analysis"][1]
+
+def prompt_template_for(prompt_type: str) -> str:
+    """
+    Use the first prompt in the selected category, or the judgment-only detailed analysis prompt
+    when local pre-analysis is enabled.
+    For more granular control, you might need an index or sub-type in the future.
+    """
+    if prompt_type == "detailed_analysis" and LOCAL_PREANALYSIS_ENABLED:
+        return LOCAL_PREANALYSIS_TEMPLATE
+    return PROMPT_TEMPLATES[prompt_type][0]
+
+def current_template_fingerprints(prompt_type: Optional[str] = None) -> List[str]:
+    """Fingerprints of the templates currently in use (optionally for one prompt type), including their strict retry variants."""
+    return [
+        template_fingerprint(template)
+        for template, template_type in TEMPLATE_PROMPT_TYPES.items()
+        if prompt_type is None or template_type == prompt_type
+    ]
 
 # --- Helper Function for LLM Interaction ---
-async def generate_llm_response(prompt_template_str: str, chunk: str, **kwargs) -> str:
+class LLMUnavailableError(HTTPException):
+    """The LLM kept timing out or failing, or its circuit breaker is open."""
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=503, detail=detail)
+
+def circuit_for(model_name: str) -> CircuitBreaker:
+    if model_name not in llm_circuits:
+        llm_circuits[model_name] = CircuitBreaker(LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS)
+    return llm_circuits[model_name]
+
+async def generate_llm_response(prompt_template_str: str, chunk: str, model_name: Optional[str] = None, **kwargs) -> str:
     """
     Generates a response from the LLM based on a prompt template and a text chunk.
     Handles placeholder replacement and ensures JSON response mime type.
+    model_name defaults to LLM_MODEL_NAME (the cascade picks its screening and escalation models).
+    Responses that parse as JSON are cached on the normalized text, prompt type, template and model,
+    and concurrent identical calls (in this worker or, with shared state, any worker) are made once.
+    """
+    llm_output, _ = await generate_llm_response_with_source(prompt_template_str, chunk, model_name, **kwargs)
+    return llm_output
+
+async def generate_llm_response_with_source(prompt_template_str: str, chunk: str, model_name: Optional[str] = None,
+                                            **kwargs) -> Tuple[str, str]:
     """
-    formatted_prompt = prompt_template_str.replace("{{chunk}}", chunk)
+    generate_llm_response, also returning where the output came from: 'call' (an LLM call made for
+    this caller), 'cache', or 'local'/'remote' (an identical call of another request, see RequestCoalescer).
+    """
+    model_name = model_name or LLM_MODEL_NAME
+    prompt_type = TEMPLATE_PROMPT_TYPES.get(prompt_template_str, "custom")
+    if not result_cache:
+        return await call_llm(prompt_template_str, chunk, model_name, prompt_type, None, kwargs), "call"
+
+    cache_key = make_cache_key(chunk, prompt_type, prompt_template_str, model_name, kwargs)
+    with stage_timer("cache_lookup", prompt_type):
+        cached_output = await run_blocking(result_cache, result_cache.get, cache_key)
+    if cached_output is not None:
+        logger.info(f"Result cache hit for prompt_type: {prompt_type}")
+        return cached_output, "cache"
+    # Other callers wait for the first; callers in other workers read its output from the shared cache.
+    llm_output, source = await llm_coalescer.run(
+        cache_key,
+        lambda: call_llm(prompt_template_str, chunk, model_name, prompt_type, cache_key, kwargs),
+        lambda: run_blocking(result_cache, result_cache.peek, cache_key),
+    )
+    if source != "call":
+        logger.info(f"Coalesced with an identical in-flight LLM call ({source}) for prompt_type: {prompt_type}")
+    return llm_output, source
+
+async def call_llm(prompt_template_str: str, chunk: str, model_name: str, prompt_type: str,
+                   cache_key: Optional[str], kwargs: Dict[str, str]) -> str:
+    """Fills in the prompt and makes the LLM call for generate_llm_response, caching parseable output under cache_key."""
+    with stage_timer("prompt_render", prompt_type):
+        formatted_prompt = prompt_template_str.replace("{{chunk}}", chunk)
+
+        # Handle other specific placeholders if the chosen prompt uses them
+        for key, value in kwargs.items():
+            placeholder = f"{{{{{key}}}}}"
+            formatted_prompt = formatted_prompt.replace(placeholder, value)
+
+    # Every call is admitted by the shared quota limiter; 429s back off (with jitter) and are retried.
+    # Calls run under a deadline and are hedged when slow; timeouts and upstream errors are retried
+    # with back-off and counted by the model's circuit breaker, which fails fast while it is open.
+    input_tokens = estimate_tokens(formatted_prompt)
+    estimated_tokens = input_tokens + LLM_ESTIMATED_OUTPUT_TOKENS
+    circuit = circuit_for(model_name)
+    latency_key = f"{model_name}:{prompt_type}"
+
+    async def call_backend(hedge: bool) -> Tuple[Any, float]:
+        if hedge: # The duplicate is a real call, admitted against the quota like any other
+            with stage_timer("rate_limit_wait", prompt_type):
+                await llm_rate_limiter.acquire(estimated_tokens)
+        started = time.perf_counter()
+        with stage_timer("llm_call", prompt_type):
+            response = await llm_backend.generate(formatted_prompt, model_name)
+        return response, time.perf_counter() - started
 
-    # Handle other specific placeholders if the chosen prompt uses them
-    for key, value in kwargs.items():
-        placeholder = f"{{{{{key}}}}}"
-        formatted_prompt = formatted_prompt.replace(placeholder, value)
+    def start_hedge() -> bool:
+        if not hedge_stats.try_hedge():
+            return False
+        LLM_HEDGES.inc(model=model_name, outcome="fired")
+        return True
 
+    rate_limited_attempts = failed_attempts = 0
+    while True:
+        if not circuit.allow():
+            LLM_CIRCUIT_EVENTS.inc(model=model_name, event="rejected")
+            raise LLMUnavailableError(f"LLM '{model_name}' is unavailable after repeated failures, please retry later.")
+        with stage_timer("rate_limit_wait", prompt_type):
+            await llm_rate_limiter.acquire(estimated_tokens)
+        hedge_delay = llm_latencies.percentile(latency_key, LLM_HEDGE_PERCENTILE) if LLM_HEDGE_ENABLED else None
+        hedge_stats.calls += 1
+        started = time.perf_counter()
+        try:
+            (response, call_seconds), winner = await asyncio.wait_for(
+                hedged_call(call_backend, hedge_delay, start_hedge), LLM_CALL_TIMEOUT_SECONDS)
+        except LLMRateLimitError as e:
+            delay = backoff_delay(rate_limited_attempts, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS)
+            await llm_rate_limiter.penalize(delay)
+            if rate_limited_attempts == LLM_MAX_RETRIES:
+                logger.error(f"LLM quota still exhausted after {LLM_MAX_RETRIES} retries: {e}")
+                raise HTTPException(status_code=429, detail=f"LLM quota exhausted, please retry later: {e}")
+            rate_limited_attempts += 1
+            logger.warning(f"LLM rate limited (attempt {rate_limited_attempts}), backing off {delay:.1f}s: {e}")
+            continue
+        except LLMRequestError as e:
+            # Not retried, but still a failed call of this model for its circuit breaker.
+            LLM_CALL_FAILURES.inc(model=model_name, reason="rejected")
+            if circuit.record_failure():
+                LLM_CIRCUIT_EVENTS.inc(model=model_name, event="opened")
+                logger.error(f"Circuit opened for LLM '{model_name}' after {circuit.consecutive_failures} consecutive failed calls")
+            logger.error(f"LLM call rejected: {e}")
+            raise HTTPException(status_code=502, detail=f"LLM call failed: {e}")
+        except (LLMBackendError, asyncio.TimeoutError) as e:
+            reason = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            LLM_CALL_FAILURES.inc(model=model_name, reason=reason)
+            if circuit.record_failure():
+                LLM_CIRCUIT_EVENTS.inc(model=model_name, event="opened")
+                logger.error(f"Circuit opened for LLM '{model_name}' after {circuit.consecutive_failures} consecutive failed calls")
+            detail = f"timed out after {LLM_CALL_TIMEOUT_SECONDS:.0f}s" if reason == "timeout" else f"failed: {e}"
+            if failed_attempts == LLM_ERROR_RETRIES:
+                logger.error(f"LLM call {detail} ({LLM_ERROR_RETRIES} retries)")
+                raise LLMUnavailableError(f"LLM call {detail}")
+            delay = backoff_delay(failed_attempts, LLM_ERROR_BACKOFF_BASE_SECONDS, LLM_ERROR_BACKOFF_MAX_SECONDS)
+            failed_attempts += 1
+            logger.warning(f"LLM call {detail} (attempt {failed_attempts}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except Exception as e:
+            logger.error(f"LLM generation error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"LLM generation failed: {e}")
+
+        circuit.record_success()
+        llm_latencies.record(latency_key, call_seconds)
+        if winner == "hedge":
+            # The primary was cancelled unanswered; it would likely have taken as long as the recent calls slower than it.
+            saved = llm_latencies.expected_remaining(latency_key, time.perf_counter() - started)
+            hedge_stats.record_win(saved)
+            LLM_HEDGES.inc(model=model_name, outcome="hedge_won")
+            LLM_HEDGE_SECONDS_SAVED.inc(saved, model=model_name)
+        elif winner == "primary":
+            LLM_HEDGES.inc(model=model_name, outcome="primary_won")
+        llm_output = response.text
+        LLM_INPUT_TOKENS.observe(input_tokens, prompt_type=prompt_type)
+        LLM_OUTPUT_TOKENS.observe(estimate_tokens(llm_output), prompt_type=prompt_type)
+        await llm_rate_limiter.record_usage(estimated_tokens, response.total_tokens)
+        break
+
+    # Only cache parseable (or repairable) output, so a malformed response is retried on the next request.
+    if cache_key and _is_parseable(llm_output):
+        await run_blocking(result_cache, result_cache.set, cache_key, llm_output, prompt_type,
+                           template_fingerprint(prompt_template_str), model_name)
+    return llm_output
+
+def _is_parseable(text: str) -> bool:
+    try:
+        parse_json(text)
+        return True
+    except OutputRepairError:
+        return False
+
+async def forget_llm_response(prompt_template_str: str, chunk: str, model_name: Optional[str] = None):
+    """Drops a cached response that parsed but turned out to be unusable, so it isn't served again."""
+    if result_cache:
+        prompt_type = TEMPLATE_PROMPT_TYPES.get(prompt_template_str, "custom")
+        await run_blocking(result_cache, result_cache.discard,
+                           make_cache_key(chunk, prompt_type, prompt_template_str, model_name or LLM_MODEL_NAME, {}))
+
+# --- Chunked (Map-Reduce) Analysis ---
+
+# Prompt types whose output is a structured per-chunk analysis that can be merged across chunks.
+# Other prompt types (e.g., 'jargon_simplification', 'overall_summary') are sent as a single request.
+CHUNKED_PROMPT_TYPES = ("detailed_analysis", "risk_identification")
+
+# Used to pick the overall risk level of a document as the highest risk level among its chunks
+RISK_LEVEL_ORDER = {"Neutral": 0, "Low": 1, "Medium": 2, "High": 3}
+
+# Analyzed document versions, used to re-analyze only the changed clauses of a revised document. The analysis store
+# also persists them and indexes their findings for /analyses/query; otherwise only the latest are kept in memory.
+document_versions = AnalysisStore(
+    ANALYSIS_STORE_PATH or ":memory:",
+    risk_order=RISK_LEVEL_ORDER,
+    max_documents=ANALYSIS_STORE_MAX_DOCUMENTS,
+    ttl_seconds=ANALYSIS_STORE_TTL_SECONDS,
+) if ANALYSIS_STORE_ENABLED else DocumentVersionStore(max_documents=DOCUMENT_VERSION_STORE_SIZE)
+
+# Prebuilt parsing/validation for the prompt types with a result model; their strict variants are
+# the same templates with instructions appended that spell out the exact keys and types expected.
+OUTPUT_SCHEMAS = {
+    "detailed_analysis": OutputSchema(DetailedAnalysisResult, {"risk_level": tuple(RISK_LEVEL_ORDER)}),
+    "risk_identification": OutputSchema(RiskAnalysisResult, {"risk_level": tuple(RISK_LEVEL_ORDER)}),
+}
+STRICT_TEMPLATES = {
+    template: template + schema.strict_instructions(template)
+    for prompt_type, schema in OUTPUT_SCHEMAS.items()
+    for template in PROMPT_TEMPLATES[prompt_type]
+}
+TEMPLATE_PROMPT_TYPES.update({strict: TEMPLATE_PROMPT_TYPES[template] for template, strict in STRICT_TEMPLATES.items()})
+
+class ChunkOutputError(HTTPException):
+    """The LLM output for a chunk was unusable, even after repair and a retry with strict instructions."""
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=500, detail=detail)
+
+def validate_llm_output(prompt_type: str, parsed_llm_output: Any) -> Tuple[Any, List[str]]:
+    """
+    Validates parsed LLM output against the result model for the given prompt type, after coercing
+    near-miss fields (renamed keys, wrong case, single objects instead of lists, ...).
+    Returns the result and the coercions made; raises OutputRepairError if it still doesn't match.
+    Prompt types without a specific model are returned as raw parsed JSON.
+    """
+    schema = OUTPUT_SCHEMAS.get(prompt_type)
+    if schema is None:
+        # For other prompt types (e.g., 'jargon_simplification', 'overall_summary'),
+        # no specific Pydantic model is defined, so return the raw parsed JSON.
+        logger.info(f"Returning raw JSON for prompt_type: {prompt_type}")
+        return parsed_llm_output, []
+    return schema.validate(parsed_llm_output)
+
+async def analyze_chunk_on_model(prompt_type: str, prompt_template_str: str, chunk: str, offset: int = 0,
+                                 model_name: Optional[str] = None) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Runs a single chunk through the LLM (model_name, by default LLM_MODEL_NAME), then parses and validates the JSON output, repairing
+    malformed JSON and coercing near-miss fields where possible. Output that is still unusable is
+    retried (up to LLM_OUTPUT_RETRIES times) for this chunk alone, with the strict variant of the template.
+    Output of the judgment-only prompt is completed with the local pre-analysis findings,
+    whose offsets are shifted by `offset` (the chunk's position in the document).
+    Returns the result and its output status: {"status": "ok" | "repaired" | "retried", "repairs": [...]},
+    with "cached": True if no LLM call was made for it (cached or coalesced output).
+    """
+    schema = OUTPUT_SCHEMAS.get(prompt_type)
+    template = prompt_template_str
+    called = False
+    for attempt in range(LLM_OUTPUT_RETRIES + 1):
+        llm_output, source = await generate_llm_response_with_source(template, chunk, model_name)
+        called = called or source == "call"
+        logger.info(f"LLM raw output (first 500 chars): {llm_output[:500]}...")
+        try:
+            with stage_timer("json_parse", prompt_type):
+                parsed_llm_output, repairs = schema.parse(llm_output) if schema else parse_json(llm_output)
+            if prompt_template_str == LOCAL_PREANALYSIS_TEMPLATE and isinstance(parsed_llm_output, dict):
+                with stage_timer("local_preanalysis", prompt_type):
+                    parsed_llm_output = apply_local_findings(parsed_llm_output, chunk, offset)
+            with stage_timer("validation", prompt_type):
+                result, coercions = validate_llm_output(prompt_type, parsed_llm_output)
+        except OutputRepairError as e:
+            LLM_OUTPUTS.inc(prompt_type=prompt_type, outcome="unusable")
+            await forget_llm_response(template, chunk, model_name)
+            if attempt == LLM_OUTPUT_RETRIES or prompt_template_str not in STRICT_TEMPLATES:
+                logger.error(f"Unusable LLM output for '{prompt_type}' ({e}). Raw LLM output: {llm_output}")
+                raise ChunkOutputError(f"LLM output for '{prompt_type}' could not be used: {e}")
+            logger.warning(f"Unusable LLM output for '{prompt_type}' ({e}), retrying the chunk with strict instructions")
+            template = STRICT_TEMPLATES[prompt_template_str]
+            continue
+        status = "retried" if attempt else ("repaired" if repairs or coercions else "ok")
+        LLM_OUTPUTS.inc(prompt_type=prompt_type, outcome=status)
+        if not called:
+            return result, {"status": status, "repairs": repairs + coercions, "cached": True}
+        return result, {"status": status, "repairs": repairs + coercions}
+
+def uses_cascade(prompt_type: str, prompt_template_str: str) -> bool:
+    return CASCADE_ENABLED and prompt_type == "detailed_analysis" and prompt_template_str == prompt_template_for(prompt_type)
+
+def similarity_scope(prompt_type: str, prompt_template_str: str) -> str:
+    # Results of the cascade and of a single model are indexed separately.
+    cascaded = uses_cascade(prompt_type, prompt_template_str)
+    model_scope = f"cascade:{CASCADE_SCREENING_MODEL}>{CASCADE_ESCALATION_MODEL}" if cascaded else LLM_MODEL_NAME
+    return SimilarityIndex.scope(prompt_type, template_fingerprint(prompt_template_str), model_scope)
+
+async def analyze_chunk_with_status(prompt_type: str, prompt_template_str: str, chunk: str,
+                                    offset: int = 0) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Analyzes a single chunk and returns the result and its output status. Chunks of the chunked
+    prompt types reuse the analysis of a near-duplicate chunk from the similarity index when there
+    is one (see reuse_similar_analysis). In cascade mode, 'detailed_analysis' chunks are screened
+    first (see analyze_chunk_cascaded); everything else runs on LLM_MODEL_NAME.
+    If the LLM is unavailable, chunks of the chunked prompt types get a degraded result instead
+    (see degraded_chunk_analysis).
+    """
     try:
-        response = await model.generate_content_async(
-            formatted_prompt,
-            generation_config=genai.GenerationConfig(response_mime_type="application/json")
+        return await analyze_chunk_or_reuse(prompt_type, prompt_template_str, chunk, offset)
+    except LLMUnavailableError as e:
+        if not LLM_DEGRADED_FALLBACK or prompt_type not in CHUNKED_PROMPT_TYPES:
+            raise
+        return await degraded_chunk_analysis(prompt_type, prompt_template_str, chunk, offset, e.detail)
+
+async def analyze_chunk_or_reuse(prompt_type: str, prompt_template_str: str, chunk: str,
+                                 offset: int = 0) -> Tuple[Any, Dict[str, Any]]:
+    if similarity_index is None or prompt_type not in CHUNKED_PROMPT_TYPES or prompt_template_str != prompt_template_for(prompt_type):
+        return await analyze_chunk_fresh(prompt_type, prompt_template_str, chunk, offset)
+
+    scope = similarity_scope(prompt_type, prompt_template_str)
+    started = time.perf_counter()
+    signature, match = await run_blocking(similarity_index, find_similar_chunk, scope, chunk)
+    lookup_seconds = time.perf_counter() - started
+    record_stage("similarity_lookup", lookup_seconds, prompt_type)
+    if match is not None:
+        reused = await reuse_similar_analysis(prompt_type, chunk, offset, match)
+        outcome = "reused" if reused is not None else "rejected"
+        similarity_index.record_lookup(lookup_seconds, outcome)
+        SIMILARITY_LOOKUPS.inc(prompt_type=prompt_type, outcome=outcome)
+        if reused is not None:
+            return reused
+    else:
+        similarity_index.record_lookup(lookup_seconds, "miss")
+        SIMILARITY_LOOKUPS.inc(prompt_type=prompt_type, outcome="miss")
+
+    result, status = await analyze_chunk_fresh(prompt_type, prompt_template_str, chunk, offset)
+    # Only what the LLM found is stored; the local findings are recomputed for each chunk that reuses it.
+    await run_blocking(similarity_index, similarity_index.add, scope, signature, strip_local_findings(result))
+    return result, status
+
+def find_similar_chunk(scope: str, chunk: str, threshold: Optional[float] = None) -> Tuple[List[int], Optional[SimilarMatch]]:
+    """The chunk's MinHash signature and its most similar indexed chunk; blocking, see run_blocking."""
+    signature = minhash_signature(chunk)
+    return signature, similarity_index.find(scope, signature, threshold)
+
+async def analyze_chunk_fresh(prompt_type: str, prompt_template_str: str, chunk: str,
+                              offset: int = 0) -> Tuple[Any, Dict[str, Any]]:
+    """Analyzes a chunk with the LLM: through the cascade when it applies, otherwise on LLM_MODEL_NAME."""
+    if uses_cascade(prompt_type, prompt_template_str):
+        return await analyze_chunk_cascaded(chunk, offset)
+    return await analyze_chunk_on_model(prompt_type, prompt_template_str, chunk, offset)
+
+async def reuse_similar_analysis(prompt_type: str, chunk: str, offset: int,
+                                 match: SimilarMatch) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Builds a chunk's result from the stored analysis of a near-duplicate chunk, with the local
+    findings computed for this chunk's own text and offsets. With SIMILARITY_VERIFY, a cheap
+    'risk_identification' call on SIMILARITY_VERIFY_MODEL must agree on the risk level first;
+    returns None if it doesn't, so the chunk is analyzed normally.
+    """
+    if SIMILARITY_VERIFY:
+        try:
+            check, _ = await analyze_chunk_on_model("risk_identification", PROMPT_TEMPLATES["risk_identification"][0], chunk, offset,
+                                                    SIMILARITY_VERIFY_MODEL)
+        except ChunkOutputError:
+            check = None
+        if check is None or check["risk_level"] != match.result.get("risk_level"):
+            logger.info(f"Similar chunk {match.entry_id} ({match.similarity:.2f}) rejected by verification")
+            return None
+    logger.info(f"Reusing the analysis of similar chunk {match.entry_id} (similarity {match.similarity:.2f})")
+    return similar_result(prompt_type, chunk, offset, match), {"status": "similar", "similarity": round(match.similarity, 4), "repairs": []}
+
+def similar_result(prompt_type: str, chunk: str, offset: int, match: SimilarMatch) -> Dict[str, Any]:
+    """The stored analysis of a similar chunk, with the local findings of this chunk's own text."""
+    if prompt_type == "detailed_analysis" and (LOCAL_PREANALYSIS_ENABLED or CASCADE_ENABLED):
+        with stage_timer("local_preanalysis", prompt_type):
+            return apply_local_findings(match.result, chunk, offset)
+    return match.result
+
+async def degraded_chunk_analysis(prompt_type: str, prompt_template_str: str, chunk: str, offset: int,
+                            error: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Fallback for a chunk the LLM could not analyze: the analysis of the most similar indexed chunk
+    down to LLM_FALLBACK_SIMILARITY_THRESHOLD or, failing that, a result with risk level 'Unknown'
+    that only has the local findings. The status is 'degraded', with the fallback used.
+    (Cached responses are already served by generate_llm_response while the circuit is open.)
+    """
+    if similarity_index is not None and prompt_template_str == prompt_template_for(prompt_type):
+        _, match = await run_blocking(similarity_index, find_similar_chunk, similarity_scope(prompt_type, prompt_template_str),
+                                      chunk, LLM_FALLBACK_SIMILARITY_THRESHOLD)
+        if match is not None:
+            LLM_FALLBACKS.inc(prompt_type=prompt_type, fallback="similar")
+            return similar_result(prompt_type, chunk, offset, match), {
+                "status": "degraded", "fallback": "similar", "similarity": round(match.similarity, 4), "error": error}
+
+    LLM_FALLBACKS.inc(prompt_type=prompt_type, fallback="local")
+    findings = preanalyze(chunk, offset)
+    result = {
+        name: findings.get(name, []) if kind != "text" else ""
+        for name, kind in OUTPUT_SCHEMAS[prompt_type].field_kinds.items()
+    }
+    result["risk_level"] = "Unknown"
+    result["simplified_explanation"] = "This part could not be analyzed because the LLM is unavailable; only locally detected findings are shown."
+    return result, {"status": "degraded", "fallback": "local", "error": error}
+
+async def analyze_chunk(prompt_type: str, prompt_template_str: str, chunk: str, offset: int = 0) -> Dict[str, Any]:
+    """
+    Runs a single chunk through the LLM and returns the validated (possibly repaired) result.
+    See analyze_chunk_with_status.
+    """
+    result, _ = await analyze_chunk_with_status(prompt_type, prompt_template_str, chunk, offset)
+    return result
+
+async def analyze_chunk_with_limit(semaphore: asyncio.Semaphore, prompt_type: str, prompt_template_str: str,
+                                   chunk: Chunk) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Analyzes one chunk while holding the caller's semaphore, bounding concurrent LLM calls per document.
+    Returns the result and its output status, as analyze_chunk_with_status.
+    """
+    async with semaphore:
+        return await analyze_chunk_with_status(prompt_type, prompt_template_str, chunk.text, chunk.start)
+
+# --- Tiered Model Cascade ---
+
+if CASCADE_ESCALATION_THRESHOLD not in RISK_LEVEL_ORDER:
+    raise ValueError(f"Invalid CASCADE_ESCALATION_THRESHOLD: '{CASCADE_ESCALATION_THRESHOLD}'. Use one of: {', '.join(RISK_LEVEL_ORDER)}")
+
+CASCADE_SCREENING_TEMPLATE = PROMPT_TEMPLATES["risk_identification"][0]
+
+cascade_stats = CascadeStats(
+    screening_model=CASCADE_SCREENING_MODEL,
+    escalation_model=CASCADE_ESCALATION_MODEL,
+    screening_price=CASCADE_SCREENING_PRICE_PER_MTOK,
+    escalation_price=CASCADE_ESCALATION_PRICE_PER_MTOK,
+    threshold=CASCADE_ESCALATION_THRESHOLD,
+    default_output_tokens=LLM_ESTIMATED_OUTPUT_TOKENS,
+)
+
+async def analyze_chunk_cascaded(chunk: str, offset: int = 0) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Cascade mode for one 'detailed_analysis' chunk: screens it with the short 'risk_identification'
+    prompt on CASCADE_SCREENING_MODEL and, if it is rated CASCADE_ESCALATION_THRESHOLD or higher (or
+    the screening output is unusable), analyzes it with the detailed prompt on CASCADE_ESCALATION_MODEL.
+    A chunk that isn't escalated keeps its screening result, completed with the local detectors'
+    findings, in the detailed result shape. The output status records the 'tier' that produced it.
+    """
+    detailed_template = prompt_template_for("detailed_analysis")
+    started = time.perf_counter()
+    try:
+        screening, status = await analyze_chunk_on_model("risk_identification", CASCADE_SCREENING_TEMPLATE, chunk, offset,
+                                                         CASCADE_SCREENING_MODEL)
+    except ChunkOutputError as e:
+        logger.warning(f"Cascade screening output unusable, escalating the chunk: {e.detail}")
+        screening, status = None, None
+    # Only chunks screened by an actual LLM call count towards the cascade's costs and savings.
+    screened = status is not None and not status.get("cached")
+    if screened:
+        cascade_stats.record_screening(estimate_tokens(CASCADE_SCREENING_TEMPLATE) + estimate_tokens(chunk),
+                                       estimate_tokens(json.dumps(screening)), time.perf_counter() - started)
+
+    screened_level = screening["risk_level"] if screening else None
+    if screening is not None and not should_escalate(screened_level, CASCADE_ESCALATION_THRESHOLD, RISK_LEVEL_ORDER):
+        if screened:
+            cascade_stats.record_skipped(estimate_tokens(detailed_template) + estimate_tokens(chunk))
+        CASCADE_CHUNKS.inc(tier="screening")
+        with stage_timer("local_preanalysis", "detailed_analysis"):
+            completed = apply_local_findings(screening, chunk, offset)
+        result, _ = OUTPUT_SCHEMAS["detailed_analysis"].validate(completed) # Fills the detailed-only lists
+        return result, {**status, "tier": "screening"}
+
+    started = time.perf_counter()
+    result, status = await analyze_chunk_on_model("detailed_analysis", detailed_template, chunk, offset, CASCADE_ESCALATION_MODEL)
+    if not status.get("cached"):
+        cascade_stats.record_escalation(estimate_tokens(detailed_template) + estimate_tokens(chunk),
+                                        estimate_tokens(json.dumps(result)), time.perf_counter() - started)
+    CASCADE_CHUNKS.inc(tier="escalated")
+    return result, {**status, "tier": "escalated", "screened_risk_level": screened_level}
+
+def merge_chunk_results(chunk_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Reduce step: merges per-chunk analysis results into a single result of the same shape.
+    The document risk level is the highest chunk risk level, list fields are concatenated
+    (dropping exact duplicates) and the chunk explanations are joined as a fallback summary.
+    """
+    merged: Dict[str, Any] = {}
+    for key in chunk_results[0]:
+        if key == "risk_level":
+            merged[key] = max((result[key] for result in chunk_results), key=lambda level: RISK_LEVEL_ORDER.get(level, 0))
+        elif key == "simplified_explanation":
+            merged[key] = "\n\n".join(result[key] for result in chunk_results if result.get(key))
+        elif isinstance(chunk_results[0][key], list):
+            seen = set()
+            merged[key] = []
+            for result in chunk_results:
+                for item in result.get(key, []):
+                    fingerprint = json.dumps(item, sort_keys=True)
+                    if fingerprint not in seen:
+                        seen.add(fingerprint)
+                        merged[key].append(item)
+        else:
+            merged[key] = chunk_results[0][key]
+    return merged
+
+def _extract_summary_text(llm_output: str, keys: Tuple[str, ...] = ("summary", "overall_summary", "executive_summary")) -> str:
+    """
+    The summary (and pairwise clause) prompts ask for prose, but responses are requested as JSON.
+    Accepts a JSON string, an object with one of the given fields, or plain text.
+    """
+    try:
+        parsed = json.loads(llm_output)
+    except json.JSONDecodeError:
+        return llm_output.strip()
+    if isinstance(parsed, str):
+        return parsed
+    if isinstance(parsed, dict):
+        for key in keys:
+            if isinstance(parsed.get(key), str):
+                return parsed[key]
+        return "\n\n".join(value for value in parsed.values() if isinstance(value, str)) or llm_output
+    return llm_output
+
+async def summarize_chunk_results(chunk_results: List[Dict[str, Any]], document_text: str) -> str:
+    """
+    Feeds the per-chunk findings into the 'overall_summary' prompt to produce one document-level summary.
+    Falls back to the joined chunk explanations if the summary call fails.
+    """
+    summary_parts = "\n".join(
+        f"- Part {index + 1} (risk: {result.get('risk_level', 'Unknown')}): {result.get('simplified_explanation', '')}"
+        for index, result in enumerate(chunk_results)
+    )
+    try:
+        llm_output = await generate_llm_response(
+            PROMPT_TEMPLATES["overall_summary"][0],
+            "",
+            summary_parts=summary_parts,
+            raw_text_snippet=document_text[:SUMMARY_SNIPPET_CHARS],
         )
-        return response.text
+        return _extract_summary_text(llm_output)
+    except HTTPException as e:
+        logger.warning(f"Overall summary generation failed, using joined chunk explanations instead: {e.detail}")
+        return merge_chunk_results(chunk_results)["simplified_explanation"]
+
+# --- Pairwise Clause Analysis ---
+
+# risk_identification templates taking two clauses: how they depend on each other, and which is riskier
+CLAUSE_PAIR_DEPENDENCY_TEMPLATE = PROMPT_TEMPLATES["risk_identification"][2]
+CLAUSE_PAIR_COMPARISON_TEMPLATE = PROMPT_TEMPLATES["risk_identification"][8]
+PAIRWISE_TEXT_KEYS = ("explanation", "description", "analysis", "dependency", "comparison", "summary")
+
+async def analyze_clause_pair(semaphore: asyncio.Semaphore, graph: ClauseGraph, edge: ClauseEdge) -> Dict[str, Any]:
+    """
+    Runs both pairwise prompts on the clauses joined by an edge and returns an inter_clause_dependencies entry.
+    """
+    clause_a, clause_b = graph.clause_text(edge.source)[:MAX_CHUNK_CHARS], graph.clause_text(edge.target)[:MAX_CHUNK_CHARS]
+
+    async def call(template: str, **clauses) -> str:
+        async with semaphore:
+            return _extract_summary_text(await generate_llm_response(template, "", **clauses), PAIRWISE_TEXT_KEYS)
+
+    dependency, comparison = await asyncio.gather(
+        call(CLAUSE_PAIR_DEPENDENCY_TEMPLATE, clause_a_text=clause_a, clause_b_text=clause_b),
+        call(CLAUSE_PAIR_COMPARISON_TEMPLATE, clause_x_text=clause_a, clause_y_text=clause_b),
+    )
+    return {
+        "clause_id": edge.reference,
+        "related_clause_id": edge.source,
+        "dependency_type": RELATION_DEPENDENCY_TYPES[edge.relation],
+        "description": dependency,
+        "risk_comparison": comparison,
+        "start": edge.start,
+        "end": edge.end,
+    }
+
+def carried_over_pair(edge: ClauseEdge, previous_pairs: Dict[str, Dict[str, Any]],
+                      changed_labels: Set[str]) -> Optional[Dict[str, Any]]:
+    """
+    The previous version's entry for an edge's clause pair, moved to the edge's position, if neither
+    clause changed and the pair was analyzed in the same direction and relation; otherwise None.
+    """
+    previous_entry = previous_pairs.get(pair_key(edge.source, edge.target))
+    if (previous_entry is None or edge.source in changed_labels or edge.target in changed_labels
+            or previous_entry.get("related_clause_id") != edge.source
+            or previous_entry.get("dependency_type") != RELATION_DEPENDENCY_TYPES[edge.relation]):
+        return None
+    return {**previous_entry, "clause_id": edge.reference, "start": edge.start, "end": edge.end}
+
+async def analyze_connected_clause_pairs(document_text: str, clauses: List[Clause],
+                                         previous_pairs: Optional[Dict[str, Dict[str, Any]]] = None,
+                                         changed_labels: Optional[Set[str]] = None
+                                         ) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], Dict[str, int]]:
+    """
+    Builds the clause reference graph of a document and runs the pairwise prompts concurrently on
+    (at most PAIRWISE_MAX_PAIRS) connected clause pairs. A failing pair is logged and left out.
+    On re-analysis, pairs whose clauses are both unchanged (not in changed_labels) reuse their entry
+    from previous_pairs, the previous version's clause_pairs, so only pairs touching an edit cost LLM calls.
+    Returns the dependency entries, the entries by pair_key (to store with the version) and graph statistics.
+    """
+    graph = build_clause_graph(document_text, clauses)
+    pairs = graph.connected_pairs(PAIRWISE_MAX_PAIRS)
+    carried_over = {}
+    if previous_pairs:
+        for edge in pairs:
+            entry = carried_over_pair(edge, previous_pairs, changed_labels or set())
+            if entry is not None:
+                carried_over[pair_key(edge.source, edge.target)] = entry
+    fresh_pairs = [edge for edge in pairs if pair_key(edge.source, edge.target) not in carried_over]
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    outcomes = await asyncio.gather(*(analyze_clause_pair(semaphore, graph, edge) for edge in fresh_pairs), return_exceptions=True)
+
+    analyzed = {}
+    for edge, outcome in zip(fresh_pairs, outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Pairwise analysis of clauses {edge.source} and {edge.target} failed: {outcome}")
+        else:
+            analyzed[pair_key(edge.source, edge.target)] = outcome
+    entries_by_pair = {**carried_over, **analyzed}
+    entries = [entries_by_pair[key] for key in (pair_key(edge.source, edge.target) for edge in pairs) if key in entries_by_pair]
+    logger.info(f"Clause graph: {len(graph.clauses)} clauses, {len(graph.edges)} references, analyzed {len(analyzed)}/{len(fresh_pairs)} "
+                f"pairs, reused {len(carried_over)}")
+    return entries, entries_by_pair, {**graph.stats(), "pairs_analyzed": len(analyzed), "pairs_reused": len(carried_over)}
+
+# --- Progressive (Streaming) Analysis ---
+
+def chunk_event(start: int, end: int, result: Optional[Dict[str, Any]], total: Optional[int] = None, reused: bool = False,
+                status: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    A per-chunk progress event; 'start'/'end' locate the chunk in the document text. 'status' is the
+    chunk's output status ('ok', 'repaired', 'retried', or 'failed' with an 'error' and no result).
+    """
+    return {"event": "chunk", "start": start, "end": end, "total": total, "reused": reused,
+            "status": "ok", "result": result, **(status or {})}
+
+async def iterate_chunks(chunks: List[Chunk]) -> AsyncIterator[Chunk]:
+    for chunk in chunks:
+        yield chunk
+
+async def iter_chunk_analyses(chunk_source: AsyncIterator[Chunk], prompt_type: str,
+                              prompt_template_str: str) -> AsyncIterator[Tuple[Chunk, Optional[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    Map step for progressive output: starts analyzing each chunk as soon as chunk_source produces it
+    and yields (chunk, result, output status) in completion order, with at most LLM_MAX_CONCURRENCY
+    calls in flight. A chunk whose output is unusable even after its retry is yielded with no result
+    and a 'failed' status, so the other chunks' results are kept; any other error is raised.
+    """
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    completed: asyncio.Queue = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def analyze(chunk: Chunk):
+        try:
+            await completed.put((chunk, *await analyze_chunk_with_limit(semaphore, prompt_type, prompt_template_str, chunk), None))
+        except ChunkOutputError as e:
+            await completed.put((chunk, None, {"status": "failed", "error": e.detail}, None))
+        except Exception as e:
+            await completed.put((chunk, None, None, e))
+
+    async def produce():
+        async for chunk in chunk_source:
+            tasks.append(asyncio.ensure_future(analyze(chunk)))
+
+    producer = asyncio.ensure_future(produce())
+    yielded = 0
+    try:
+        while True:
+            if producer.done():
+                producer.result() # Re-raise errors from the chunk source (e.g. extraction failures)
+                if yielded == len(tasks):
+                    break
+                chunk, result, status, error = await completed.get()
+            else:
+                getter = asyncio.ensure_future(completed.get())
+                await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                chunk, result, status, error = getter.result()
+            if error is not None:
+                raise error
+            yielded += 1
+            yield chunk, result, status
+    finally:
+        # Don't leave LLM calls running for a request that has failed or been abandoned.
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+async def ndjson_stream(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Serializes analysis events as NDJSON lines; failures become a final 'error' event."""
+    try:
+        async for event in events:
+            yield json.dumps(event) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"event": "error", "status_code": e.status_code, "detail": e.detail}) + "\n"
     except Exception as e:
-        logger.error(f"LLM generation error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"LLM generation failed: {e}")
+        logger.error(f"An unexpected error occurred during streaming analysis: {e}", exc_info=True)
+        yield json.dumps({"event": "error", "status_code": 500, "detail": f"Analysis failed: {e}"}) + "\n"
+
+def ndjson_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    # X-Accel-Buffering stops reverse proxies (nginx) from holding back partial results.
+    return StreamingResponse(ndjson_stream(events), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Incremental Re-Analysis ---
+
+async def resolve_previous_version(doc_text: DocumentText) -> Optional[DocumentVersion]:
+    """Looks up the document version named by previous_document_id, if any."""
+    if not doc_text.previous_document_id:
+        return None
+    previous = await run_blocking(document_versions, document_versions.get, doc_text.previous_document_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail=f"Unknown previous_document_id: '{doc_text.previous_document_id}'")
+    if previous.prompt_type != doc_text.prompt_type:
+        raise HTTPException(status_code=400, detail=f"Previous document was analyzed with prompt_type '{previous.prompt_type}', not '{doc_text.prompt_type}'.")
+    return previous
+
+async def refresh_cross_clause_findings(prompt_type: str, prompt_template_str: str, chunk_text: str,
+                                        changed_clause_texts: List[str], fields: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Recomputes the cross-clause findings (the CROSS_CLAUSE_FIELDS among `fields`) between an
+    unchanged chunk and the changed clauses it refers to, by analyzing just that chunk and those
+    clauses. Dependencies alone need only the short 'risk_identification' prompt; compounding risks
+    come from the document's own prompt. Runs on the LLM directly (no near-duplicate reuse or
+    degraded fallback), so a failure raises.
+    """
+    context = "\n\n".join([chunk_text] + changed_clause_texts)[:MAX_CHUNK_CHARS]
+    fields = [field_name for field_name in CROSS_CLAUSE_FIELDS if field_name in fields]
+    if fields == ["inter_clause_dependencies"]:
+        prompt_type, prompt_template_str = "risk_identification", PROMPT_TEMPLATES["risk_identification"][0]
+    refreshed, _ = await analyze_chunk_on_model(prompt_type, prompt_template_str, context)
+    return {field_name: refreshed.get(field_name, []) for field_name in fields}
+
+async def stream_chunked_analysis(doc_text: DocumentText, prompt_template_str: str,
+                                  previous: Optional[DocumentVersion] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analyzes a document chunk by chunk, yielding a 'chunk' event per completed chunk and a final
+    'result' event with the merged analysis, which is also stored as a new document version.
+    When a previous version is given, chunks whose clauses are unchanged reuse the stored results;
+    only added or changed clauses are sent to the LLM, and cross-clause findings that referred to
+    changed clauses are recomputed.
+    """
+    with stage_timer("chunking", doc_text.prompt_type):
+        clauses = split_into_clauses(doc_text.text, MAX_CHUNK_CHARS)
+    if not clauses:
+        yield {"event": "result", "result": await analyze_chunk(doc_text.prompt_type, prompt_template_str, doc_text.text)}
+        return
+
+    # Each unit is (start offset, clauses, chunk text, result, output status) so results can be put back in document order.
+    units = []
+    if previous is None:
+        chunks = pack_clauses(doc_text.text, clauses, MAX_CHUNK_CHARS)
+        if len(chunks) == 1:
+            result, status = await analyze_chunk_with_status(doc_text.prompt_type, prompt_template_str, doc_text.text)
+            units.append((chunks[0].start, chunks[0].clauses, chunks[0].text, result, status))
+            yield chunk_event(chunks[0].start, chunks[0].end, result, total=1, status=status)
+        else:
+            logger.info(f"Split document into {len(chunks)} chunks (max {MAX_CHUNK_CHARS} chars each)")
+            async for chunk, result, status in iter_chunk_analyses(iterate_chunks(chunks), doc_text.prompt_type, prompt_template_str):
+                units.append((chunk.start, chunk.clauses, chunk.text, result, status))
+                yield chunk_event(chunk.start, chunk.end, result, total=len(chunks), status=status)
+        analysis_result = await finalize_chunked_analysis(doc_text.prompt_type, doc_text.text, units, name=doc_text.name)
+    else:
+        plan = plan_reanalysis(doc_text.text, clauses, previous, MAX_CHUNK_CHARS)
+        total = len(plan.reused) + len(plan.new_chunks)
+        logger.info(f"Incremental re-analysis of {previous.document_id}: reusing {len(plan.reused)} chunks, "
+                    f"analyzing {len(plan.new_chunks)} chunks, {len(plan.changed_clauses)} changed clauses")
+
+        # Drop cross-clause findings of reused chunks that touch changed clauses, then recompute just those links.
+        changed_texts = {clause.label: clause.text for clause in plan.changed_clauses if clause.label}
+        refreshed_units, refresh_calls = [], []
+        for reused in plan.reused:
+            result, stale_refs = drop_stale_cross_clause_entries(reused.stored.result, plan.changed_labels)
+            result = shift_offsets(result, reused.start - reused.stored.start) # The chunk may have moved
+            status = {"status": "reused"}
+            units.append((reused.start, reused.clauses, reused.stored.text, result, status))
+            yield chunk_event(reused.start, reused.clauses[-1].end, result, total=total, reused=True)
+            texts = [changed_texts[label] for label in sorted(stale_refs) if label in changed_texts]
+            if texts:
+                # Only the fields that lost entries are recomputed, so the others aren't duplicated.
+                stale_fields = [field_name for field_name in CROSS_CLAUSE_FIELDS
+                                if len(result.get(field_name, [])) < len(reused.stored.result.get(field_name, []))]
+                refreshed_units.append((result, status))
+                refresh_calls.append(refresh_cross_clause_findings(doc_text.prompt_type, prompt_template_str, reused.stored.text,
+                                                                   texts, stale_fields))
+
+        async for chunk, result, status in iter_chunk_analyses(iterate_chunks(plan.new_chunks), doc_text.prompt_type, prompt_template_str):
+            units.append((chunk.start, chunk.clauses, chunk.text, result, status))
+            yield chunk_event(chunk.start, chunk.end, result, total=total, status=status)
+
+        # A failed refresh keeps the chunk's trimmed result and is reported like a failed chunk (see finalize_chunked_analysis).
+        failed_refreshes = 0
+        for (result, status), findings in zip(refreshed_units, await asyncio.gather(*refresh_calls, return_exceptions=True)):
+            if isinstance(findings, BaseException):
+                logger.warning(f"Refreshing cross-clause findings failed: {findings!r}")
+                status["refresh_error"] = getattr(findings, "detail", None) or str(findings) or type(findings).__name__
+                failed_refreshes += 1
+                continue
+            for field_name, entries in findings.items():
+                result[field_name] = result.get(field_name, []) + entries
+
+        analysis_result = await finalize_chunked_analysis(doc_text.prompt_type, doc_text.text, units, previous.document_id,
+                                                          doc_text.name or previous.name, previous.clause_pairs, plan.changed_labels)
+        analysis_result["reanalysis"] = {
+            "previous_document_id": previous.document_id,
+            "reused_chunks": len(plan.reused),
+            "analyzed_chunks": len(plan.new_chunks),
+            "changed_clauses": len(plan.changed_clauses),
+            "refreshed_dependencies": len(refresh_calls) - failed_refreshes,
+            "failed_refreshes": failed_refreshes,
+        }
+
+    yield {"event": "result", "result": analysis_result}
+
+def incomplete_chunk(status: Dict[str, Any]) -> bool:
+    """Whether a chunk with a result is still incomplete: degraded, or reused without its refreshed cross-clause findings."""
+    return status.get("status") == "degraded" or "refresh_error" in status
+
+async def finalize_chunked_analysis(prompt_type: str, document_text: str, units: List[tuple],
+                                    previous_document_id: Optional[str] = None, name: Optional[str] = None,
+                                    previous_pairs: Optional[Dict[str, Dict[str, Any]]] = None,
+                                    changed_labels: Optional[Set[str]] = None) -> Dict[str, Any]:
+    """
+    Reduce step shared by all chunked paths: orders the (start, clauses, text, result, status) units,
+    merges and summarizes them, runs the pairwise prompts on clauses connected by explicit
+    references and stores the chunks and pair entries as a new document version. name labels the
+    stored version; on re-analysis, previous_pairs and changed_labels let unchanged clause pairs
+    keep their previous pairwise entries (see analyze_connected_clause_pairs).
+    Failed chunks are left out of the merge; the result is then marked 'partial' (as it is when some
+    chunks only have a degraded result, or reused chunks have a 'refresh_error' because their
+    cross-clause findings couldn't be recomputed), and 'chunk_status' lists every chunk's status.
+    Failed, degraded and unrefreshed chunks are stored without a result, so re-analyzing the
+    document with previous_document_id only sends those chunks to the LLM again.
+    """
+    units.sort(key=lambda unit: unit[0])
+    chunk_results = [unit[3] for unit in units if unit[3] is not None]
+    if not chunk_results:
+        raise ChunkOutputError(units[0][4]["error"])
+    if len(chunk_results) == 1:
+        analysis_result = dict(chunk_results[0])
+    else:
+        analysis_result = merge_chunk_results(chunk_results)
+        with stage_timer("summary", prompt_type):
+            analysis_result["simplified_explanation"] = await summarize_chunk_results(chunk_results, document_text)
+
+    clause_pairs = {}
+    if PAIRWISE_ANALYSIS_ENABLED:
+        # Pairwise results replace the mechanical entries found locally for the same references.
+        with stage_timer("pairwise_analysis", prompt_type):
+            pair_entries, clause_pairs, analysis_result["clause_graph"] = await analyze_connected_clause_pairs(
+                document_text, [clause for unit in units for clause in unit[1]], previous_pairs, changed_labels)
+        analyzed_spans = {(entry["start"], entry["end"]) for entry in pair_entries}
+        analysis_result["inter_clause_dependencies"] = [
+            entry for entry in analysis_result.get("inter_clause_dependencies", [])
+            if (entry.get("start"), entry.get("end")) not in analyzed_spans
+        ] + pair_entries
+
+    # Degraded and unrefreshed chunks are stored without a result too, so they get a full analysis on re-analysis.
+    stored_chunks = [
+        StoredChunk([clause_hash(clause) for clause in unit_clauses], [clause.label for clause in unit_clauses], text,
+                    None if incomplete_chunk(status) else result, start)
+        for start, unit_clauses, text, result, status in units
+    ]
+    analysis_result["document_id"] = await run_blocking(document_versions, document_versions.save,
+                                                        prompt_type, stored_chunks, previous_document_id, name, clause_pairs)
+    analysis_result["chunk_status"] = [
+        {"start": start, "end": unit_clauses[-1].end if unit_clauses else start + len(text), **status}
+        for start, unit_clauses, text, _, status in units
+    ]
+    analysis_result["partial"] = len(chunk_results) < len(units) or any(incomplete_chunk(unit[4]) for unit in units)
+    return analysis_result
+
+async def final_result(events: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Drains an analysis event stream and returns the payload of its final 'result' event."""
+    analysis_result = None
+    async for event in events:
+        if event["event"] == "result":
+            analysis_result = event["result"]
+    return analysis_result
+
+# --- Fast (Local) Analysis ---
+
+def local_analysis(text: str) -> Dict[str, Any]:
+    """
+    Fast mode: only the deterministic local detectors, no LLM call. Returns vague terms, biased
+    language, external references and clause cross-references with character offsets.
+    """
+    started = time.perf_counter()
+    result = {"mode": "fast", **preanalyze(text)}
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+# --- Token-Reduction Preprocessing ---
+
+def preprocessing_report(preprocessor: DocumentPreprocessor, source: str) -> Dict[str, Any]:
+    """Per-document preprocessing stats (characters and estimated tokens before/after, what was removed)."""
+    stats = preprocessor.stats()
+    PREPROCESSING_TOKENS_SAVED.inc(stats["tokens_saved"], source=source)
+    return stats
+
+async def map_events_to_original(events: AsyncIterator[Dict[str, Any]], preprocessor: DocumentPreprocessor,
+                                 source: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analysis runs on the preprocessed text; this maps the offsets of its events back to the original
+    text, so highlights line up with what the client sent or uploaded, and reports the tokens saved.
+    """
+    offset_map = preprocessor.offset_map
+    async for event in events:
+        if event["event"] == "chunk":
+            start, end = offset_map.span_to_original(event["start"], event["end"])
+            result = map_result_offsets(event["result"], offset_map) if event["result"] is not None else None
+            event = {**event, "start": start, "end": end, "result": result}
+        elif event["event"] == "result":
+            result = map_result_offsets(event["result"], offset_map)
+            result["preprocessing"] = preprocessing_report(preprocessor, source)
+            event = {**event, "result": result}
+        yield event
 
 # --- API Endpoints ---
 
-# UPDATED: response_model is now Dict[str, Any] for flexibility
-@app.post("/analyze-document-text", response_model=Dict[str, Any])
-async def analyze_document_text(doc_text: DocumentText):
+async def stream_text_analysis(doc_text: DocumentText, source: str = "text", segments: Optional[List[str]] = None,
+                         paged: bool = True) -> AsyncIterator[Dict[str, Any]]:
     """
-    Analyzes provided legal text based on the specified prompt type.
+    Validates a text analysis request and returns its event stream.
+    Request errors (bad prompt_type, unknown previous_document_id) are raised here, before any streaming starts.
+    The text is preprocessed first; pages are split on form feeds unless the extracted `segments`
+    (pages, or DOCX paragraphs with paged=False) are given.
     """
-    logger.info(f"Received request for text analysis. Prompt type: {doc_text.prompt_type}, Text length: {len(doc_text.text)}")
+    if doc_text.fast_mode:
+        DOCUMENT_SIZE.observe(len(doc_text.text), source=source, prompt_type="fast")
+        async def fast_analysis():
+            yield {"event": "result", "result": local_analysis(doc_text.text)}
+        return fast_analysis()
 
     if doc_text.prompt_type not in PROMPT_TEMPLATES:
         raise HTTPException(status_code=400, detail=f"Invalid prompt_type: '{doc_text.prompt_type}'. Available types are: {', '.join(PROMPT_TEMPLATES.keys())}")
 
-    # Use the first prompt in the selected category.
-    # For more granular control, you might need an index or sub-type in the future.
-    prompt_template_str = PROMPT_TEMPLATES[doc_text.prompt_type][0]
+    prompt_template_str = prompt_template_for(doc_text.prompt_type)
+    DOCUMENT_SIZE.observe(len(doc_text.text), source=source, prompt_type=doc_text.prompt_type)
+    previous = await resolve_previous_version(doc_text) if doc_text.prompt_type in CHUNKED_PROMPT_TYPES else None
 
-    try:
-        # Pass the text to the LLM helper.
-        # For prompts requiring more specific parameters (e.g., clause_a_text),
-        # you would need to add them to DocumentText model and pass them here.
-        # For 'detailed_analysis', only 'chunk' (doc_text.text) is used.
-        llm_output = await generate_llm_response(prompt_template_str, doc_text.text)
-        logger.info(f"LLM raw output (first 500 chars): {llm_output[:500]}...")
+    preprocessor = None
+    if PREPROCESSING_ENABLED:
+        with stage_timer("preprocessing", doc_text.prompt_type):
+            preprocessor = preprocess_document(segments if segments is not None else split_pages(doc_text.text),
+                                               paged, doc_text.drop_boilerplate)
+        doc_text = DocumentText(**{**doc_text.dict(), "text": preprocessor.text})
 
-        parsed_llm_output = json.loads(llm_output)
+    if doc_text.prompt_type in CHUNKED_PROMPT_TYPES:
+        events = stream_chunked_analysis(doc_text, prompt_template_str, previous)
+    else:
+        async def single_call_analysis():
+            # Unchunked prompt types are analyzed in a single LLM call.
+            # For prompts requiring more specific parameters (e.g., clause_a_text),
+            # you would need to add them to DocumentText model and pass them here.
+            yield {"event": "result", "result": await analyze_chunk(doc_text.prompt_type, prompt_template_str, doc_text.text)}
+        events = single_call_analysis()
+    return events if preprocessor is None else map_events_to_original(events, preprocessor, source)
 
-        # Validate and return the output based on prompt_type
-        if doc_text.prompt_type == "detailed_analysis":
-            try:
-                # Validate against the comprehensive DetailedAnalysisResult model
-                validated_output = DetailedAnalysisResult(**parsed_llm_output)
-                return validated_output.dict()
-            except ValidationError as e:
-                logger.error(f"Pydantic validation error for 'detailed_analysis' output: {e}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"LLM output for 'detailed_analysis' failed validation: {e.errors()}")
-        elif doc_text.prompt_type == "risk_identification":
-            try:
-                # Validate against the simpler RiskAnalysisResult model
-                validated_output = RiskAnalysisResult(**parsed_llm_output)
-                # You might want to add 'original_text_snippet' and 'color_code' here
-                # if you intend for all outputs to conform to a similar 'FullAnalysisResponse' structure.
-                # For now, it returns the direct RiskAnalysisResult dict.
-                return validated_output.dict()
-            except ValidationError as e:
-                logger.error(f"Pydantic validation error for 'risk_identification' output: {e}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"LLM output for 'risk_identification' failed validation: {e.errors()}")
-        # Add similar elif blocks for other prompt types (e.g., 'jargon_simplification', 'overall_summary')
-        # if they have specific Pydantic models or require custom processing.
-        else:
-            # For other prompt types, if no specific Pydantic model is defined,
-            # return the raw parsed JSON.
-            logger.info(f"Returning raw JSON for prompt_type: {doc_text.prompt_type}")
-            return parsed_llm_output
-
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decoding error from LLM. Raw LLM output: {llm_output}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"LLM did not return valid JSON: {e}")
+# UPDATED: response_model is now Dict[str, Any] for flexibility
+@app.post("/analyze-document-text", response_model=Dict[str, Any])
+async def analyze_document_text(doc_text: DocumentText):
+    """
+    Analyzes provided legal text based on the specified prompt type.
+    Long documents are split into clause-aligned chunks that are analyzed concurrently
+    and merged into a single result. Passing previous_document_id re-analyzes only the clauses
+    that changed since that version.
+    """
+    logger.info(f"Received request for text analysis. Prompt type: {doc_text.prompt_type}, Text length: {len(doc_text.text)}")
+
+    try:
+        return await final_result(await stream_text_analysis(doc_text))
     except HTTPException as e:
         # Re-raise FastAPI HTTPExceptions directly
         raise e
@@ -172,36 +1314,610 @@ async def analyze_document_text(doc_text: DocumentText):
         logger.error(f"An unexpected error occurred during analysis: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {e}")
 
+@app.post("/analyze-document-text/stream")
+async def analyze_document_text_stream(doc_text: DocumentText):
+    """
+    Streaming variant of /analyze-document-text. Emits NDJSON events: one 'chunk' event per analyzed
+    chunk (risk level, red flags, vague terms, ...) as soon as it completes, then a final 'result'
+    event with the merged analysis, or an 'error' event.
+    """
+    logger.info(f"Received streaming request for text analysis. Prompt type: {doc_text.prompt_type}, Text length: {len(doc_text.text)}")
+    return ndjson_response(await stream_text_analysis(doc_text))
+
+async def extract_document_segments(filename: str, source: Union[bytes, str], prompt_type: str) -> List[str]:
+    """
+    Extracts a whole uploaded file (its bytes or spooled path) in the extraction process pool, as its
+    pages (PDF) or paragraphs (DOCX), each ending in a newline; joined, they are the document text.
+    """
+    with stage_timer("extraction", prompt_type):
+        return [segment + "\n" async for segment in text_extractor.stream(filename, source)]
+
+def upload_preprocessor(filename: str, drop_boilerplate: bool) -> Optional[DocumentPreprocessor]:
+    """Incremental preprocessor for a streamed upload; running headers/footers only exist on PDF pages."""
+    if not PREPROCESSING_ENABLED:
+        return None
+    return DocumentPreprocessor(file_kind(filename) == "pdf", drop_boilerplate, PREPROCESSING_SAMPLE_PAGES)
+
+async def stream_uploaded_analysis(filename: str, source: Union[bytes, str], prompt_type: str,
+                                   preprocessor: Optional[DocumentPreprocessor] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Extracts a document in the extraction process pool and starts analyzing each chunk as soon as
+    its pages/paragraphs have been extracted, so extraction and LLM inference overlap.
+    With a preprocessor, chunks are cut from the preprocessed text and offsets refer to it.
+    """
+    prompt_template_str = prompt_template_for(prompt_type)
+    chunker = StreamingChunker(MAX_CHUNK_CHARS)
+
+    async def extracted_chunks():
+        # Only the waits for segments count as extraction time, not the time spent analyzing chunks in between.
+        segments = text_extractor.stream(filename, source).__aiter__()
+        extraction_seconds, preprocessing_seconds, extracted_chars, error = 0.0, 0.0, 0, None
+        try:
+            while True:
+                waited = time.perf_counter()
+                try:
+                    segment = await segments.__anext__() + "\n" # Use \n for newline
+                except StopAsyncIteration:
+                    break
+                finally:
+                    extraction_seconds += time.perf_counter() - waited
+                extracted_chars += len(segment)
+                if preprocessor is not None:
+                    started = time.perf_counter()
+                    segment = preprocessor.feed(segment)
+                    preprocessing_seconds += time.perf_counter() - started
+                for chunk in chunker.feed(segment):
+                    yield chunk
+        except ExtractionError as e:
+            error = e
+            raise
+        finally:
+            record_stage("extraction", extraction_seconds, prompt_type, error)
+        if preprocessor is not None:
+            started = time.perf_counter()
+            chunker.feed(preprocessor.finish())
+            record_stage("preprocessing", preprocessing_seconds + time.perf_counter() - started, prompt_type)
+        for chunk in chunker.finish():
+            yield chunk
+        DOCUMENT_SIZE.observe(extracted_chars, source="upload", prompt_type=prompt_type)
+
+    units = []
+    async for chunk, result, status in iter_chunk_analyses(extracted_chunks(), prompt_type, prompt_template_str):
+        units.append((chunk.start, chunk.clauses, chunk.text, result, status))
+        yield chunk_event(chunk.start, chunk.end, result, status=status)
+
+    if not units:
+        yield {"event": "result", "result": await analyze_chunk(prompt_type, prompt_template_str, chunker.text)}
+        return
+    logger.info(f"Analyzed {filename} as {len(units)} streamed chunks (max {MAX_CHUNK_CHARS} chars each)")
+    yield {"event": "result", "result": await finalize_chunked_analysis(prompt_type, chunker.text, units, name=filename)}
+
+async def analyze_spooled_upload(upload: SpooledUpload, previous_document_id: Optional[str], fast_mode: bool,
+                                 drop_boilerplate: bool) -> AsyncIterator[Dict[str, Any]]:
+    filename = upload.filename
+    if fast_mode:
+        extracted_text = "".join(await extract_document_segments(filename, upload.path, "fast"))
+        DOCUMENT_SIZE.observe(len(extracted_text), source="upload", prompt_type="fast")
+        yield {"event": "result", "result": local_analysis(extracted_text)}
+        return
+
+    # For file uploads, automatically use the 'detailed_analysis' prompt type.
+    # You could add a query parameter to allow the user to select this from the UI/request.
+    if previous_document_id:
+        # Incremental re-analysis diffs against the whole new version, so extract it fully first.
+        segments = await extract_document_segments(filename, upload.path, "detailed_analysis")
+        document_for_analysis = DocumentText(text="".join(segments), prompt_type="detailed_analysis",
+                                             previous_document_id=previous_document_id, drop_boilerplate=drop_boilerplate,
+                                             name=filename)
+        events = await stream_text_analysis(document_for_analysis, "upload", segments, paged=file_kind(filename) == "pdf")
+    else:
+        preprocessor = upload_preprocessor(filename, drop_boilerplate)
+        events = stream_uploaded_analysis(filename, upload.path, "detailed_analysis", preprocessor)
+        if preprocessor is not None:
+            events = map_events_to_original(events, preprocessor, "upload")
+    async for event in events:
+        yield event
+
+async def stream_upload_analysis(upload: SpooledUpload, previous_document_id: Optional[str],
+                                 fast_mode: bool = False, drop_boilerplate: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Event stream for an uploaded file. The analysis waits for its share of the upload memory budget,
+    the result reports the upload's size and memory reservation, and the spooled file is deleted at
+    the end. Extraction failures are translated into HTTP errors (413 when the worker memory cap or
+    the per-request text cap is hit, 422 for unparseable files).
+    """
+    filename = upload.filename
+    try:
+        logger.info(f"Processing {file_kind(filename).upper()} file: {filename} ({upload.size} bytes)")
+        async with upload_memory.reserve(UPLOAD_REQUEST_MEMORY_BYTES) as waited_seconds:
+            record_stage("memory_wait", waited_seconds, "fast" if fast_mode else "detailed_analysis")
+            async for event in analyze_spooled_upload(upload, previous_document_id, fast_mode, drop_boilerplate):
+                if event["event"] == "result":
+                    event["result"]["upload"] = {
+                        "bytes": upload.size,
+                        "memory_reserved_bytes": min(UPLOAD_REQUEST_MEMORY_BYTES, UPLOAD_MEMORY_BUDGET_BYTES),
+                        "memory_wait_ms": round(waited_seconds * 1000, 1),
+                    }
+                yield event
+
+    except ExtractionMemoryError as e:
+        logger.error(f"Extraction of {filename} exceeded the worker memory limit: {e}")
+        raise HTTPException(status_code=413, detail=f"Document is too large to extract: {e}")
+    except ExtractionError as e:
+        logger.error(f"Error extracting text from {filename}: {e}")
+        raise HTTPException(status_code=422, detail=f"Failed to extract text from file: {e}")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error processing uploaded file: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
+    finally:
+        upload.remove()
+
+async def check_upload(file: UploadFile, previous_document_id: Optional[str]):
+    if file_kind(file.filename) is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF or DOCX.")
+    if previous_document_id:
+        await resolve_previous_version(DocumentText(text="", prompt_type="detailed_analysis", previous_document_id=previous_document_id))
+
+async def receive_upload(file: UploadFile) -> SpooledUpload:
+    """Copies an uploaded file to a temp file in small blocks; files over UPLOAD_MAX_MB are rejected with 413."""
+    try:
+        with stage_timer("upload_read"):
+            return await spool_upload(file, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_DIR)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
 # UPDATED: response_model is now Dict[str, Any] for consistency with /analyze-document-text
 @app.post("/upload-and-analyze", response_model=Dict[str, Any])
-async def upload_and_analyze_document(file: UploadFile = File(...)):
+async def upload_and_analyze_document(file: UploadFile = File(...), previous_document_id: Optional[str] = Form(None),
+                                      fast_mode: bool = Form(False), drop_boilerplate: bool = Form(False)):
     """
     Receives a document file (PDF or DOCX), extracts text, and performs analysis.
     Defaults to 'detailed_analysis' for file uploads.
+    Pass previous_document_id to re-analyze only what changed since an earlier version,
+    or fast_mode=true to only run the local detectors. drop_boilerplate=true also drops blank signature
+    fields and placeholder lines ("signature page follows") during preprocessing.
+    Extraction runs in a separate process pool and chunks are analyzed while later pages are still being extracted.
     """
-    extracted_text = ""
-    try:
-        file_content = await file.read()
-        if file.filename.endswith(".pdf"):
-            logger.info(f"Processing PDF file: {file.filename}")
-            reader = PdfReader(io.BytesIO(file_content))
-            for page in reader.pages:
-                extracted_text += page.extract_text() + "\n" # Use \n for newline
-        elif file.filename.endswith(".docx"):
-            logger.info(f"Processing DOCX file: {file.filename}")
-            document = docx.Document(io.BytesIO(file_content))
-            for paragraph in document.paragraphs:
-                extracted_text += paragraph.text + "\n" # Use \n for newline
+    await check_upload(file, previous_document_id)
+    upload = await receive_upload(file)
+    return await final_result(stream_upload_analysis(upload, previous_document_id, fast_mode, drop_boilerplate))
+
+@app.post("/upload-and-analyze/stream")
+async def upload_and_analyze_document_stream(file: UploadFile = File(...), previous_document_id: Optional[str] = Form(None),
+                                             fast_mode: bool = Form(False), drop_boilerplate: bool = Form(False)):
+    """
+    Streaming variant of /upload-and-analyze, emitting the same NDJSON events as /analyze-document-text/stream.
+    """
+    await check_upload(file, previous_document_id)
+    upload = await receive_upload(file)
+    return ndjson_response(stream_upload_analysis(upload, previous_document_id, fast_mode, drop_boilerplate))
+
+# --- Background Job Endpoints ---
+
+async def run_analysis_job(job: Job, events: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Drains an analysis event stream inside a job, recording chunk progress for status polling."""
+    job.progress = {"chunks_completed": 0, "total_chunks": None}
+    analysis_result = None
+    async for event in events:
+        if event["event"] == "chunk":
+            job.progress["chunks_completed"] += 1
+            job.progress["total_chunks"] = event["total"]
+        elif event["event"] == "result":
+            analysis_result = event["result"]
+    return analysis_result
+
+def job_submission(job: Job) -> Dict[str, Any]:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.job_id}",
+        "result_url": f"/jobs/{job.job_id}/result",
+    }
+
+@app.post("/jobs/analyze-document-text", response_model=Dict[str, Any], status_code=202)
+async def submit_text_analysis_job(doc_text: DocumentText):
+    """
+    Queues a text analysis as a background job at interactive priority and returns its job id right away.
+    """
+    events = await stream_text_analysis(doc_text) # Validates the request before it is queued
+    job = job_scheduler.submit("analyze-document-text", PRIORITY_INTERACTIVE, lambda job: run_analysis_job(job, events))
+    return job_submission(job)
+
+@app.post("/jobs/upload-and-analyze", response_model=Dict[str, Any], status_code=202)
+async def submit_upload_analysis_job(file: UploadFile = File(...), previous_document_id: Optional[str] = Form(None),
+                                     fast_mode: bool = Form(False), drop_boilerplate: bool = Form(False)):
+    """
+    Queues a document upload analysis as a background job at bulk priority and returns its job id right away.
+    """
+    await check_upload(file, previous_document_id)
+    # The upload is spooled now, since the request (and its file) is gone by the time the job runs.
+    events = stream_upload_analysis(await receive_upload(file), previous_document_id, fast_mode, drop_boilerplate)
+    job = job_scheduler.submit("upload-and-analyze", PRIORITY_BULK, lambda job: run_analysis_job(job, events))
+    return job_submission(job)
+
+@app.get("/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_job_status(job_id: str):
+    """
+    Returns the status and progress of a background job.
+    """
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id: '{job_id}'")
+    return job.describe()
+
+@app.get("/jobs/{job_id}/result", response_model=Dict[str, Any])
+async def get_job_result(job_id: str):
+    """
+    Returns the result of a finished job. Unfinished jobs answer 202 with their status;
+    failed jobs answer with the error status code the analysis failed with.
+    """
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id: '{job_id}'")
+    if job.status == JOB_SUCCEEDED:
+        return job.result
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=job.error["status_code"], detail=job.error["detail"])
+    return JSONResponse(status_code=202, content=job.describe())
+
+# --- Batch Analysis ---
+
+async def run_batch_analysis(job: Job, prompt_type: str, documents: List[Dict[str, Any]], include_summary: bool,
+                             drop_boilerplate: bool = False) -> Dict[str, Any]:
+    """
+    Analyzes many documents at once. Every document is split into clauses and identical clauses
+    (after whitespace normalization) are analyzed only once across the whole batch; each clause
+    result then fans back out to every document containing it. A failing clause or document only
+    affects the documents it belongs to, which are reported as 'partial' or 'failed'.
+    Each document is a dict with 'name' and either 'text' or, for uploads, 'filename' and the spooled 'upload'.
+    """
+    started = time.monotonic()
+    prompt_template_str = prompt_template_for(prompt_type)
+    job.progress = {"documents": len(documents), "documents_extracted": 0, "unique_clauses": None, "clauses_completed": 0}
+
+    async def extract(document: Dict[str, Any]):
+        if "text" not in document and "error" not in document:
+            try:
+                upload = document.pop("upload")
+                try:
+                    document["segments"] = await extract_document_segments(document["filename"], upload.path, prompt_type)
+                finally:
+                    upload.remove()
+                document["text"] = "".join(document["segments"])
+            except ExtractionError as e:
+                document["error"] = {"status_code": 413 if isinstance(e, ExtractionMemoryError) else 422, "detail": f"Failed to extract text from file: {e}"}
+        job.progress["documents_extracted"] += 1
+
+    await asyncio.gather(*(extract(document) for document in documents))
+
+    # Dedupe clauses across the batch: clause hash -> clause text.
+    unique_clauses: Dict[str, str] = {}
+    total_clauses = 0
+    for document in documents:
+        if "error" in document:
+            continue
+        DOCUMENT_SIZE.observe(len(document["text"]), source="batch", prompt_type=prompt_type)
+        if PREPROCESSING_ENABLED:
+            # Stripping page headers and numbers also lets clauses that straddle a page break dedupe.
+            with stage_timer("preprocessing", prompt_type):
+                document["preprocessor"] = preprocess_document(
+                    document.pop("segments", None) or split_pages(document["text"]),
+                    file_kind(document.get("filename", "")) != "docx", drop_boilerplate)
+            document["text"] = document["preprocessor"].text
+        with stage_timer("chunking", prompt_type):
+            document["clauses"] = split_into_clauses(document["text"], MAX_CHUNK_CHARS)
+        document["clause_hashes"] = [clause_hash(clause) for clause in document["clauses"]]
+        total_clauses += len(document["clauses"])
+        for clause, digest in zip(document["clauses"], document["clause_hashes"]):
+            unique_clauses.setdefault(digest, clause.text)
+    job.progress["unique_clauses"] = len(unique_clauses)
+    logger.info(f"Batch of {len(documents)} documents: {total_clauses} clauses, {len(unique_clauses)} unique")
+
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    clause_results: Dict[str, Dict[str, Any]] = {}
+    clause_errors: Dict[str, Dict[str, Any]] = {}
+
+    async def analyze_unique_clause(digest: str, text: str):
+        try:
+            async with semaphore:
+                clause_results[digest] = await analyze_chunk(prompt_type, prompt_template_str, text)
+        except HTTPException as e:
+            clause_errors[digest] = {"status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Batch clause analysis failed: {e}", exc_info=True)
+            clause_errors[digest] = {"status_code": 500, "detail": f"Analysis failed: {e}"}
+        job.progress["clauses_completed"] += 1
+
+    await asyncio.gather(*(analyze_unique_clause(digest, text) for digest, text in unique_clauses.items()))
+
+    # Fan clause results back out to the documents and reduce each document separately.
+    async def assemble(document: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {"name": document["name"], "status": "failed", "document_id": None, "result": None, "error": document.get("error")}
+        if entry["error"]:
+            return entry
+        clauses, hashes = document["clauses"], document["clause_hashes"]
+        analyzed = [(clause, digest) for clause, digest in zip(clauses, hashes) if digest in clause_results]
+        entry["clauses"] = len(clauses)
+        entry["failed_clauses"] = len(clauses) - len(analyzed)
+        if not clauses:
+            entry["error"] = {"status_code": 422, "detail": "Document contains no text."}
+            return entry
+        if not analyzed:
+            entry["error"] = clause_errors[hashes[0]]
+            return entry
+
+        # Clause results are shared across documents, so their local offsets are moved to this document's positions.
+        results = [shift_offsets(clause_results[digest], clause.start) for clause, digest in analyzed]
+        if len(results) == 1:
+            entry["result"] = dict(results[0])
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF or DOCX.")
+            entry["result"] = merge_chunk_results(results)
+            if include_summary:
+                entry["result"]["simplified_explanation"] = await summarize_chunk_results(results, document["text"])
+        # Stored one clause per chunk, so a later revision can be re-analyzed incrementally.
+        entry["document_id"] = entry["result"]["document_id"] = await run_blocking(
+            document_versions, document_versions.save,
+            prompt_type, [StoredChunk([digest], [clause.label], clause.text, result, clause.start)
+                          for (clause, digest), result in zip(analyzed, results)],
+            None, document["name"],
+        )
+        if "preprocessor" in document:
+            entry["result"] = map_result_offsets(entry["result"], document["preprocessor"].offset_map)
+            entry["result"]["preprocessing"] = preprocessing_report(document["preprocessor"], "batch")
+        entry["status"] = "succeeded" if not entry["failed_clauses"] else "partial"
+        if entry["failed_clauses"]:
+            entry["error"] = next(clause_errors[digest] for digest in hashes if digest in clause_errors)
+        return entry
 
-        # For file uploads, automatically use the 'detailed_analysis' prompt type.
-        # You could add a query parameter to allow the user to select this from the UI/request.
-        document_for_analysis = DocumentText(text=extracted_text, prompt_type="detailed_analysis")
-        return await analyze_document_text(document_for_analysis)
+    document_results = await asyncio.gather(*(assemble(document) for document in documents))
 
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        logger.error(f"Error processing uploaded file: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
\ No newline at end of file
+    elapsed = time.monotonic() - started
+    statuses = [entry["status"] for entry in document_results]
+    return {
+        "documents": list(document_results),
+        "stats": {
+            "documents": len(documents),
+            "succeeded": statuses.count("succeeded"),
+            "partial": statuses.count("partial"),
+            "failed": statuses.count("failed"),
+            "total_clauses": total_clauses,
+            "unique_clauses": len(unique_clauses),
+            "failed_clauses": len(clause_errors),
+            "dedupe_ratio": round(1 - len(unique_clauses) / total_clauses, 4) if total_clauses else 0.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "documents_per_second": round(len(documents) / elapsed, 3) if elapsed else None,
+            "clauses_per_second": round(total_clauses / elapsed, 3) if elapsed else None,
+        },
+    }
+
+async def run_batch_upload_analysis(job: Job, documents: List[Dict[str, Any]], include_summary: bool,
+                                    drop_boilerplate: bool) -> Dict[str, Any]:
+    """Batch upload job: holds one per-request memory reservation per file while the batch runs."""
+    uploads = sum(1 for document in documents if "upload" in document)
+    try:
+        async with upload_memory.reserve(uploads * UPLOAD_REQUEST_MEMORY_BYTES):
+            return await run_batch_analysis(job, "detailed_analysis", documents, include_summary, drop_boilerplate)
+    finally:
+        for document in documents:
+            if "upload" in document:
+                document.pop("upload").remove()
+
+def check_batch_prompt_type(prompt_type: str):
+    if prompt_type not in CHUNKED_PROMPT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Batch analysis supports prompt types: {', '.join(CHUNKED_PROMPT_TYPES)}")
+
+@app.post("/batch/analyze-texts", response_model=Dict[str, Any], status_code=202)
+async def submit_batch_text_analysis(request: BatchAnalysisRequest):
+    """
+    Queues a batch of text documents as one bulk job. Identical clauses across the batch are sent to
+    the LLM once. Poll /jobs/{job_id}/result for per-document results and batch throughput stats.
+    """
+    check_batch_prompt_type(request.prompt_type)
+    if not request.documents:
+        raise HTTPException(status_code=400, detail="A batch needs at least one document.")
+    documents = [{"name": document.name or f"document-{index + 1}", "text": document.text} for index, document in enumerate(request.documents)]
+    job = job_scheduler.submit("batch-analyze-texts", PRIORITY_BULK,
+                               lambda job: run_batch_analysis(job, request.prompt_type, documents, request.include_summary, request.drop_boilerplate))
+    return job_submission(job)
+
+@app.post("/batch/upload-and-analyze", response_model=Dict[str, Any], status_code=202)
+async def submit_batch_upload_analysis(files: List[UploadFile] = File(...), include_summary: bool = Form(False),
+                                      drop_boilerplate: bool = Form(False)):
+    """
+    Queues a batch of PDF/DOCX uploads as one bulk 'detailed_analysis' job, with the same clause
+    deduplication as /batch/analyze-texts. Unsupported or unreadable files fail individually.
+    """
+    documents = []
+    try:
+        for file in files:
+            document = {"name": file.filename}
+            if file_kind(file.filename) is None:
+                document["error"] = {"status_code": 400, "detail": "Unsupported file type. Please upload PDF or DOCX."}
+            else:
+                # Files are spooled now, since the request (and its files) is gone by the time the job runs.
+                try:
+                    document.update(filename=file.filename, upload=await spool_upload(file, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_DIR))
+                except UploadTooLargeError as e:
+                    document["error"] = {"status_code": 413, "detail": str(e)}
+            documents.append(document)
+        job = job_scheduler.submit("batch-upload-and-analyze", PRIORITY_BULK,
+                                   lambda job: run_batch_upload_analysis(job, documents, include_summary, drop_boilerplate))
+    except BaseException:
+        # The job never got the files (client disconnect, disk full), so nothing else removes them.
+        for document in documents:
+            if "upload" in document:
+                document.pop("upload").remove()
+        raise
+    return job_submission(job)
+
+# --- Stored Analyses ---
+
+def require_analysis_store() -> AnalysisStore:
+    if not isinstance(document_versions, AnalysisStore):
+        raise HTTPException(status_code=404, detail="The analysis store is disabled (ANALYSIS_STORE_ENABLED=false).")
+    return document_versions
+
+@app.get("/analyses/query", response_model=Dict[str, Any])
+async def query_analyses(field: Optional[str] = None, term: Optional[str] = None, match: str = "exact",
+                         text: Optional[str] = None, risk_level: Optional[List[str]] = Query(None),
+                         prompt_type: Optional[str] = None, include_superseded: bool = False, limit: int = 100):
+    """
+    Finds stored analyses by their findings, from the analysis store's indexes (no LLM call).
+    field is one of red_flag, vague_term, external_reference, jurisdiction or risk_level; term
+    matches its normalized values exactly, by prefix or as a substring (match). text searches the
+    findings' descriptions. risk_level (repeatable) and prompt_type filter the documents, and only
+    the latest version of re-analyzed documents is searched unless include_superseded.
+    Returns the matching documents, most recent first, with their matching findings.
+    """
+    store = require_analysis_store()
+    if field is None and term is None and text is None and not risk_level and prompt_type is None:
+        raise HTTPException(status_code=400, detail="Give a field, term, text, risk_level or prompt_type to query.")
+    try:
+        return await run_blocking(store, store.query, field, term, match, text, risk_level, prompt_type, include_superseded,
+                                  max(1, min(limit, 1000)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analyses/terms", response_model=Dict[str, Any])
+async def list_analysis_terms(field: str, prefix: str = "", limit: int = 100):
+    """
+    Lists the indexed values of a field (e.g. every red flag type seen so far) with their number of
+    findings, most frequent first, to build queries from.
+    """
+    store = require_analysis_store()
+    try:
+        return {"field": field, "terms": await run_blocking(store, store.terms, field, prefix, max(1, min(limit, 1000)))}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analyses/{document_id}", response_model=Dict[str, Any])
+async def get_stored_analysis(document_id: str):
+    """
+    Returns a stored document version: its name, prompt type, previous version and the result of
+    each of its chunks (None for chunks whose analysis failed or was degraded).
+    """
+    version = await run_blocking(document_versions, document_versions.get, document_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document_id: '{document_id}'")
+    return {
+        "document_id": version.document_id,
+        "name": version.name,
+        "prompt_type": version.prompt_type,
+        "previous_document_id": version.previous_document_id,
+        "created_at": version.created_at,
+        "chunks": [{"start": chunk.start, "clause_labels": chunk.clause_labels, "result": chunk.result} for chunk in version.chunks],
+    }
+
+# --- Admin Endpoints ---
+
+def require_admin(admin_key: Optional[str]):
+    """Rejects admin calls without the configured X-Admin-Key (no-op when ADMIN_API_KEY is unset)."""
+    if ADMIN_API_KEY and admin_key != ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid or missing admin key.")
+
+@app.get("/admin/cache/stats", response_model=Dict[str, Any])
+async def get_cache_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns result cache hit/miss counters and tier sizes.
+    """
+    require_admin(x_admin_key)
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_blocking(result_cache, result_cache.stats)}
+
+@app.post("/admin/cache/invalidate", response_model=Dict[str, Any])
+async def invalidate_cache(request: CacheInvalidationRequest, x_admin_key: Optional[str] = Header(None)):
+    """
+    Invalidates cached LLM results. By default only entries produced by templates that have since
+    changed or been removed are dropped; set stale_only=false to drop every entry (for a prompt type).
+    """
+    require_admin(x_admin_key)
+    if result_cache is None:
+        raise HTTPException(status_code=404, detail="Result cache is disabled.")
+    if request.prompt_type is not None and request.prompt_type not in PROMPT_TEMPLATES:
+        raise HTTPException(status_code=400, detail=f"Invalid prompt_type: '{request.prompt_type}'. Available types are: {', '.join(PROMPT_TEMPLATES.keys())}")
+
+    keep_template_hashes = current_template_fingerprints() if request.stale_only else None
+    removed = await run_blocking(result_cache, result_cache.invalidate, request.prompt_type, keep_template_hashes)
+    logger.info(f"Invalidated {removed} cache entries (prompt_type={request.prompt_type}, stale_only={request.stale_only})")
+    return {"removed": removed, **await run_blocking(result_cache, result_cache.stats)}
+
+@app.get("/admin/rate-limiter/stats", response_model=Dict[str, Any])
+async def get_rate_limiter_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns LLM quota limiter counters (admitted, rate-limited, waiting calls, remaining budget), job queue
+    stats and the upload memory budget (reserved, peak and waiting uploads).
+    """
+    require_admin(x_admin_key)
+    return {"rate_limiter": await llm_rate_limiter.stats(), "jobs": job_scheduler.stats(), "upload_memory": upload_memory.stats()}
+
+@app.get("/admin/coalescing/stats", response_model=Dict[str, Any])
+async def get_coalescing_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns the in-flight call coalescing counters of this worker: LLM calls made, calls coalesced with
+    one in flight in this worker or another, takeovers of abandoned calls, and the shared state backend.
+    """
+    require_admin(x_admin_key)
+    return {"shared_state_backend": SHARED_STATE_BACKEND, **await llm_coalescer.stats()}
+
+@app.get("/admin/cascade/stats", response_model=Dict[str, Any])
+async def get_cascade_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns the model cascade statistics: chunks screened and escalated, the escalation rate, tokens,
+    LLM time and estimated cost per tier, and the estimated cost and LLM time saved.
+    """
+    require_admin(x_admin_key)
+    return {"enabled": CASCADE_ENABLED, **cascade_stats.stats()}
+
+@app.get("/admin/llm/stats", response_model=Dict[str, Any])
+async def get_llm_call_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns the tail-latency statistics of LLM calls: hedges fired and won, the estimated time they
+    saved, the current hedge delay per model and prompt type, and each model's circuit breaker state.
+    """
+    require_admin(x_admin_key)
+    return {
+        "call_timeout_seconds": LLM_CALL_TIMEOUT_SECONDS,
+        "hedging": {
+            "enabled": LLM_HEDGE_ENABLED,
+            "percentile": LLM_HEDGE_PERCENTILE,
+            **hedge_stats.stats(),
+            "hedge_delays": {key: llm_latencies.percentile(key, LLM_HEDGE_PERCENTILE) for key in llm_latencies.keys()},
+        },
+        "circuits": {model_name: circuit.stats() for model_name, circuit in llm_circuits.items()},
+    }
+
+@app.get("/admin/similarity/stats", response_model=Dict[str, Any])
+async def get_similarity_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns the near-duplicate index statistics: lookups, reuses, verification rejections, the
+    reuse rate, lookup latency and the number of indexed chunks.
+    """
+    require_admin(x_admin_key)
+    if similarity_index is None:
+        return {"enabled": False}
+    return {"enabled": True, "verify": SIMILARITY_VERIFY, **similarity_index.stats()}
+
+@app.get("/admin/analysis-store/stats", response_model=Dict[str, Any])
+async def get_analysis_store_stats(x_admin_key: Optional[str] = Header(None)):
+    """
+    Returns the analysis store's row counts (documents, chunks, findings, indexed terms and
+    postings) and its size on disk.
+    """
+    require_admin(x_admin_key)
+    if not isinstance(document_versions, AnalysisStore):
+        return {"enabled": False}
+    return {"enabled": True, **await run_blocking(document_versions, document_versions.stats)}
+
+# --- Metrics ---
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus scrape endpoint: request latency and per-stage latency histograms (extraction, prompt
+    rendering, LLM call, JSON parsing, validation, ...), stage errors by exception class, LLM token
+    counts and document sizes.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
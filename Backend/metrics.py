@@ -0,0 +1,262 @@
+# metrics.py
+
+"""
+In-process metrics in the Prometheus text exposition format, plus per-request traces.
+
+Hot-path stages (extraction, prompt rendering, the LLM call, JSON parsing, validation, ...) are
+timed with `stage_timer`, which records a latency histogram per stage and, when the code runs
+inside an HTTP request, adds the time to that request's trace. The trace id and the per-stage
+totals are returned as X-Trace-Id and Server-Timing headers, so a slow request seen in production
+can be matched to its stage breakdown.
+"""
+
+import contextvars
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+SIZE_BUCKETS = (1000, 5000, 20000, 50000, 100000, 250000, 500000, 1000000, 5000000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((position for position, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else _format_number(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_number(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body is complete.", ("method", "route", "status"))
+STAGE_DURATION = registry.histogram(
+    "analysis_stage_duration_seconds", "Time spent in each analysis stage.", ("stage", "prompt_type"))
+STAGE_ERRORS = registry.counter(
+    "analysis_stage_errors_total", "Exceptions raised inside an analysis stage, by exception class.", ("stage", "prompt_type", "error_class"))
+LLM_INPUT_TOKENS = registry.histogram(
+    "llm_input_tokens", "Estimated prompt tokens per LLM call.", ("prompt_type",), TOKEN_BUCKETS)
+LLM_OUTPUT_TOKENS = registry.histogram(
+    "llm_output_tokens", "Estimated output tokens per LLM call.", ("prompt_type",), TOKEN_BUCKETS)
+DOCUMENT_SIZE = registry.histogram(
+    "document_size_chars", "Size of analyzed documents in characters.", ("source", "prompt_type"), SIZE_BUCKETS)
+PREPROCESSING_TOKENS_SAVED = registry.counter(
+    "preprocessing_tokens_saved_total", "Estimated input tokens removed from documents before prompting.", ("source",))
+LLM_OUTPUTS = registry.counter(
+    "llm_outputs_total", "Parsed LLM outputs by outcome: ok, repaired, retried (usable after a strict retry) or unusable.",
+    ("prompt_type", "outcome"))
+CASCADE_CHUNKS = registry.counter(
+    "cascade_chunks_total", "Chunks analyzed in cascade mode, by the tier that produced their result (screening or escalated).", ("tier",))
+SIMILARITY_LOOKUPS = registry.counter(
+    "similarity_lookups_total", "Near-duplicate index lookups by outcome: reused, rejected (by verification) or miss.", ("prompt_type", "outcome"))
+LLM_CALL_FAILURES = registry.counter(
+    "llm_call_failures_total", "LLM calls that timed out or failed upstream, by model and reason (timeout or error).", ("model", "reason"))
+LLM_HEDGES = registry.counter(
+    "llm_hedges_total", "Hedged LLM calls by model and outcome: fired, primary_won or hedge_won.", ("model", "outcome"))
+LLM_HEDGE_SECONDS_SAVED = registry.counter(
+    "llm_hedge_seconds_saved_total", "Estimated latency saved by hedges that won, in seconds.", ("model",))
+LLM_CIRCUIT_EVENTS = registry.counter(
+    "llm_circuit_events_total", "Circuit breaker events by model: opened, or rejected (a call that failed fast).", ("model", "event"))
+LLM_FALLBACKS = registry.counter(
+    "llm_fallbacks_total", "Chunks analyzed without the LLM while it was unavailable, by fallback (similar or local).", ("prompt_type", "fallback"))
+
+
+@dataclass
+class RequestTrace:
+    """Per-request stage totals. Concurrent stages (e.g. chunk LLM calls) add up, so totals can exceed wall time."""
+    trace_id: str
+    started: float = field(default_factory=time.perf_counter)
+    stages: Dict[str, float] = field(default_factory=dict)
+    finished: bool = False
+
+    def add(self, stage: str, seconds: float) -> None:
+        # Background tasks can outlive the request that started them; their time isn't the request's.
+        if not self.finished:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (durations in milliseconds)."""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace(trace_id: Optional[str] = None) -> RequestTrace:
+    trace = RequestTrace(trace_id or uuid.uuid4().hex)
+    current_trace.set(trace)
+    return trace
+
+
+def record_stage(stage: str, seconds: float, prompt_type: str = "", error: Optional[BaseException] = None) -> None:
+    """Records one timed stage (and its exception, if any) in the histograms and the current request's trace."""
+    STAGE_DURATION.observe(seconds, stage=stage, prompt_type=prompt_type)
+    if error is not None:
+        STAGE_ERRORS.inc(stage=stage, prompt_type=prompt_type, error_class=type(error).__name__)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, prompt_type: str = "") -> Iterator[None]:
+    """Times a block as one analysis stage; exceptions are counted by class and re-raised."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e: # Cancellation (e.g. of an abandoned stream) is not an error
+        error = e
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started, prompt_type, error)
+
+
+# Incoming trace ids are only reused if they look like ids, so they can't inject header or log content.
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that starts a trace per HTTP request (reusing a valid incoming X-Request-Id or
+    X-Trace-Id), returns X-Trace-Id and Server-Timing headers, records the request latency once the
+    response body is complete and logs the stage breakdown of requests slower than slow_request_seconds.
+    For streaming responses the headers are sent before the analysis runs, so Server-Timing only covers
+    the time until then; the slow-request log has the full breakdown.
+    """
+
+    def __init__(self, app, slow_request_seconds: float = 10.0):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = (headers.get(b"x-trace-id") or headers.get(b"x-request-id") or b"").decode("latin-1")
+        trace = start_trace(incoming if TRACE_ID_PATTERN.match(incoming) else None)
+        status = {"code": 500}
+
+        def finish():
+            if trace.finished:
+                return
+            elapsed = time.perf_counter() - trace.started
+            trace.finished = True
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_DURATION.observe(elapsed, method=scope["method"], route=route, status=str(status["code"]))
+            if elapsed >= self.slow_request_seconds:
+                logger.warning(f"Slow request {trace.trace_id}: {scope['method']} {scope['path']} -> {status['code']} "
+                               f"in {elapsed:.2f}s; stages: {trace.server_timing()}")
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-trace-id", trace.trace_id.encode("latin-1")),
+                    (b"server-timing", trace.server_timing().encode("latin-1")),
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            finish()
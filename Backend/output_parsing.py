@@ -0,0 +1,305 @@
+# output_parsing.py
+
+"""
+Tolerant parsing and validation of LLM JSON output.
+
+Models sometimes wrap their JSON in Markdown fences or prose, leave trailing commas, stop in the
+middle of a response (output token limit) or return a field in a slightly different shape than
+the one asked for. Instead of failing the chunk, OutputSchema.parse repairs the text and
+OutputSchema.validate coerces near-miss fields towards the result model before validating it
+with a prebuilt TypeAdapter. Both report what they changed, and only output that still cannot
+be used raises OutputRepairError, so the caller can retry just that chunk with
+OutputSchema.strict_instructions appended to its prompt.
+"""
+
+import json
+import re
+import typing
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+try:
+    import orjson # Optional: parses large responses several times faster than the json module
+except ImportError:
+    orjson = None
+
+FENCE_PATTERN = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+CAMEL_CASE_PATTERN = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+KEY_SEPARATOR_PATTERN = re.compile(r"[\s\-]+")
+# Key of the entry built when a list field holds a bare string instead of an object
+STRING_ENTRY_KEY = "description"
+
+
+class OutputRepairError(ValueError):
+    """Raised when LLM output can't be parsed or validated, even after repair and coercion."""
+
+    def __init__(self, message: str, errors: Optional[List[Any]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def loads(text: str) -> Any:
+    """json.loads, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def repair_json(text: str) -> Tuple[str, List[str]]:
+    """
+    Repairs the common defects of LLM JSON output and returns the repaired text with the names
+    of the repairs made: Markdown fences, text around the JSON value, trailing commas and
+    truncation. A truncated response is cut back to its last complete top-level field or list
+    entry and its open arrays and objects are closed, so half-written entries are dropped rather
+    than kept.
+    """
+    repairs = []
+    fenced = FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1)
+        repairs.append("code_fence")
+
+    start = next((index for index, char in enumerate(text) if char in "{["), None)
+    if start is None:
+        return text, repairs
+    if text[:start].strip():
+        repairs.append("surrounding_text")
+
+    out: List[str] = []
+    stack: List[str] = [] # Open containers, as their closing characters
+    expect_key = False # Inside an object, before a key's colon
+    in_string = escaped = False
+    safe = None # (output length, open containers) after the last complete field or list entry
+    end = None
+    trailing_commas = 0
+
+    def at_boundary() -> bool:
+        # Fields of the top-level object and entries of lists are kept or dropped as a whole.
+        return len(stack) == 1 or (bool(stack) and stack[-1] == "]")
+
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if at_boundary() and not (stack[-1] == "}" and expect_key):
+                    safe = (len(out), list(stack))
+            continue
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            expect_key = char == "{"
+            out.append(char)
+            if at_boundary():
+                safe = (len(out), list(stack))
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                trailing_commas += 1
+            if not stack or stack[-1] != char:
+                break # Mismatched bracket: keep what was complete before it
+            stack.pop()
+            out.append(char)
+            expect_key = False
+            if not stack:
+                end = index
+                break
+            if at_boundary():
+                safe = (len(out), list(stack))
+        elif char == ",":
+            if at_boundary():
+                safe = (len(out), list(stack))
+            if stack and stack[-1] == "}":
+                expect_key = True
+            out.append(char)
+        elif char == ":":
+            expect_key = False
+            out.append(char)
+        else:
+            out.append(char)
+
+    if trailing_commas:
+        repairs.append("trailing_commas")
+    if end is not None:
+        if text[end + 1:].strip():
+            if "surrounding_text" not in repairs:
+                repairs.append("surrounding_text")
+        return "".join(out), repairs
+
+    # Truncated: keep everything up to the last complete field or entry and close what is still open.
+    repairs.append("truncation")
+    length, open_containers = safe if safe else (0, [])
+    repaired = "".join(out[:length]).rstrip()
+    if repaired.endswith(","):
+        repaired = repaired[:-1]
+    return repaired + "".join(reversed(open_containers)), repairs
+
+
+def parse_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    Parses JSON text, falling back to repair_json only when it doesn't parse as is.
+    Returns the parsed value and the repairs made; raises OutputRepairError if it can't be repaired.
+    """
+    try:
+        return loads(text), []
+    except ValueError:
+        pass
+    repaired, repairs = repair_json(text)
+    try:
+        return loads(repaired), repairs
+    except ValueError as e:
+        raise OutputRepairError(f"LLM did not return valid JSON: {e}")
+
+
+def _normalize_key(key: str) -> str:
+    """'redFlags', 'Red Flags' and 'red-flags' all become 'red_flags'."""
+    return KEY_SEPARATOR_PATTERN.sub("_", CAMEL_CASE_PATTERN.sub("_", key.strip())).lower()
+
+
+def _to_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and all(isinstance(item, (str, int, float)) for item in value):
+        return ", ".join(str(item) for item in value)
+    return json.dumps(value)
+
+
+class OutputSchema:
+    """
+    Parsing, coercion and validation for one result model. `choices` lists the allowed values
+    of string fields such as risk_level; a value is matched to them case-insensitively.
+    """
+
+    def __init__(self, model: type, choices: Optional[Dict[str, Sequence[str]]] = None):
+        self.model = model
+        self.adapter = TypeAdapter(model)
+        self.choices = choices or {}
+        # Field name -> "text" (str), "entries" (list of dicts with string values) or "objects" (list of dicts)
+        self.field_kinds: Dict[str, str] = {}
+        for name, info in model.model_fields.items():
+            if info.annotation is str:
+                self.field_kinds[name] = "text"
+            elif typing.get_origin(info.annotation) is list:
+                item_args = typing.get_args(typing.get_args(info.annotation)[0])
+                self.field_kinds[name] = "entries" if item_args[1:] == (str,) else "objects"
+
+    def parse(self, text: str) -> Tuple[Any, List[str]]:
+        """Parses LLM output, repairing it if needed. Returns the parsed value and the repairs made."""
+        parsed, repairs = parse_json(text)
+        return self._unwrap(parsed, repairs), repairs
+
+    def _unwrap(self, parsed: Any, repairs: List[str]) -> Any:
+        """Unwraps a result returned as a one-element list or nested under a single key."""
+        if isinstance(parsed, list) and len(parsed) == 1 and isinstance(parsed[0], dict):
+            repairs.append("unwrapped_list")
+            return parsed[0]
+        if isinstance(parsed, dict) and len(parsed) == 1:
+            inner = next(iter(parsed.values()))
+            if isinstance(inner, dict) and not set(parsed) & set(self.field_kinds) and set(inner) & set(self.field_kinds):
+                repairs.append("unwrapped_object")
+                return inner
+        return parsed
+
+    def validate(self, data: Any) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Coerces near-miss fields and validates the result. Returns the validated dict and the names
+        of the coercions made; raises OutputRepairError if it still doesn't match the model.
+        """
+        if not isinstance(data, dict):
+            raise OutputRepairError(f"LLM output is a {type(data).__name__}, not a JSON object.")
+        coerced, coercions = self._coerce(data)
+        try:
+            return self.adapter.validate_python(coerced).model_dump(), coercions
+        except ValidationError as e:
+            raise OutputRepairError(f"LLM output failed validation: {e.errors()}", e.errors())
+
+    def _coerce(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        coerced = dict(data)
+        coercions = set()
+        for key in data:
+            normalized = _normalize_key(key) if isinstance(key, str) else key
+            if normalized != key and normalized in self.field_kinds and normalized not in coerced:
+                coerced[normalized] = coerced.pop(key)
+                coercions.add("renamed_fields")
+
+        for name, kind in self.field_kinds.items():
+            value = coerced.get(name)
+            if kind == "text":
+                if isinstance(value, list) and all(isinstance(item, str) for item in value):
+                    coerced[name] = "\n\n".join(value)
+                    coercions.add("joined_text")
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    coerced[name] = str(value)
+                    coercions.add("stringified_values")
+                if name in self.choices and isinstance(coerced.get(name), str):
+                    choice = self._match_choice(name, coerced[name])
+                    if choice is not None and choice != coerced[name]:
+                        coerced[name] = choice
+                        coercions.add("normalized_choices")
+                continue
+
+            if value is None:
+                coerced[name] = []
+                coercions.add("missing_lists")
+                continue
+            if isinstance(value, dict):
+                value = [value]
+                coercions.add("wrapped_entries")
+            if not isinstance(value, list):
+                continue # Left for validation to reject
+            entries = []
+            for item in value:
+                if isinstance(item, str):
+                    item = {STRING_ENTRY_KEY: item}
+                    coercions.add("wrapped_entries")
+                elif not isinstance(item, dict):
+                    coercions.add("dropped_entries")
+                    continue
+                if kind == "entries" and not all(isinstance(field_value, str) for field_value in item.values()):
+                    item = {field_key: _to_text(field_value) for field_key, field_value in item.items()}
+                    coercions.add("stringified_values")
+                entries.append(item)
+            coerced[name] = entries
+        return coerced, sorted(coercions)
+
+    def _match_choice(self, name: str, value: str) -> Optional[str]:
+        """'high', 'HIGH RISK' and 'Risk: High' all match the choice 'High'."""
+        words = {word.lower() for word in re.findall(r"[A-Za-z]+", value)}
+        matches = [choice for choice in self.choices[name] if choice.lower() in words]
+        return matches[0] if len(matches) == 1 else None
+
+    def strict_instructions(self, prompt_template: str) -> str:
+        """
+        Instructions appended to a prompt to retry a chunk whose output couldn't be used: the exact
+        keys the template asks for, their types, and a reminder to return complete, bare JSON.
+        """
+        keys = []
+        for name, kind in self.field_kinds.items():
+            if f'"{name}"' not in prompt_template and f"'{name}'" not in prompt_template and kind != "text":
+                continue
+            if name in self.choices:
+                keys.append(f'"{name}" (one of {", ".join(json.dumps(choice) for choice in self.choices[name])})')
+            elif kind == "text":
+                keys.append(f'"{name}" (string)')
+            elif kind == "entries":
+                keys.append(f'"{name}" (list of objects whose values are all strings; [] if none)')
+            else:
+                keys.append(f'"{name}" (list of objects; [] if none)')
+        return (
+            "\n\nIMPORTANT: Your response must be a single JSON object and nothing else: no Markdown fences, "
+            f"no comments, no text before or after it. It must have exactly these keys: {', '.join(keys)}. "
+            "Keep each list to its 10 most important entries and each string short, so that the response "
+            "is complete, with every string, list and object closed."
+        )
@@ -0,0 +1,395 @@
+# preanalysis.py
+
+"""
+Local, deterministic pre-analysis of legal text.
+
+Some findings of a detailed analysis are mechanical: known vague terms, biased wording, citations
+of statutes and regulations, and explicit cross-references between numbered clauses. These are
+found here without an LLM: a compiled Aho-Corasick automaton matches the whole term lexicon in a
+single pass over the text, and a few regexes pick up citations and clause references. Every
+finding carries 'start'/'end' character offsets into the analyzed text.
+"""
+
+import bisect
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chunking import CLAUSE_HEADING_PATTERN
+from versioning import CLAUSE_REFERENCE_PATTERN
+
+# Result fields that are filled in locally instead of by the LLM.
+LOCAL_FIELDS = ("vague_terms", "biased_language", "external_references")
+# Locally found clause references are added to this (otherwise LLM-produced) field.
+CROSS_REFERENCE_FIELD = "inter_clause_dependencies"
+
+# Vague or open-ended terms: term -> why it is vague.
+VAGUE_TERMS = {
+    "reasonable": "What is 'reasonable' depends on the circumstances and is ultimately decided by a court.",
+    "reasonably": "What is 'reasonable' depends on the circumstances and is ultimately decided by a court.",
+    "commercially reasonable efforts": "An effort standard without a defined benchmark; courts interpret it inconsistently.",
+    "reasonable efforts": "An effort standard without a defined benchmark; courts interpret it inconsistently.",
+    "best efforts": "May require more than is commercially sensible; its scope varies by jurisdiction.",
+    "good faith": "Depends on the parties' intent and conduct, which is hard to prove either way.",
+    "material": "Whether something is 'material' is a judgment call unless a threshold is defined.",
+    "materially": "Whether something is 'material' is a judgment call unless a threshold is defined.",
+    "substantially": "Leaves open how close to full performance is enough.",
+    "substantial": "Leaves open how much is enough.",
+    "promptly": "No fixed deadline; the acceptable delay depends on the circumstances.",
+    "as soon as practicable": "No fixed deadline; the acceptable delay depends on the circumstances.",
+    "as soon as possible": "No fixed deadline; the acceptable delay depends on the circumstances.",
+    "timely": "No fixed deadline unless a time period is specified elsewhere.",
+    "from time to time": "Allows changes or actions at unspecified times.",
+    "appropriate": "Leaves the standard to be decided by whoever applies the clause.",
+    "adequate": "Leaves the standard to be decided by whoever applies the clause.",
+    "sufficient": "Leaves the standard to be decided by whoever applies the clause.",
+    "satisfactory": "Satisfaction is subjective unless acceptance criteria are defined.",
+    "sole discretion": "Gives one party an essentially unreviewable choice.",
+    "absolute discretion": "Gives one party an essentially unreviewable choice.",
+    "industry standard": "Industry practice may be unclear, disputed or change over time.",
+    "industry standards": "Industry practice may be unclear, disputed or change over time.",
+    "customary": "Relies on an unstated custom that the parties may understand differently.",
+    "including without limitation": "Makes the list open-ended, so the full scope is not defined.",
+    "and/or": "Unclear whether the items apply together, separately or both.",
+    "etc": "Leaves the rest of the list undefined.",
+    "significant": "No threshold defines what counts as significant.",
+    "normal wear and tear": "Depends on usage expectations that are not spelled out.",
+    "to the extent permitted by law": "The actual scope depends on whichever law ends up applying.",
+    "applicable law": "Does not say which jurisdiction's law applies.",
+    "applicable laws": "Does not say which jurisdiction's law applies.",
+}
+
+# Biased wording: term -> (suggested alternative, reason). None marks neutral phrases whose words
+# would otherwise match a shorter biased term (e.g. "he or she" contains "he").
+BIASED_TERMS: Dict[str, Optional[Tuple[str, str]]] = {
+    "he": ("they", "Generic masculine pronoun used for a party of unspecified gender."),
+    "him": ("them", "Generic masculine pronoun used for a party of unspecified gender."),
+    "his": ("their", "Generic masculine pronoun used for a party of unspecified gender."),
+    "himself": ("themselves", "Generic masculine pronoun used for a party of unspecified gender."),
+    "he or she": None,
+    "she or he": None,
+    "he/she": None,
+    "his or her": None,
+    "his/her": None,
+    "him or her": None,
+    "himself or herself": None,
+    "chairman": ("chair", "Gendered job title."),
+    "chairmen": ("chairs", "Gendered job title."),
+    "foreman": ("supervisor", "Gendered job title."),
+    "workman": ("worker", "Gendered noun."),
+    "workmen": ("workers", "Gendered noun."),
+    "manpower": ("workforce", "Gendered noun."),
+    "mankind": ("humankind", "Gendered noun."),
+    "man-hours": ("work hours", "Gendered noun."),
+    "policeman": ("police officer", "Gendered job title."),
+    "businessman": ("businessperson", "Gendered noun."),
+    "layman": ("layperson", "Gendered noun."),
+    "draftsman": ("drafter", "Gendered job title."),
+    "spokesman": ("spokesperson", "Gendered job title."),
+    "middleman": ("intermediary", "Gendered noun."),
+    "handicapped": ("person with a disability", "Outdated term for disability."),
+    "the disabled": ("people with disabilities", "Defines people by their disability."),
+}
+
+# Citations of statutes, regulations and codes.
+EXTERNAL_REFERENCE_PATTERNS = [
+    # 15 U.S.C. § 78j, 17 C.F.R. 240.10b-5, 42 USC 2000e
+    re.compile(r"\b\d+\s+(?:U\.?\s?S\.?\s?C|C\.?\s?F\.?\s?R)\.?(?:\s*(?:§+|Part|Sec\.))?\s*\d+[\w.\-]*(?:\([0-9a-zA-Z]+\))*"),
+    # Regulation (EU) 2016/679, Directive 2002/58/EC
+    re.compile(r"\b(?:Regulation|Directive)\s+(?:\((?:EU|EC|EEC)\)\s+(?:No\.?\s+)?\d+/\d+|\d+/\d+/(?:EU|EC|EEC))\b"),
+    # [Section 10(b) of] the Securities Exchange Act of 1934, the California Civil Code
+    re.compile(
+        r"(?:(?:Section|Article|§)\s*\d+[\w.\-]*(?:\([0-9a-zA-Z]+\))*\s+of\s+)?(?:the\s+)?"
+        r"[A-Z][\w'\-]*(?:\s+(?:(?:and|of|for|on|to)\s+)?[A-Z][\w'\-]*){0,8}\s+"
+        r"(?:Act|Code|Statute|Regulations?|Directive|Rules)\b(?:\s+of\s+\d{4})?(?:\s*(?:§+|Sec\.)\s*\d+[\w.\-]*)?"
+    ),
+    # Well-known acronyms
+    re.compile(r"\b(?:GDPR|CCPA|CPRA|HIPAA|FCPA|ERISA|COPPA|FERPA|DMCA|UCC|OSHA|FLSA|FMLA|ADA|SOX|GLBA|PIPEDA)\b"),
+]
+
+# Wording just before a clause reference that says how the referring clause relates to it.
+REFERENCE_RELATION_PATTERNS = [
+    ("subject_to", re.compile(r"\bsubject\s+to(?:\s+the\s+(?:terms|provisions)\s+of)?\s*$", re.IGNORECASE)),
+    ("notwithstanding", re.compile(r"\bnotwithstanding(?:\s+(?:anything\s+(?:to\s+the\s+contrary\s+)?in|the\s+provisions\s+of))?\s*$", re.IGNORECASE)),
+    ("except", re.compile(r"\b(?:except|unless(?:\s+otherwise)?)(?:\s+as)?(?:\s+(?:provided|set\s+forth|stated|permitted))?(?:\s+(?:in|by|under))?\s*$", re.IGNORECASE)),
+    ("pursuant_to", re.compile(r"\b(?:pursuant\s+to|in\s+accordance\s+with|as\s+(?:set\s+forth|described|defined|provided|specified)\s+in|under)\s*$", re.IGNORECASE)),
+]
+RELATION_LOOKBEHIND_CHARS = 60
+# Earlier references of the same list ("subject to Sections 3, 4 and 5"), skipped when looking for the relation.
+REFERENCE_LIST_TAIL = re.compile(r"(?:(?:article|section|clause|§)s?\s*[0-9a-z.()]+\s*(?:,\s*|\s+(?:and|or)\s+))+$", re.IGNORECASE)
+# How each relation maps onto the 'dependency_type' vocabulary of the analysis prompts.
+RELATION_DEPENDENCY_TYPES = {
+    "subject_to": "sets_condition_for",
+    "notwithstanding": "modifies",
+    "except": "modifies",
+    "pursuant_to": "reinforces",
+    "references": "references",
+}
+RELATION_DESCRIPTIONS = {
+    "subject_to": "{source} is subject to {reference}.",
+    "notwithstanding": "{source} applies notwithstanding {reference}.",
+    "except": "{source} makes an exception by reference to {reference}.",
+    "pursuant_to": "{source} applies in accordance with {reference}.",
+    "references": "{source} refers to {reference}.",
+}
+
+# Citations that name a specific section or number count as 'clear', others as 'ambiguous'.
+CITATION_HAS_NUMBER = re.compile(r"\d")
+# Characters of surrounding text kept as 'context' for each external reference
+CONTEXT_CHARS = 80
+
+
+class LexiconMatcher:
+    """
+    Aho-Corasick automaton over several named lexicons at once, so every term of every lexicon is
+    found in a single pass. Matching is case-insensitive, treats any run of whitespace as a single
+    space and only reports whole-word matches; overlapping matches within a lexicon are resolved
+    leftmost-longest.
+    """
+
+    def __init__(self, lexicons: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, str]]] = [[]]
+        for lexicon, terms in lexicons.items():
+            for term in terms:
+                self._add(lexicon, normalize_term(term))
+        self._build_failure_links()
+
+    def _add(self, lexicon: str, term: str) -> None:
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append((lexicon, term))
+
+    def _build_failure_links(self) -> None:
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> Dict[str, List[Tuple[int, int, str]]]:
+        """Returns, per lexicon, (start, end, normalized term) for every whole-word match in text."""
+        goto, fail, output = self._goto, self._fail, self._output
+        lowered = text.lower()
+        if len(lowered) != len(text): # A few characters lowercase to several; keep offsets aligned
+            lowered = "".join(char.lower()[0] for char in text)
+        matches: Dict[str, List[Tuple[int, int, str]]] = {}
+        positions: List[int] = [] # Offset in text of every character fed to the automaton
+        state = 0
+        previous_space = True
+        for index, char in enumerate(lowered):
+            if char.isspace():
+                if previous_space:
+                    continue
+                char = " "
+                previous_space = True
+            else:
+                previous_space = False
+            positions.append(index)
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for lexicon, term in output[state]:
+                start = positions[len(positions) - len(term)]
+                if _is_word_boundary(text, start - 1) and _is_word_boundary(text, index + 1):
+                    matches.setdefault(lexicon, []).append((start, index + 1, term))
+        return {lexicon: _leftmost_longest(found) for lexicon, found in matches.items()}
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+def _is_word_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not (text[index].isalnum() or text[index] == "_")
+
+
+def _leftmost_longest(matches: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    selected = []
+    last_end = -1
+    for start, end, term in sorted(matches, key=lambda match: (match[0], -match[1])):
+        if start >= last_end:
+            selected.append((start, end, term))
+            last_end = end
+    return selected
+
+
+LEXICON_MATCHER = LexiconMatcher({"vague_terms": VAGUE_TERMS, "biased_language": BIASED_TERMS})
+_VAGUE_TERMS = {normalize_term(term): explanation for term, explanation in VAGUE_TERMS.items()}
+_BIASED_TERMS = {normalize_term(term): entry for term, entry in BIASED_TERMS.items()}
+
+
+def _context(text: str, start: int, end: int) -> str:
+    snippet = " ".join(text[max(0, start - CONTEXT_CHARS):end + CONTEXT_CHARS].split())
+    return f"...{snippet}..."
+
+
+def find_lexicon_terms(text: str, offset: int = 0) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Returns the (vague_terms, biased_language) findings of one pass of the lexicon automaton."""
+    matches = LEXICON_MATCHER.find(text)
+    vague_terms = [
+        {"term": text[start:end], "explanation": _VAGUE_TERMS[term], "start": start + offset, "end": end + offset}
+        for start, end, term in matches.get("vague_terms", [])
+    ]
+    biased_language = []
+    for start, end, term in matches.get("biased_language", []):
+        entry = _BIASED_TERMS[term]
+        if entry is not None:
+            suggestion, reason = entry
+            biased_language.append({"phrase": text[start:end], "suggestion": suggestion, "reason": reason,
+                                    "start": start + offset, "end": end + offset})
+    return vague_terms, biased_language
+
+
+def external_reference_spans(text: str) -> List[Tuple[int, int]]:
+    """Sorted, non-overlapping (start, end) spans of the statute/regulation citations in text."""
+    spans = [(match.start(), match.end()) for pattern in EXTERNAL_REFERENCE_PATTERNS for match in pattern.finditer(text)]
+    return [(start, end) for start, end, _ in _leftmost_longest([(start, end, "") for start, end in spans])]
+
+
+def find_external_references(text: str, offset: int = 0, spans: Optional[List[Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
+    """Statute/regulation citations. Citations without a section or number are flagged 'ambiguous'."""
+    return [
+        {
+            "reference": text[start:end],
+            "status": "clear" if CITATION_HAS_NUMBER.search(text[start:end]) else "ambiguous",
+            "context": _context(text, start, end),
+            "start": start + offset,
+            "end": end + offset,
+        }
+        for start, end in (spans if spans is not None else external_reference_spans(text))
+    ]
+
+
+@dataclass
+class ClauseReference:
+    """An explicit reference from one clause to another, e.g. "subject to Section 7.2" inside clause 3."""
+    source: Optional[str] # Label of the clause containing the reference (None before the first heading)
+    target: str # Referenced clause label, normalized like chunking labels ("7.2", "IV")
+    text: str # The reference as written, e.g. "Section 7.2"
+    start: int
+    end: int
+    relation: str # One of the REFERENCE_RELATION_PATTERNS names, or "references"
+
+
+def _reference_relation(text: str, start: int) -> str:
+    preceding = REFERENCE_LIST_TAIL.sub("", text[max(0, start - RELATION_LOOKBEHIND_CHARS):start])
+    for relation, pattern in REFERENCE_RELATION_PATTERNS:
+        if pattern.search(preceding):
+            return relation
+    return "references"
+
+
+def iter_clause_references(text: str, external_spans: Optional[List[Tuple[int, int]]] = None) -> Iterator[ClauseReference]:
+    """
+    Finds explicit references between numbered clauses, attributing each to the clause whose
+    heading precedes it. Headings themselves, self-references and section numbers inside statute
+    citations ("Section 10(b) of the Securities Act") are skipped.
+    """
+    headings = [(match.start(), match.end(), (match.group("keyword_label") or match.group("number_label")).rstrip(".)").upper())
+                for match in CLAUSE_HEADING_PATTERN.finditer(text)]
+    if external_spans is None:
+        external_spans = external_reference_spans(text)
+    span_starts = [start for start, _ in external_spans]
+    heading_index = -1
+    for match in CLAUSE_REFERENCE_PATTERN.finditer(text):
+        span_index = bisect.bisect_right(span_starts, match.start()) - 1
+        if span_index >= 0 and match.start() < external_spans[span_index][1]:
+            continue
+        while heading_index + 1 < len(headings) and headings[heading_index + 1][0] <= match.start():
+            heading_index += 1
+        if heading_index >= 0 and match.start() < headings[heading_index][1]:
+            continue # The clause's own heading, not a reference
+        source = headings[heading_index][2] if heading_index >= 0 else None
+        target = match.group(1).upper()
+        if target != source:
+            yield ClauseReference(source, target, match.group(0), match.start(), match.end(),
+                                  _reference_relation(text, match.start()))
+
+
+def find_cross_references(text: str, offset: int = 0, external_spans: Optional[List[Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
+    """Clause references as inter-clause dependency entries (see iter_clause_references)."""
+    dependencies = []
+    for reference in iter_clause_references(text, external_spans):
+        source = f"Clause {reference.source}" if reference.source else "This text"
+        entry = {
+            "clause_id": reference.text,
+            "dependency_type": RELATION_DEPENDENCY_TYPES[reference.relation],
+            "description": RELATION_DESCRIPTIONS[reference.relation].format(source=source, reference=reference.text),
+            "start": reference.start + offset,
+            "end": reference.end + offset,
+        }
+        if reference.source:
+            entry["related_clause_id"] = reference.source
+        dependencies.append(entry)
+    return dependencies
+
+
+def preanalyze(text: str, offset: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Runs every local detector over text. Offsets in the findings are shifted by `offset`, so a
+    chunk can be analyzed on its own and still report positions in the full document.
+    """
+    vague_terms, biased_language = find_lexicon_terms(text, offset)
+    external_spans = external_reference_spans(text)
+    return {
+        "vague_terms": vague_terms,
+        "biased_language": biased_language,
+        "external_references": find_external_references(text, offset, external_spans),
+        CROSS_REFERENCE_FIELD: find_cross_references(text, offset, external_spans),
+    }
+
+
+def apply_local_findings(llm_output: Dict[str, Any], text: str, offset: int = 0) -> Dict[str, Any]:
+    """
+    Completes the output of the reduced (judgment-only) detailed analysis prompt: the locally
+    computed fields are set and clause references are added to the LLM's dependencies.
+    """
+    findings = preanalyze(text, offset)
+    completed = dict(llm_output)
+    for field_name in LOCAL_FIELDS:
+        completed[field_name] = findings[field_name]
+    llm_dependencies = completed.get(CROSS_REFERENCE_FIELD)
+    completed[CROSS_REFERENCE_FIELD] = (llm_dependencies if isinstance(llm_dependencies, list) else []) + findings[CROSS_REFERENCE_FIELD]
+    return completed
+
+
+def strip_local_findings(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a copy of a result without the locally computed entries (those with offsets), leaving the LLM's findings."""
+    stripped = dict(result)
+    for field_name in LOCAL_FIELDS + (CROSS_REFERENCE_FIELD,):
+        if isinstance(result.get(field_name), list):
+            stripped[field_name] = [
+                entry for entry in result[field_name] if not (isinstance(entry, dict) and isinstance(entry.get("start"), int))
+            ]
+    return stripped
+
+
+def shift_offsets(result: Dict[str, Any], delta: int) -> Dict[str, Any]:
+    """Returns a copy of a result with the offsets of its local findings moved by delta characters."""
+    if not delta:
+        return result
+    shifted = dict(result)
+    for field_name in LOCAL_FIELDS + (CROSS_REFERENCE_FIELD,):
+        if isinstance(result.get(field_name), list):
+            shifted[field_name] = [
+                {**entry, "start": entry["start"] + delta, "end": entry["end"] + delta}
+                if isinstance(entry, dict) and isinstance(entry.get("start"), int) else entry
+                for entry in result[field_name]
+            ]
+    return shifted
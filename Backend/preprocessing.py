@@ -0,0 +1,270 @@
+# preprocessing.py
+
+"""
+Token-reduction preprocessing between text extraction and prompting.
+
+Text extracted from PDFs repeats the page header and footer on every page and carries page
+numbers, words hyphenated across line breaks and runs of whitespace, all of which cost input
+tokens on every prompt. DocumentPreprocessor removes them page by page (and can drop blank
+signature fields and "signature page follows" / "exhibit to follow" placeholders) while recording
+an OffsetMap, so offsets found in the cleaned text can be mapped back to the original text.
+"""
+
+import math
+import re
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from chunking import CLAUSE_HEADING_PATTERN
+from preanalysis import CROSS_REFERENCE_FIELD, LOCAL_FIELDS
+from rate_limiter import CHARS_PER_TOKEN
+
+# Only the first and last few non-blank lines of a page can be running headers, footers or page numbers.
+EDGE_LINES = 3
+# An edge line is a running header/footer if it appears on at least this share of pages (and on at least two).
+REPEAT_FRACTION = 0.5
+
+PAGE_NUMBER_PATTERN = re.compile(
+    r"^[-–—(\[]?\s*(?:page\s+)?(?:\d{1,4}|[ivxlc]{1,7})(?:\s*(?:of|/)\s*\d{1,4})?\s*[-–—)\]]?$",
+    re.IGNORECASE,
+)
+
+# Whole lines dropped when drop_boilerplate is set. Filled-in signature details are kept.
+BOILERPLATE_LINE_PATTERNS = [
+    re.compile(r"^(?:by|name|title|date|its|signature|signed)\s*:?\s*_{2,}[\s_]*$", re.IGNORECASE), # Blank signature fields
+    re.compile(r"^[_\s]*_{3,}[_\s]*$"), # Signature rules
+    re.compile(
+        r"^[\[(]?\s*(?:\[?signature pages? follows?\]?|signatures? (?:appear )?on (?:the )?following page"
+        r"|(?:the )?remainder of (?:this )?page (?:is )?(?:intentionally )?(?:left )?blank[^\])]{0,60}"
+        r"|(?:this )?page (?:is )?intentionally left blank)\s*[\])]?\.?$",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"^[\[(]?\s*(?:exhibits?|schedules?|annex(?:es)?|appendi(?:x|ces))\b.{0,40}?"
+        r"\b(?:follows?|to follow|intentionally omitted|omitted|reserved)\s*[\])]?\.?$",
+        re.IGNORECASE,
+    ),
+]
+
+LINE_PATTERN = re.compile(r"[^\n]*\n|[^\n]+")
+HORIZONTAL_SPACE = " \t\r\f\v\u00a0"
+COLLAPSIBLE_SPACE_PATTERN = re.compile(r"[ \t\r\f\v\u00a0]{2,}|[\t\r\f\v\u00a0]")
+HYPHENATED_END_PATTERN = re.compile(r"[A-Za-z]{2}-$")
+PAGE_BREAK_PATTERN = re.compile(r"(?<=\f)")
+
+
+def line_signature(line: str) -> str:
+    """Header/footer identity of a line: case, spacing and numbers (dates, page numbers) are ignored."""
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def split_pages(text: str) -> List[str]:
+    """Splits plain text on form feeds, the page separator of pasted or converted PDF text."""
+    return [page for page in PAGE_BREAK_PATTERN.split(text) if page]
+
+
+@dataclass
+class OffsetMap:
+    """Maps positions in the cleaned text back to the original text; one anchor per verbatim run."""
+    clean_starts: List[int] = field(default_factory=list)
+    original_starts: List[int] = field(default_factory=list)
+
+    def to_original(self, position: int) -> int:
+        index = bisect_right(self.clean_starts, position) - 1
+        if index < 0:
+            return position
+        return self.original_starts[index] + position - self.clean_starts[index]
+
+    def span_to_original(self, start: int, end: int) -> Tuple[int, int]:
+        """Maps a [start, end) span; the end is mapped from its last character, so it never lands in a removed gap."""
+        original_start = self.to_original(start)
+        return original_start, (self.to_original(end - 1) + 1 if end > start else original_start)
+
+
+class DocumentPreprocessor:
+    """
+    Cleans a document fed page by page (or paragraph by paragraph for DOCX, with paged=False).
+    Running headers and footers are learned from the first sample_pages pages: until then feed()
+    returns nothing, afterwards it returns each page's cleaned text right away, so streamed
+    extraction keeps overlapping with analysis. With sample_pages=None the whole document is
+    used for detection and everything is returned by finish().
+    Offsets of the cleaned text are the positions in the concatenation of everything returned.
+    """
+
+    def __init__(self, paged: bool = True, drop_boilerplate: bool = False, sample_pages: Optional[int] = None):
+        self.paged = paged
+        self.drop_boilerplate = drop_boilerplate
+        self.sample_pages = sample_pages
+        self.offset_map = OffsetMap()
+        self.original_chars = 0
+        self.removed = {"repeated_lines": 0, "page_numbers": 0, "boilerplate_lines": 0, "hyphenations": 0}
+        self._pending: List[Tuple[str, int]] = []
+        self._repeated: Optional[Set[Tuple[str, int, str]]] = None
+        self._parts: List[str] = []
+        self._clean_length = 0
+        self._run_end = -1 # Original offset right after the last verbatim emission
+        self._trailing_newlines = 2 # Blank lines at the start of the document are dropped
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, segment: str) -> str:
+        """Adds the next page or paragraph of the original text and returns the text cleaned so far."""
+        self._pending.append((segment, self.original_chars))
+        self.original_chars += len(segment)
+        if self._repeated is None and (self.sample_pages is None or len(self._pending) < self.sample_pages):
+            return ""
+        return self._flush()
+
+    def finish(self) -> str:
+        """Cleans whatever is still buffered and returns it."""
+        return self._flush()
+
+    def stats(self) -> Dict[str, Any]:
+        original_tokens = self.original_chars // CHARS_PER_TOKEN
+        clean_tokens = self._clean_length // CHARS_PER_TOKEN
+        return {
+            "original_chars": self.original_chars,
+            "clean_chars": self._clean_length,
+            "original_tokens": original_tokens,
+            "clean_tokens": clean_tokens,
+            "tokens_saved": max(0, original_tokens - clean_tokens),
+            "removed": dict(self.removed),
+        }
+
+    def _flush(self) -> str:
+        if self._repeated is None:
+            self._repeated = self._learn_repeated_lines([segment for segment, _ in self._pending]) if self.paged else set()
+        first_part = len(self._parts)
+        for segment, start in self._pending:
+            self._clean_page(segment, start)
+        self._pending = []
+        return "".join(self._parts[first_part:])
+
+    @staticmethod
+    def _edge_positions(contents: List[str]) -> Dict[int, Tuple[str, int]]:
+        """Line index -> (page edge, distance from it) for the first and last EDGE_LINES non-blank lines."""
+        non_blank = [index for index, content in enumerate(contents) if content.strip(HORIZONTAL_SPACE)]
+        positions = {index: ("bottom", distance) for distance, index in enumerate(reversed(non_blank[-EDGE_LINES:]))}
+        positions.update({index: ("top", distance) for distance, index in enumerate(non_blank[:EDGE_LINES])})
+        return positions
+
+    def _learn_repeated_lines(self, pages: List[str]) -> Set[Tuple[str, int, str]]:
+        """Running headers/footers: lines repeated at the same distance from the same page edge."""
+        counts: Counter = Counter()
+        for page in pages:
+            contents = page.split("\n")
+            signatures = set()
+            for index, position in self._edge_positions(contents).items():
+                line = contents[index].strip(HORIZONTAL_SPACE)
+                # Clause headings ("Section 4. Term") are never treated as running headers.
+                if len(line) >= 3 and not PAGE_NUMBER_PATTERN.match(line) and not CLAUSE_HEADING_PATTERN.match(line):
+                    signatures.add(position + (line_signature(line),))
+            counts.update(signatures)
+        threshold = max(2, math.ceil(REPEAT_FRACTION * len(pages)))
+        return {signature for signature, count in counts.items() if count >= threshold}
+
+    def _dropped_line_kind(self, line: str, position: Optional[Tuple[str, int]]) -> Optional[str]:
+        if position is not None and self.paged:
+            if PAGE_NUMBER_PATTERN.match(line):
+                return "page_numbers"
+            if position + (line_signature(line),) in self._repeated:
+                return "repeated_lines"
+        if self.drop_boilerplate and any(pattern.match(line) for pattern in BOILERPLATE_LINE_PATTERNS):
+            return "boilerplate_lines"
+        return None
+
+    def _emit(self, text: str, original_start: int) -> None:
+        if not text:
+            return
+        if original_start != self._run_end:
+            self.offset_map.clean_starts.append(self._clean_length)
+            self.offset_map.original_starts.append(original_start)
+        self._parts.append(text)
+        self._clean_length += len(text)
+        self._run_end = original_start + len(text)
+
+    def _emit_line_body(self, body: str, original_start: int) -> None:
+        """Emits a line with every run of horizontal whitespace collapsed to one space."""
+        position = 0
+        for match in COLLAPSIBLE_SPACE_PATTERN.finditer(body):
+            self._emit(body[position:match.start()], original_start + position)
+            self._emit(" ", original_start + match.start())
+            position = match.end()
+        self._emit(body[position:], original_start + position)
+
+    def _clean_page(self, page: str, page_start: int) -> None:
+        lines = [(match.start(), match.group()) for match in LINE_PATTERN.finditer(page)]
+        contents = [raw[:-1] if raw.endswith("\n") else raw for _, raw in lines]
+        edges = self._edge_positions(contents)
+
+        kept: List[int] = []
+        for index, content in enumerate(contents):
+            line = content.strip(HORIZONTAL_SPACE)
+            kind = self._dropped_line_kind(line, edges.get(index)) if line else None
+            if kind:
+                self.removed[kind] += 1
+            else:
+                kept.append(index)
+
+        for position, index in enumerate(kept):
+            line_start, raw = lines[index]
+            content = contents[index]
+            lead = len(content) - len(content.lstrip(HORIZONTAL_SPACE))
+            body_end = len(content.rstrip(HORIZONTAL_SPACE))
+            if body_end <= lead:
+                # Blank line: at most one in a row survives, as a paragraph break.
+                if self._trailing_newlines < 2 and raw.endswith("\n"):
+                    self._emit("\n", page_start + line_start + len(content))
+                    self._trailing_newlines += 1
+                continue
+
+            body = content[lead:body_end]
+            next_line = contents[kept[position + 1]].lstrip(HORIZONTAL_SPACE) if position + 1 < len(kept) else ""
+            if raw.endswith("\n") and HYPHENATED_END_PATTERN.search(body) and next_line[:1].islower():
+                # "termi-\nnation" -> "termination"
+                self._emit_line_body(body[:-1], page_start + line_start + lead)
+                self.removed["hyphenations"] += 1
+                self._trailing_newlines = 0
+                continue
+
+            self._emit_line_body(body, page_start + line_start + lead)
+            if body_end < len(raw):
+                # The line break (or the page's trailing form feed) becomes a single newline.
+                self._emit("\n", page_start + line_start + body_end)
+                self._trailing_newlines = 1
+            else:
+                self._trailing_newlines = 0
+
+
+def preprocess_document(segments: Iterable[str], paged: bool = True, drop_boilerplate: bool = False) -> DocumentPreprocessor:
+    """Cleans a whole document at once, detecting running headers and footers across all of its pages."""
+    preprocessor = DocumentPreprocessor(paged, drop_boilerplate)
+    for segment in segments:
+        preprocessor.feed(segment)
+    preprocessor.finish()
+    return preprocessor
+
+
+# Result fields whose entries carry 'start'/'end' offsets: the local findings and the per-chunk statuses
+OFFSET_FIELDS = LOCAL_FIELDS + (CROSS_REFERENCE_FIELD, "chunk_status")
+
+
+def map_result_offsets(result: Dict[str, Any], offset_map: OffsetMap) -> Dict[str, Any]:
+    """Returns a copy of a result with the offsets of its local findings and chunks mapped back to the original text."""
+    mapped = dict(result)
+    for field_name in OFFSET_FIELDS:
+        if isinstance(result.get(field_name), list):
+            mapped[field_name] = [
+                _map_entry(entry, offset_map) if isinstance(entry, dict) and isinstance(entry.get("start"), int) else entry
+                for entry in result[field_name]
+            ]
+    return mapped
+
+
+def _map_entry(entry: Dict[str, Any], offset_map: OffsetMap) -> Dict[str, Any]:
+    start, end = offset_map.span_to_original(entry["start"], entry["end"])
+    return {**entry, "start": start, "end": end}
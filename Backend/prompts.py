@@ -274,5 +274,40 @@ PROMPT_TEMPLATES = {
             "Legal Text Chunk to Analyze: \"\"\"{{chunk}}\"\"\""
             "\n\nOutput only the JSON object."
         ),
+        # Judgment-only variant: vague terms, biased language, external references and explicit
+        # clause references are found locally (see preanalysis.py) and merged into the result.
+        (
+            "Your task is to perform a comprehensive analysis of the provided legal text chunk. "
+            "Identify and categorize risk, inter-clause dependencies, red flags, compounding risks, "
+            "structural complexities, exception clauses and jurisdictional risks. "
+            "Output your findings as a single JSON object. DO NOT include any conversational text, "
+            "explanations, or additional formatting outside the JSON object.\n\n"
+            "The JSON object must have the following primary keys. If a category has no findings, provide an empty list or appropriate default:\n"
+            "{\n"
+            "  \"risk_level\": \"High\" | \"Medium\" | \"Low\" | \"Neutral\",\n"
+            "  \"simplified_explanation\": \"A concise, plain language summary of the chunk's main points and any identified risks or key obligations.\",\n"
+            "  \"inter_clause_dependencies\": [\n"
+            "    {\"clause_id\": \"[reference ID if applicable]\", \"dependency_type\": \"reinforces\" | \"modifies\" | \"contradicts\" | \"sets_condition_for\", \"description\": \"Explain the nature of the dependency.\"}\n"
+            "  ],\n"
+            "  \"red_flags\": [\n"
+            "    {\"type\": \"hidden_obligation\" | \"loophole\" | \"disproportionate_risk\" | \"unclear_carveout\", \"description\": \"Detailed explanation of the red flag and its implications.\"}\n"
+            "  ],\n"
+            "  \"compounding_risks\": [\n"
+            "    {\"description\": \"Explanation of how multiple clauses interact to create amplified risk.\", \"clauses_involved\": [\"[clause_ref1]\", \"[clause_ref2]\"]}\n"
+            "  ],\n"
+            "  \"structural_elements\": [\n"
+            "    {\"type\": \"preamble\" | \"savings_clause\" | \"conditional_logic\" | \"nested_dependency\" | \"excessive_cross_references\" | \"redundant_phrasing\" | \"overly_detailed_definitions\", \"description\": \"Explanation of the structural element and its impact on clarity/complexity.\"}\n"
+            "  ],\n"
+            "  \"exception_clauses\": [\n"
+            "    {\"clause_text\": \"[exception clause snippet]\", \"assessment\": \"Does it create a loophole? Explain.\"}\n"
+            "  ],\n"
+            "  \"jurisdictional_risks\": [\n"
+            "    {\"clause_text\": \"[clause snippet]\", \"jurisdictions\": [\"California\", \"Delaware\"], \"potential_divergence\": \"Explanation of how interpretation might differ.\"}\n"
+            "  ]\n"
+            "}\n\n"
+            "Do not list plain cross-references such as 'see Section 5' as dependencies; only describe how clauses modify, condition, reinforce or contradict each other.\n\n"
+            "Legal Text Chunk to Analyze: \"\"\"{{chunk}}\"\"\""
+            "\n\nOutput only the JSON object."
+        ),
     ],
 }
\ No newline at end of file
@@ -0,0 +1,202 @@
+# rate_limiter.py
+
+"""
+Client-side LLM quota limiting.
+
+Every LLM call acquires capacity from two token buckets, one for requests per minute and one for
+(estimated) tokens per minute, so calls are spread out to stay just under the provider quota
+instead of bursting into 429 errors. Waiting calls are admitted in priority order, so interactive
+requests overtake bulk jobs. After a 429 the limiter pauses all admissions for the back-off delay.
+
+The bucket state lives in a quota store: LocalQuota keeps it in this process, while
+shared_state.SQLiteQuota keeps it in a file shared by every worker on the host, so that several
+workers together stay within one quota (the priority queue stays per process). Stores that block
+(blocking = True: file transactions that may wait on other workers) are called in the default
+executor, so the event loop keeps running meanwhile.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Lower values are admitted first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Priority of the LLM calls made by the current task; job workers set this for the jobs they run.
+llm_priority: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+# Rough average for English text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float) -> float:
+    """Exponential back-off with full jitter for the given (0-based) retry attempt."""
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+async def run_blocking(store: Any, method: Callable[..., T], *args: Any) -> T:
+    """Calls a store method: in the default executor if the store blocks (SQLite-backed), otherwise inline."""
+    if not getattr(store, "blocking", False):
+        return method(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+
+class TokenBucket:
+    """Classic token bucket holding up to `capacity` tokens, refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are available now)."""
+        self._refill()
+        missing = amount - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def consume(self, amount: float) -> None:
+        # Tokens may go negative when actual usage exceeds the estimate; the debt delays later calls.
+        self._refill()
+        self.tokens -= amount
+
+
+class LocalQuota:
+    """
+    Request and token buckets of a single process. Quota stores implement try_acquire, consume_tokens,
+    pause and stats; see shared_state.SQLiteQuota for the one shared between workers.
+    """
+
+    blocking = False # Cheap in-memory updates, made on the event loop
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self.tokens_capacity = tokens_per_minute
+        self._paused_until = 0.0
+
+    def try_acquire(self, estimated_tokens: float) -> float:
+        """Takes one request and estimated_tokens if both are available; otherwise returns the seconds to wait first."""
+        delay = max(
+            self._paused_until - time.monotonic(),
+            self.requests.time_until(1),
+            self.tokens.time_until(estimated_tokens),
+        )
+        if delay <= 0:
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+        return delay
+
+    def consume_tokens(self, amount: float) -> None:
+        self.tokens.consume(amount)
+
+    def pause(self, delay_seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + delay_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_available": round(self.requests.tokens, 2),
+            "requests_per_minute": self.requests.capacity,
+            "tokens_available": round(self.tokens.tokens, 2),
+            "tokens_per_minute": self.tokens.capacity,
+            "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+        }
+
+
+class LLMRateLimiter:
+    """
+    Admits LLM calls against request and token budgets, serving waiters in priority order.
+    The budgets are kept in `quota` (by default a LocalQuota of this process).
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, quota: Optional[Any] = None):
+        self.quota = quota or LocalQuota(requests_per_minute, tokens_per_minute)
+        self._waiters: List[list] = [] # Heap of [priority, sequence, tokens, future]
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.counters = {"admitted": 0, "rate_limited": 0, "wait_seconds": 0.0, "tokens_estimated": 0, "tokens_actual": 0}
+
+    async def acquire(self, estimated_tokens: int, priority: Optional[int] = None) -> None:
+        """Waits until the call fits within both budgets and no higher-priority call is waiting."""
+        if priority is None:
+            priority = llm_priority.get()
+        # A single call larger than the whole per-minute budget is admitted once the bucket is full.
+        estimated_tokens = min(estimated_tokens, self.quota.tokens_capacity)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), estimated_tokens, future])
+        self._wake()
+        started = time.monotonic()
+        await future
+        self.counters["wait_seconds"] += time.monotonic() - started
+
+    async def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Corrects the token budget once the real token count of a call is known."""
+        self.counters["tokens_estimated"] += estimated_tokens
+        if actual_tokens is not None:
+            self.counters["tokens_actual"] += actual_tokens
+            await run_blocking(self.quota, self.quota.consume_tokens,
+                               actual_tokens - min(estimated_tokens, self.quota.tokens_capacity))
+
+    async def penalize(self, delay_seconds: float) -> None:
+        """Pauses all admissions after the provider reported a rate limit (429)."""
+        self.counters["rate_limited"] += 1
+        await run_blocking(self.quota, self.quota.pause, delay_seconds)
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            waiter = self._waiters[0]
+            priority, _, estimated_tokens, future = waiter
+            if future.done(): # The caller was cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            delay = await run_blocking(self.quota, self.quota.try_acquire, estimated_tokens)
+            if delay <= 0:
+                # Waiters queued while a blocking store was being asked may now be ahead of this one.
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self.counters["admitted"] += 1
+                if not future.done(): # Otherwise cancelled meanwhile: the admission is lost, like an unused call
+                    future.set_result(None)
+                continue
+            # Sleep until capacity frees up, or until a new (possibly higher-priority) waiter or a 429 arrives.
+            # (With a shared quota another worker may take it first; the waiter then just tries again.)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "waiting": sum(1 for waiter in self._waiters if not waiter[3].done()),
+            **await run_blocking(self.quota, self.quota.stats),
+        }
@@ -0,0 +1,321 @@
+# shared_state.py
+
+"""
+State shared between the worker processes of a deployment.
+
+Each uvicorn worker is a separate process, so anything kept in module globals (the quota
+buckets, the calls in flight) is per worker: with four workers the LLM quota is overshot four
+times over and four concurrent identical requests make four LLM calls. The stores here hold that
+state behind two small interfaces, so the backend can be swapped:
+
+- LocalQuota (rate_limiter.py) and LocalLeases keep it in process: the single-worker stand-in.
+- SQLiteQuota and SQLiteLeases keep it in a SQLite file (WAL mode, short IMMEDIATE transactions)
+  that every worker on a host opens, with wall-clock timestamps so all processes agree.
+
+A deployment across hosts plugs in a network store (e.g. Redis) implementing the same methods.
+RequestCoalescer builds the cluster-wide single flight on top of a LeaseStore and the shared
+result cache: the worker holding a key's lease makes the LLM call and stores the output, and the
+others wait for it to appear in the cache.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from rate_limiter import LocalQuota, run_blocking
+
+
+class LeaseStore(ABC):
+    """Interface of lease stores: time-limited, owner-tagged locks on string keys."""
+
+    blocking = False # True if calls may block (e.g. on a file lock): RequestCoalescer then makes them off the event loop
+
+    @abstractmethod
+    def try_acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        """Takes the lease if it is free, expired or already held by owner (which extends it)."""
+
+    @abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """Gives up the lease if owner holds it."""
+
+    @abstractmethod
+    def holder(self, key: str) -> Optional[str]:
+        """The owner of a live lease on key, or None."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Backend name and number of live leases."""
+
+
+class LocalLeases(LeaseStore):
+    """In-process leases: coalescing within one worker only."""
+
+    def __init__(self):
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(key)
+            if current is not None and current[1] > now and current[0] != owner:
+                return False
+            self._leases[key] = (owner, now + ttl_seconds)
+            return True
+
+    def release(self, key: str, owner: str) -> None:
+        with self._lock:
+            if self._leases.get(key, (None,))[0] == owner:
+                del self._leases[key]
+
+    def holder(self, key: str) -> Optional[str]:
+        current = self._leases.get(key)
+        return current[0] if current is not None and current[1] > time.time() else None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {"backend": "local", "leases": sum(1 for _, expires_at in self._leases.values() if expires_at > now)}
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # A busy timeout instead of immediate 'database is locked' errors when workers write at once
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class SQLiteLeases(LeaseStore):
+    """Leases in a SQLite file shared by the workers of a host. Called off the event loop (blocking)."""
+
+    blocking = True # Writes may wait up to the busy timeout on other workers' transactions
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def try_acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            # A single upsert, so two workers can't both take the lease
+            cursor = self._conn.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET owner = excluded.owner,"
+                " expires_at = excluded.expires_at WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+                (key, owner, now + ttl_seconds, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def holder(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT owner FROM leases WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            # Leases of crashed workers are only replaced when their key comes up again; clear them here.
+            self._conn.execute("DELETE FROM leases WHERE expires_at <= ?", (time.time(),))
+            leases = self._conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "leases": leases}
+
+
+class SQLiteQuota:
+    """
+    The request and token buckets of LocalQuota, kept in a SQLite file so every worker on the host
+    draws from the same per-minute budgets. Each admission is one IMMEDIATE transaction, which may
+    wait for other workers' transactions, so LLMRateLimiter calls it off the event loop (blocking).
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, requests_per_minute: int, tokens_per_minute: int):
+        self.path = path
+        self.capacities = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.tokens_capacity = tokens_per_minute
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS quota (name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)")
+        now = time.time()
+        self._conn.executemany("INSERT OR IGNORE INTO quota VALUES (?, ?, ?)",
+                               [("requests", self.capacities["requests"], now), ("tokens", self.capacities["tokens"], now),
+                                ("paused_until", 0.0, now)])
+
+    def _transaction(self, update: Callable[[Dict[str, float], float], Any]) -> Any:
+        """Runs update(levels, now) on the refilled bucket levels in one transaction and writes the levels back."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                levels = {}
+                for name, level, updated_at in self._conn.execute("SELECT name, level, updated_at FROM quota"):
+                    if name in self.capacities:
+                        level = min(self.capacities[name], level + max(0.0, now - updated_at) * self.capacities[name] / 60.0)
+                    levels[name] = level
+                outcome = update(levels, now)
+                self._conn.executemany("UPDATE quota SET level = ?, updated_at = ? WHERE name = ?",
+                                       [(level, now, name) for name, level in levels.items()])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return outcome
+
+    def try_acquire(self, estimated_tokens: float) -> float:
+        """Takes one request and estimated_tokens if both are available; otherwise returns the seconds to wait first."""
+
+        def take(levels: Dict[str, float], now: float) -> float:
+            delay = max(
+                levels["paused_until"] - now,
+                (1 - levels["requests"]) * 60.0 / self.capacities["requests"],
+                (estimated_tokens - levels["tokens"]) * 60.0 / self.capacities["tokens"],
+            )
+            if delay <= 0:
+                levels["requests"] -= 1
+                levels["tokens"] -= estimated_tokens
+            return delay
+
+        return self._transaction(take)
+
+    def consume_tokens(self, amount: float) -> None:
+        def consume(levels: Dict[str, float], now: float) -> None:
+            levels["tokens"] -= amount # May go negative: the debt delays later calls
+        self._transaction(consume)
+
+    def pause(self, delay_seconds: float) -> None:
+        def pause(levels: Dict[str, float], now: float) -> None:
+            levels["paused_until"] = max(levels["paused_until"], now + delay_seconds)
+        self._transaction(pause)
+
+    def stats(self) -> Dict[str, Any]:
+        levels = self._transaction(lambda levels, now: dict(levels, now=now))
+        return {
+            "requests_available": round(levels["requests"], 2),
+            "requests_per_minute": self.capacities["requests"],
+            "tokens_available": round(levels["tokens"], 2),
+            "tokens_per_minute": self.capacities["tokens"],
+            "paused_for_seconds": round(max(0.0, levels["paused_until"] - levels["now"]), 2),
+            "shared_path": self.path,
+        }
+
+
+def create_shared_state(kind: str, path: str, requests_per_minute: int, tokens_per_minute: int) -> Tuple[Any, LeaseStore]:
+    """Returns the (quota store, lease store) of a backend: 'local' (one worker) or 'sqlite' (all workers on a host)."""
+    if kind == "local":
+        return LocalQuota(requests_per_minute, tokens_per_minute), LocalLeases()
+    if kind == "sqlite":
+        return SQLiteQuota(path, requests_per_minute, tokens_per_minute), SQLiteLeases(path)
+    raise ValueError(f"Unknown shared state backend: '{kind}'. Available backends are: local, sqlite")
+
+
+class _CallAbandoned(Exception):
+    """Set on a key's shared future when the caller making the call was cancelled, so its waiters take over."""
+
+
+class RequestCoalescer:
+    """
+    Single flight for identical LLM calls (same cache key). Within a worker, concurrent callers await
+    the first caller's result. Across workers, the first to take the key's lease makes the call (the
+    lease is renewed while it runs, and expires if the worker dies); the others poll lookup(), the
+    shared result cache, until the output lands there, or take over once the lease is gone without it
+    (the call failed, or its output wasn't cacheable).
+    """
+
+    def __init__(self, leases: LeaseStore, owner: str, lease_seconds: float = 30.0,
+                 poll_seconds: float = 0.05, max_poll_seconds: float = 1.0):
+        self.leases = leases
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.counters = {"calls": 0, "coalesced_local": 0, "coalesced_remote": 0, "takeovers": 0}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[str]], lookup: Callable[[], Awaitable[Optional[str]]]) -> Tuple[str, str]:
+        """
+        Returns the output for key and how it was obtained: 'call' (this caller made the LLM call),
+        'local' (awaited another request of this worker) or 'remote' (another worker's call, read from
+        the cache). call() must store a cacheable output where lookup() finds it.
+        """
+        while key in self._in_flight:
+            try:
+                output = await asyncio.shield(self._in_flight[key])
+            except _CallAbandoned:
+                continue
+            self.counters["coalesced_local"] += 1
+            return output, "local"
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            output, source = await self._run_once(key, call, lookup)
+            future.set_result(output)
+            return output, source
+        except BaseException as e:
+            future.set_exception(_CallAbandoned() if isinstance(e, asyncio.CancelledError) else e)
+            future.exception() # Marks it retrieved, in case no other caller was waiting
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _run_once(self, key: str, call: Callable[[], Awaitable[str]], lookup: Callable[[], Awaitable[Optional[str]]]) -> Tuple[str, str]:
+        waited = False
+        while True:
+            if await self._try_acquire(key):
+                try:
+                    # Another worker may have stored the output between our cache miss and the lease.
+                    output = await lookup()
+                    if output is not None:
+                        self.counters["coalesced_remote"] += 1
+                        return output, "remote"
+                    if waited:
+                        self.counters["takeovers"] += 1
+                    self.counters["calls"] += 1
+                    renewal = asyncio.ensure_future(self._renew(key))
+                    try:
+                        return await call(), "call"
+                    finally:
+                        renewal.cancel()
+                finally:
+                    self._release(key)
+
+            waited = True
+            delay = self.poll_seconds
+            while await run_blocking(self.leases, self.leases.holder, key) is not None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_seconds)
+                output = await lookup()
+                if output is not None:
+                    self.counters["coalesced_remote"] += 1
+                    return output, "remote"
+
+    async def _renew(self, key: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await run_blocking(self.leases, self.leases.try_acquire, key, self.owner, self.lease_seconds)
+
+    async def _try_acquire(self, key: str) -> bool:
+        attempt = asyncio.ensure_future(run_blocking(self.leases, self.leases.try_acquire, key, self.owner, self.lease_seconds))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            # The store call still completes; give back a lease it took for this cancelled caller.
+            attempt.add_done_callback(lambda done: done.cancelled() or done.exception() or not done.result() or self._release(key))
+            raise
+
+    def _release(self, key: str) -> None:
+        # Not awaited, so the lease is released even when the caller is being cancelled.
+        if self.leases.blocking:
+            asyncio.get_running_loop().run_in_executor(None, self.leases.release, key, self.owner)
+        else:
+            self.leases.release(key, self.owner)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "in_flight": len(self._in_flight), "owner": self.owner,
+                **await run_blocking(self.leases, self.leases.stats)}
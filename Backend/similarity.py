@@ -0,0 +1,200 @@
+# similarity.py
+
+"""
+Near-duplicate clause index for reusing analyses.
+
+The result cache only hits when a chunk's text is identical after whitespace normalization, but
+most repeat traffic is boilerplate that differs in party names, dates, amounts or numbering.
+SimilarityIndex keeps a MinHash signature of every analyzed chunk (word shingles of the text with
+numbers and dates masked) in a persistent SQLite store, bucketed by LSH bands, so a new chunk can
+be matched against all previous ones by looking up only the entries that share a band with it.
+A match at or above the similarity threshold (estimated Jaccard similarity of the shingle sets)
+returns the stored analysis.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 64
+BAND_ROWS = 4 # 16 bands of 4 rows: pairs above ~0.5 similarity share a band with high probability
+MERSENNE_PRIME = (1 << 61) - 1
+
+MONTH_PATTERN = re.compile(
+    r"\b(?:jan(?:uary)?|feb(?:ruary)?|march|apr(?:il)?|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?"
+    r"|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+)
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+WORD_PATTERN = re.compile(r"[a-z#]+")
+
+
+def _permutations() -> List[tuple]:
+    """Fixed (a, b) pairs for the universal hashes (a * x + b) mod p, derived deterministically so signatures persist."""
+    pairs = []
+    for index in range(NUM_PERMUTATIONS):
+        digest = hashlib.sha256(f"minhash-{index}".encode("ascii")).digest()
+        a = int.from_bytes(digest[:8], "big") % (MERSENNE_PRIME - 1) + 1
+        b = int.from_bytes(digest[8:16], "big") % MERSENNE_PRIME
+        pairs.append((a, b))
+    return pairs
+
+
+PERMUTATIONS = _permutations()
+
+
+def similarity_tokens(text: str) -> List[str]:
+    """
+    Words of a clause with case, punctuation, numbers (amounts, dates, section numbers) and most
+    month names masked ("May" is left alone, as it is far more often the verb).
+    """
+    text = MONTH_PATTERN.sub("#", NUMBER_PATTERN.sub("#", text.lower()))
+    return WORD_PATTERN.findall(text)
+
+
+def minhash_signature(text: str) -> List[int]:
+    """MinHash of the text's word shingles; pure Python, so compute it off the event loop."""
+    tokens = similarity_tokens(text)
+    shingles = {" ".join(tokens[index:index + SHINGLE_WORDS]) for index in range(max(1, len(tokens) - SHINGLE_WORDS + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles]
+    return [min((a * value + b) % MERSENNE_PRIME for value in hashes) for a, b in PERMUTATIONS]
+
+
+def signature_similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Estimated Jaccard similarity: the share of MinHash components two signatures agree on."""
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def band_buckets(signature: Sequence[int]) -> List[int]:
+    """One LSH bucket id per band; the band number is hashed in, so all bands share one column."""
+    buckets = []
+    for band in range(0, len(signature), BAND_ROWS):
+        material = struct.pack(f">I{BAND_ROWS}Q", band, *signature[band:band + BAND_ROWS])
+        buckets.append(int.from_bytes(hashlib.blake2b(material, digest_size=7).digest(), "big"))
+    return buckets
+
+
+@dataclass
+class SimilarMatch:
+    entry_id: int
+    similarity: float
+    result: Dict[str, Any]
+
+
+class SimilarityIndex:
+    """
+    Persistent MinHash/LSH index of analyzed chunks (path=":memory:" keeps it in process only).
+    Entries are scoped like cache entries, by prompt type, template fingerprint and model, and the
+    least recently used are evicted past max_entries. With shared=True other worker processes add
+    to the same file, so the entry count is re-read from it before evicting. Lookups and stores
+    block on SQLite, so callers on the event loop go through rate_limiter.run_blocking.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, threshold: float = 0.85, max_entries: int = 50000, shared: bool = False):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lock = threading.Lock()
+        # Counters have their own lock, so recording a lookup on the event loop never waits on SQLite I/O under _lock.
+        self._counters_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS similar_chunks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, signature BLOB NOT NULL,"
+            " result TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS similar_chunk_bands (bucket INTEGER NOT NULL, chunk_id INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS similar_chunk_bands_bucket ON similar_chunk_bands (bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS similar_chunks_last_used ON similar_chunks (last_used)")
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM similar_chunks").fetchone()[0]
+        self.counters = {"lookups": 0, "reused": 0, "rejected_by_verification": 0, "stores": 0, "evictions": 0}
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+
+    @staticmethod
+    def scope(prompt_type: str, template_hash: str, model_name: str) -> str:
+        return f"{prompt_type}:{template_hash}:{model_name}"
+
+    def find(self, scope: str, signature: List[int], threshold: Optional[float] = None) -> Optional[SimilarMatch]:
+        """Returns the most similar stored chunk at or above the threshold (by default self.threshold), or None."""
+        threshold = self.threshold if threshold is None else threshold
+        buckets = band_buckets(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, signature, result FROM similar_chunks WHERE scope = ? AND id IN ("
+                f" SELECT chunk_id FROM similar_chunk_bands WHERE bucket IN ({', '.join('?' * len(buckets))}))",
+                [scope] + buckets,
+            ).fetchall()
+            best = None
+            for entry_id, packed, result in rows:
+                similarity = signature_similarity(signature, struct.unpack(f">{NUM_PERMUTATIONS}Q", packed))
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (entry_id, similarity, result)
+            if best is None:
+                return None
+            self._conn.execute("UPDATE similar_chunks SET last_used = ? WHERE id = ?", (time.time(), best[0]))
+        return SimilarMatch(best[0], best[1], json.loads(best[2]))
+
+    def add(self, scope: str, signature: List[int], result: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO similar_chunks (scope, signature, result, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (scope, struct.pack(f">{NUM_PERMUTATIONS}Q", *signature), json.dumps(result), now, now),
+            )
+            self._conn.executemany("INSERT INTO similar_chunk_bands VALUES (?, ?)",
+                                   [(bucket, cursor.lastrowid) for bucket in band_buckets(signature)])
+            self._entries += 1
+            evicted = self._evict()
+        with self._counters_lock:
+            self.counters["stores"] += 1
+            self.counters["evictions"] += evicted
+
+    def _evict(self) -> int:
+        if self.shared:
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM similar_chunks").fetchone()[0]
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return 0
+        doomed = [row[0] for row in self._conn.execute("SELECT id FROM similar_chunks ORDER BY last_used LIMIT ?", (excess,))]
+        placeholders = ", ".join("?" * len(doomed))
+        self._conn.execute(f"DELETE FROM similar_chunk_bands WHERE chunk_id IN ({placeholders})", doomed)
+        self._conn.execute(f"DELETE FROM similar_chunks WHERE id IN ({placeholders})", doomed)
+        self._entries -= len(doomed)
+        return len(doomed)
+
+    def record_lookup(self, seconds: float, outcome: str) -> None:
+        """Counts a lookup that took `seconds`, with outcome 'reused', 'rejected' (by verification) or 'miss'."""
+        with self._counters_lock:
+            self.counters["lookups"] += 1
+            if outcome == "reused":
+                self.counters["reused"] += 1
+            elif outcome == "rejected":
+                self.counters["rejected_by_verification"] += 1
+            self.lookup_seconds += seconds
+            self.max_lookup_seconds = max(self.max_lookup_seconds, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counters_lock:
+            counters = dict(self.counters)
+            lookups = counters["lookups"]
+            return {
+                **counters,
+                "reuse_rate": round(counters["reused"] / lookups, 4) if lookups else 0.0,
+                "mean_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else None,
+                "max_lookup_ms": round(self.max_lookup_seconds * 1000, 3),
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "path": self.path,
+            }
@@ -0,0 +1,63 @@
+# tests/conftest.py
+
+"""Makes the Backend modules importable when pytest is run from the repository root or Backend/."""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings for the API tests: the simulated LLM backend without latency, and nothing persisted to disk.
+TEST_ENVIRONMENT = {
+    "LLM_BACKEND": "simulated",
+    "LLM_SIMULATED_LATENCY_MS": "0",
+    "LLM_SIMULATED_JITTER_MS": "0",
+    "LLM_HEDGE_ENABLED": "false", # Keeps the number of LLM calls per request deterministic
+    "LLM_BACKOFF_BASE_SECONDS": "0.01",
+    "LLM_ERROR_BACKOFF_BASE_SECONDS": "0.01",
+    "MAX_CHUNK_CHARS": "2000", # Small chunks, so short test documents are still analyzed in several chunks
+    "RESULT_CACHE_PATH": "",
+    "SIMILARITY_INDEX_PATH": ":memory:",
+    "ANALYSIS_STORE_PATH": ":memory:",
+    "SHARED_STATE_BACKEND": "local",
+    "EXTRACTION_MAX_WORKERS": "1",
+    "ADMIN_API_KEY": "test-admin-key",
+}
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The API module. main reads its settings at import time, so the test settings are applied first."""
+    os.environ.update(TEST_ENVIRONMENT)
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    # One client for the session keeps a single event loop, so background jobs outlive the request that queued them.
+    from fastapi.testclient import TestClient
+    with TestClient(app_module.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def admin_headers():
+    return {"X-Admin-Key": TEST_ENVIRONMENT["ADMIN_API_KEY"]}
+
+
+@pytest.fixture
+def wait_for_job(client):
+    """Polls a background job until it has finished and returns its status."""
+    def wait(job_id, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = client.get(f"/jobs/{job_id}").json()
+            if status["status"] in ("succeeded", "failed"):
+                return status
+            time.sleep(0.02)
+        raise AssertionError(f"Job {job_id} did not finish within {timeout} seconds")
+    return wait
@@ -0,0 +1,47 @@
+# tests/test_admin_api.py
+
+import pytest
+
+ADMIN_STATS_PATHS = [
+    "/admin/cache/stats",
+    "/admin/rate-limiter/stats",
+    "/admin/coalescing/stats",
+    "/admin/cascade/stats",
+    "/admin/llm/stats",
+    "/admin/similarity/stats",
+    "/admin/analysis-store/stats",
+]
+
+
+@pytest.mark.parametrize("path", ADMIN_STATS_PATHS)
+def test_admin_endpoints_need_the_admin_key(client, admin_headers, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Admin-Key": "wrong"}).status_code == 403
+    assert client.get(path, headers=admin_headers).status_code == 200
+
+
+def test_repeated_analyses_are_served_from_the_cache(client, admin_headers):
+    before = client.get("/admin/cache/stats", headers=admin_headers).json()
+    assert before["enabled"]
+    # Chunked prompt types would reuse the first analysis through the similarity index instead.
+    body = {"text": "The tenant pays rent monthly in advance.", "prompt_type": "jargon_simplification"}
+    first = client.post("/analyze-document-text", json=body)
+    second = client.post("/analyze-document-text", json={**body, "text": body["text"].replace(" ", "\n")})
+    assert first.status_code == second.status_code == 200
+    assert first.json()["summary"] == second.json()["summary"]
+
+    after = client.get("/admin/cache/stats", headers=admin_headers).json()
+    assert after["stores"] == before["stores"] + 1
+    assert after["memory_hits"] == before["memory_hits"] + 1
+
+
+def test_cache_invalidation(client, admin_headers):
+    client.post("/analyze-document-text", json={"text": "Notices are given in writing.", "prompt_type": "jargon_simplification"})
+    assert client.post("/admin/cache/invalidate", json={"prompt_type": "unknown"}, headers=admin_headers).status_code == 400
+    assert client.post("/admin/cache/invalidate", json={}).status_code == 403
+
+    stale_only = client.post("/admin/cache/invalidate", json={}, headers=admin_headers).json()
+    assert stale_only["removed"] == 0 # Every entry was made with a current template
+    everything = client.post("/admin/cache/invalidate", json={"stale_only": False}, headers=admin_headers).json()
+    assert everything["removed"] >= 1
+    assert everything["memory"]["entries"] == 0
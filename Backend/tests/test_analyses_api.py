@@ -0,0 +1,29 @@
+# tests/test_analyses_api.py
+
+CONTRACT = "".join(
+    f"Section {number}. Penalties {number}\n" + f"A late payment penalty of {number}% per week applies without limit. " * 8 + "\n\n"
+    for number in range(1, 5)
+)
+
+
+def test_stored_analyses_can_be_queried_by_their_findings(client):
+    analysis = client.post("/analyze-document-text", json={"text": CONTRACT, "prompt_type": "detailed_analysis"}).json()
+    document_id = analysis["document_id"]
+
+    stored = client.get(f"/analyses/{document_id}").json()
+    assert (stored["document_id"], stored["prompt_type"]) == (document_id, "detailed_analysis")
+    assert len(stored["chunks"]) == len(analysis["chunk_status"]) > 1
+
+    terms = client.get("/analyses/terms", params={"field": "risk_level"}).json()
+    assert terms["field"] == "risk_level" and terms["terms"]
+    by_risk_level = client.get("/analyses/query", params={"field": "risk_level", "term": analysis["risk_level"]}).json()
+    assert document_id in [document["document_id"] for document in by_risk_level["documents"]]
+    by_prompt_type = client.get("/analyses/query", params={"prompt_type": "detailed_analysis", "limit": 1}).json()
+    assert [document["document_id"] for document in by_prompt_type["documents"]] == [document_id]
+
+
+def test_analysis_queries_need_a_valid_filter(client):
+    assert client.get("/analyses/query").status_code == 400
+    assert client.get("/analyses/query", params={"field": "party", "term": "acme"}).status_code == 400
+    assert client.get("/analyses/terms", params={"field": "party"}).status_code == 400
+    assert client.get("/analyses/missing").status_code == 404
@@ -0,0 +1,129 @@
+# tests/test_analysis_store.py
+
+import itertools
+
+import pytest
+
+import analysis_store
+from analysis_store import AnalysisStore
+from versioning import StoredChunk
+
+RISK_ORDER = {"Low": 0, "Medium": 1, "High": 2}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # Distinct, increasing save times, so "most recent first" is well defined.
+    clock = itertools.count(1000)
+    monkeypatch.setattr(analysis_store.time, "time", lambda: float(next(clock)))
+    return AnalysisStore(":memory:", RISK_ORDER)
+
+
+def chunk(risk_level, red_flags=(), vague_terms=(), explanation=""):
+    result = {
+        "risk_level": risk_level,
+        "simplified_explanation": explanation,
+        "red_flags": [{"type": flag, "description": f"{flag} in this clause"} for flag in red_flags],
+        "vague_terms": [{"term": term} for term in vague_terms],
+    }
+    return StoredChunk(["hash"], ["1"], "1. Some clause.", result)
+
+
+def save(store, *chunks, **kwargs):
+    return store.save("detailed_analysis", list(chunks), **kwargs)
+
+
+def document_ids(result):
+    return [document["document_id"] for document in result["documents"]]
+
+
+def test_get_returns_the_saved_version(store):
+    document_id = save(store, chunk("Low"), StoredChunk(["h2"], [None], "Recitals.", None, 40), name="lease.pdf",
+                       clause_pairs={"1|2": {"risk": "x"}})
+    version = store.get(document_id)
+    assert version.name == "lease.pdf"
+    assert [stored.result is None for stored in version.chunks] == [False, True]
+    assert version.chunks[1].start == 40
+    assert version.clause_pairs == {"1|2": {"risk": "x"}}
+    assert store.get("missing") is None
+
+
+def test_term_queries_match_normalized_terms(store):
+    liability = save(store, chunk("High", red_flags=["Unlimited-Liability"]))
+    renewal = save(store, chunk("Medium", red_flags=["Auto renewal"]), chunk("Low", red_flags=["Unlimited liability cap"]))
+
+    exact = store.query("red_flag", "unlimited_liability")
+    assert document_ids(exact) == [liability]
+    assert [match["finding"]["type"] for match in exact["documents"][0]["matches"]] == ["Unlimited-Liability"]
+    assert document_ids(store.query("red_flag", "Unlimited Liability", match="prefix")) == [renewal, liability]
+    assert document_ids(store.query("red_flag", "renewal", match="contains")) == [renewal]
+    assert store.query("red_flag", "indemnity")["documents"] == []
+    # Terms are indexed per field.
+    assert store.query("vague_term", "auto renewal")["documents"] == []
+
+
+def test_text_and_document_filters(store):
+    high = save(store, chunk("High", red_flags=["Penalty"], explanation="Late delivery costs a weekly penalty."))
+    low = save(store, chunk("Low", explanation="Delivery terms are standard."))
+    assert document_ids(store.query(text="delivery")) == [low, high]
+    assert document_ids(store.query(text="weekly delivery")) == [high]
+    assert document_ids(store.query(text="delivery", risk_levels=["High"])) == [high]
+    assert document_ids(store.query(field="risk_level", term="low")) == [low]
+    assert document_ids(store.query(prompt_type="detailed_analysis")) == [low, high]
+    assert store.query(prompt_type="risk_identification")["documents"] == []
+
+
+def test_document_risk_level_is_the_highest_chunk_risk_level(store):
+    save(store, chunk("Low"), chunk("High"), chunk("Medium"))
+    assert store.query(prompt_type="detailed_analysis")["documents"][0]["risk_level"] == "High"
+
+
+def test_superseded_versions_are_left_out(store):
+    first = save(store, chunk("High", red_flags=["Penalty"]))
+    second = save(store, chunk("High", red_flags=["Penalty"]), previous_document_id=first)
+    assert document_ids(store.query("red_flag", "penalty")) == [second]
+    assert document_ids(store.query("red_flag", "penalty", include_superseded=True)) == [second, first]
+
+
+@pytest.mark.parametrize("selective_postings", [analysis_store.SELECTIVE_TERM_POSTINGS, 0])
+def test_limit_returns_the_most_recent_documents(store, monkeypatch, selective_postings):
+    # With a threshold of 0 every term query takes the broad (most recent documents first) plan.
+    monkeypatch.setattr(analysis_store, "SELECTIVE_TERM_POSTINGS", selective_postings)
+    saved = [save(store, chunk("High", red_flags=["Penalty", "Penalty clause"])) for _ in range(5)]
+    save(store, chunk("Low"))
+    result = store.query("red_flag", "penalty", match="prefix", limit=2)
+    assert document_ids(result) == saved[:-3:-1]
+    # Every matching finding of a returned document is included.
+    assert [len(document["matches"]) for document in result["documents"]] == [2, 2]
+
+
+def test_invalid_queries_raise_value_error(store):
+    with pytest.raises(ValueError):
+        store.query("party", "acme")
+    with pytest.raises(ValueError):
+        store.query("red_flag", "penalty", match="fuzzy")
+    with pytest.raises(ValueError):
+        store.query(term="penalty")
+
+
+def test_oldest_documents_are_evicted_with_their_index_entries(monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(analysis_store.time, "time", lambda: float(next(clock)))
+    store = AnalysisStore(":memory:", RISK_ORDER, max_documents=2)
+    oldest = save(store, chunk("High", red_flags=["Penalty"]))
+    kept = [save(store, chunk("Low", red_flags=["Auto renewal"])) for _ in range(2)]
+    assert store.get(oldest) is None
+    assert document_ids(store.query("red_flag", "auto renewal")) == kept[::-1]
+    assert store.query("red_flag", "penalty")["documents"] == []
+    assert store.terms("red_flag") == [{"term": "auto renewal", "findings": 2}]
+    stats = store.stats()
+    assert (stats["documents"], stats["evictions"]) == (2, 1)
+
+
+
+def test_like_wildcards_in_text_queries_match_literally(store):
+    store.full_text = False # The findings scan of SQLite builds without FTS5
+    percent = save(store, chunk("High", red_flags=["Late fee"], explanation="A 5% late_fee applies."))
+    save(store, chunk("Low", red_flags=["Late fee"], explanation="A late fee of 50 euros applies."))
+    assert document_ids(store.query(text="5%")) == [percent]
+    assert document_ids(store.query(text="late_fee")) == [percent]
@@ -0,0 +1,73 @@
+# tests/test_batch_api.py
+
+import io
+
+import docx
+
+SHARED_CLAUSES = "".join(
+    f"Section {number}. Boilerplate {number}\nThis standard provision number {number} applies to both parties equally.\n\n"
+    for number in range(1, 5)
+)
+
+
+def contract(party):
+    return SHARED_CLAUSES + f"Section 5. Parties\nThis agreement is made with {party} as the customer.\n"
+
+
+def docx_bytes(text):
+    document = docx.Document()
+    for paragraph in text.split("\n"):
+        document.add_paragraph(paragraph)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def batch_result(client, wait_for_job, submitted):
+    assert submitted.status_code == 202
+    job_id = submitted.json()["job_id"]
+    status = wait_for_job(job_id)
+    assert status["status"] == "succeeded"
+    assert status["progress"]["documents_extracted"] == status["progress"]["documents"]
+    return client.get(f"/jobs/{job_id}/result").json()
+
+
+def test_clauses_shared_across_documents_are_analyzed_once(client, wait_for_job):
+    documents = [{"name": "acme", "text": contract("Acme")}, {"name": "globex", "text": contract("Globex")}, {"text": contract("Initech")}]
+    result = batch_result(client, wait_for_job, client.post("/batch/analyze-texts", json={"documents": documents}))
+
+    stats = result["stats"]
+    assert (stats["documents"], stats["succeeded"], stats["total_clauses"], stats["unique_clauses"]) == (3, 3, 15, 7)
+    assert stats["dedupe_ratio"] == round(1 - 7 / 15, 4)
+    assert [document["name"] for document in result["documents"]] == ["acme", "globex", "document-3"]
+    assert all(document["status"] == "succeeded" and document["document_id"] for document in result["documents"])
+    assert all(document["result"]["risk_level"] for document in result["documents"])
+
+
+def test_empty_documents_fail_on_their_own(client, wait_for_job):
+    documents = [{"name": "blank", "text": "   "}, {"name": "acme", "text": contract("Acme")}]
+    result = batch_result(client, wait_for_job, client.post("/batch/analyze-texts", json={"documents": documents}))
+    blank, acme = result["documents"]
+    assert blank["status"] == "failed"
+    assert blank["error"]["status_code"] == 422
+    assert acme["status"] == "succeeded"
+
+
+def test_invalid_batches_are_rejected(client):
+    assert client.post("/batch/analyze-texts", json={"documents": []}).status_code == 400
+    response = client.post("/batch/analyze-texts", json={"documents": [{"text": "x"}], "prompt_type": "overall_summary"})
+    assert response.status_code == 400
+
+
+def test_batch_uploads_fail_per_file(client, wait_for_job):
+    files = [
+        ("files", ("acme.docx", docx_bytes(contract("Acme")))),
+        ("files", ("broken.pdf", b"not a pdf")),
+        ("files", ("notes.txt", b"text")),
+    ]
+    result = batch_result(client, wait_for_job, client.post("/batch/upload-and-analyze", files=files))
+    acme, broken, notes = result["documents"]
+    assert acme["status"] == "succeeded"
+    assert acme["result"]["preprocessing"]
+    assert (broken["status"], broken["error"]["status_code"]) == ("failed", 422)
+    assert (notes["status"], notes["error"]["status_code"]) == ("failed", 400)
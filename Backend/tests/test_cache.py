@@ -0,0 +1,125 @@
+# tests/test_cache.py
+
+import pytest
+
+import cache
+from cache import ResultCache, make_cache_key, template_fingerprint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache.time, "time", fake)
+    return fake
+
+
+def store(result_cache, key, value, prompt_type="detailed_analysis", template="template v1"):
+    result_cache.set(key, value, prompt_type, template_fingerprint(template), "model")
+
+
+def test_keys_ignore_whitespace_but_not_template_model_or_extras():
+    key = make_cache_key("Fees are\n due  in 30 days.", "detailed_analysis", "template", "model")
+    assert key == make_cache_key(" Fees are due in 30 days. ", "detailed_analysis", "template", "model")
+    assert key != make_cache_key("Fees are due in 30 days.", "detailed_analysis", "template v2", "model")
+    assert key != make_cache_key("Fees are due in 30 days.", "detailed_analysis", "template", "other model")
+    assert key != make_cache_key("Fees are due in 30 days.", "risk_identification", "template", "model")
+    assert key != make_cache_key("Fees are due in 30 days.", "detailed_analysis", "template", "model", {"clause_b": "x"})
+
+
+def test_memory_tier_is_a_bounded_lru(clock):
+    result_cache = ResultCache(memory_max_entries=2)
+    assert not result_cache.blocking
+    store(result_cache, "a", "A")
+    store(result_cache, "b", "B")
+    assert result_cache.get("a") == "A" # "b" is now the least recently used
+    store(result_cache, "c", "C")
+    assert result_cache.get("b") is None
+    assert [result_cache.get(key) for key in ("a", "c")] == ["A", "C"]
+    stats = result_cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["evictions"]) == (3, 1, 1)
+    assert stats["hit_rate"] == 0.75
+
+
+def test_entries_expire_after_the_ttl(clock, tmp_path):
+    result_cache = ResultCache(disk_path=str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    store(result_cache, "a", "A")
+    clock.now += 59
+    assert result_cache.get("a") == "A"
+    clock.now += 2
+    assert result_cache.get("a") is None
+    assert result_cache.stats()["disk"]["entries"] == 0
+
+
+def test_disk_tier_survives_restarts_and_promotes_hits(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store(ResultCache(disk_path=path), "a", "A")
+
+    reopened = ResultCache(disk_path=path)
+    assert reopened.blocking
+    assert reopened.get("a") == "A"
+    assert reopened.get("a") == "A"
+    stats = reopened.stats()
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+
+
+def test_disk_tier_evicts_least_recently_used_entries_past_its_size_budget(clock, tmp_path):
+    result_cache = ResultCache(memory_max_entries=0, disk_path=str(tmp_path / "cache.sqlite3"), disk_max_bytes=25)
+    for key in ("a", "b"):
+        store(result_cache, key, key.upper() * 10)
+        clock.now += 1
+    assert result_cache.get("a") == "A" * 10 # "b" is now the least recently used
+    clock.now += 1
+    store(result_cache, "c", "C" * 10)
+    assert result_cache.get("b") is None
+    assert result_cache.get("a") == "A" * 10
+    assert result_cache.stats()["disk"]["bytes"] == 20
+
+
+def test_peek_neither_counts_nor_refreshes(clock, tmp_path):
+    result_cache = ResultCache(memory_max_entries=0, disk_path=str(tmp_path / "cache.sqlite3"), disk_max_bytes=25)
+    for key in ("a", "b"):
+        store(result_cache, key, key.upper() * 10)
+        clock.now += 1
+    assert result_cache.peek("a") == "A" * 10
+    assert result_cache.peek("missing") is None
+    assert result_cache.stats()["misses"] == 0
+    store(result_cache, "c", "C" * 10)
+    assert result_cache.peek("a") is None # Peeking did not make "a" recently used
+
+
+def test_discard_removes_an_entry_from_both_tiers(tmp_path):
+    result_cache = ResultCache(disk_path=str(tmp_path / "cache.sqlite3"))
+    store(result_cache, "a", "not json")
+    result_cache.discard("a")
+    assert result_cache.get("a") is None
+    assert result_cache.stats()["disk"]["entries"] == 0
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_invalidation_by_prompt_type_and_stale_template(tmp_path, disk):
+    result_cache = ResultCache(disk_path=str(tmp_path / "cache.sqlite3") if disk else None)
+    store(result_cache, "old", "1", template="template v1")
+    store(result_cache, "current", "2", template="template v2")
+    store(result_cache, "other", "3", prompt_type="risk_identification", template="template v1")
+
+    assert result_cache.invalidate("detailed_analysis", keep_template_hashes=[template_fingerprint("template v2")]) == 1
+    assert [result_cache.get(key) for key in ("old", "current", "other")] == [None, "2", "3"]
+    assert result_cache.invalidate() == 2
+    assert result_cache.stats()["invalidations"] == 3
+
+
+def test_shared_cache_needs_a_disk_tier_and_keeps_no_memory_tier(tmp_path):
+    with pytest.raises(ValueError):
+        ResultCache(shared=True)
+    result_cache = ResultCache(disk_path=str(tmp_path / "cache.sqlite3"), shared=True)
+    store(result_cache, "a", "A")
+    assert result_cache.get("a") == "A"
+    assert result_cache.stats()["memory"]["entries"] == 0
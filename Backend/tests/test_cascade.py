@@ -0,0 +1,84 @@
+# tests/test_cascade.py
+
+import pytest
+
+from cascade import CascadeStats, should_escalate
+
+RISK_ORDER = {"Neutral": 0, "Low": 1, "Medium": 2, "High": 3}
+
+CONTRACT = "".join(
+    f"Section {number}. Delivery {number}\n" + f"Shipment {number} is delivered to the customer's site on request. " * 10 + "\n\n"
+    for number in range(1, 7)
+)
+
+
+def stats_for(**kwargs):
+    options = {"screening_model": "flash-lite", "escalation_model": "flash", "screening_price": 0.1,
+               "escalation_price": 0.3, "threshold": "Medium", "default_output_tokens": 1000}
+    return CascadeStats(**{**options, **kwargs})
+
+
+@pytest.mark.parametrize("risk_level, escalate", [("High", True), ("Medium", True), ("Low", False), ("Neutral", False),
+                                                  ("Unknown", True), (None, True)])
+def test_chunks_at_or_above_the_threshold_escalate(risk_level, escalate):
+    assert should_escalate(risk_level, "Medium", RISK_ORDER) is escalate
+
+
+def test_savings_value_skipped_chunks_like_the_escalated_ones():
+    stats = stats_for()
+    for _ in range(4):
+        stats.record_screening(1000, 100, 0.5)
+    stats.record_escalation(3000, 1000, 2.0)
+    for _ in range(3):
+        stats.record_skipped(3000)
+
+    summary = stats.stats()
+    assert (summary["chunks_screened"], summary["chunks_escalated"], summary["escalation_rate"]) == (4, 1, 0.25)
+    assert summary["screening"]["estimated_cost"] == pytest.approx(4400 * 0.1 / 1e6)
+    assert summary["estimated_cost"] == pytest.approx((4400 * 0.1 + 4000 * 0.3) / 1e6)
+    # The three skipped detailed calls would each have cost 3000 input and 1000 (average) output tokens.
+    assert summary["estimated_baseline_cost"] == pytest.approx(4 * 4000 * 0.3 / 1e6)
+    assert summary["estimated_cost_saved"] == pytest.approx(summary["estimated_baseline_cost"] - summary["estimated_cost"])
+    assert summary["estimated_llm_seconds_saved"] == pytest.approx(3 * 2.0 - 4 * 0.5)
+
+
+def test_savings_without_escalations_use_the_default_output_tokens():
+    stats = stats_for()
+    stats.record_screening(1000, 100, 0.5)
+    stats.record_skipped(3000)
+    summary = stats.stats()
+    assert summary["escalation_rate"] == 0.0
+    assert summary["estimated_baseline_cost"] == pytest.approx(4000 * 0.3 / 1e6)
+    assert summary["estimated_llm_seconds_saved"] is None
+    assert stats_for().stats()["escalation_rate"] is None
+
+
+@pytest.fixture
+def cascade(app_module, monkeypatch):
+    """Cascade mode with fresh statistics and without near-duplicate reuse, so every chunk goes through the cascade."""
+    monkeypatch.setattr(app_module, "CASCADE_ENABLED", True)
+    monkeypatch.setattr(app_module, "similarity_index", None)
+    stats = stats_for(screening_model=app_module.CASCADE_SCREENING_MODEL, escalation_model=app_module.CASCADE_ESCALATION_MODEL)
+    monkeypatch.setattr(app_module, "cascade_stats", stats)
+    return stats
+
+
+def test_every_chunk_is_screened_and_only_risky_ones_escalate(client, cascade):
+    response = client.post("/analyze-document-text", json={"text": CONTRACT, "prompt_type": "detailed_analysis"})
+    assert response.status_code == 200
+    statuses = response.json()["chunk_status"]
+    summary = cascade.stats()
+    assert summary["chunks_screened"] == len(statuses) > 1
+    escalated = [status for status in statuses if status["tier"] == "escalated"]
+    assert summary["chunks_escalated"] == len(escalated)
+    assert cascade.skipped_chunks == len(statuses) - len(escalated)
+    assert all(should_escalate(status["screened_risk_level"], "Medium", RISK_ORDER) for status in escalated)
+
+
+def test_cached_screenings_leave_the_statistics_alone(client, cascade, admin_headers):
+    body = {"text": CONTRACT.replace("Shipment", "Parcel"), "prompt_type": "detailed_analysis"}
+    client.post("/analyze-document-text", json=body)
+    first = cascade.stats()
+    client.post("/analyze-document-text", json=body)
+    assert cascade.stats() == first
+    assert client.get("/admin/cascade/stats", headers=admin_headers).json()["enabled"] is True
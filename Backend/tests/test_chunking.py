@@ -0,0 +1,103 @@
+# tests/test_chunking.py
+
+import pytest
+
+from chunking import StreamingChunker, pack_clauses, split_into_chunks, split_into_clauses
+
+CONTRACT = (
+    "MASTER SERVICES AGREEMENT\n"
+    "This agreement is made between the parties below.\n\n"
+    "Section 1. Definitions\nCapitalized terms have the meanings given here.\n\n"
+    "Section 2.1 Payment\nFees are due within 30 days of invoice.\n\n"
+    "ARTICLE IV Termination\nEither party may terminate on 30 days notice.\n\n"
+    "5) Liability\nLiability is capped at the fees paid.\n"
+)
+
+
+def long_document(sections=60):
+    return "".join(
+        f"Section {number}. Heading {number}\n" + "The supplier shall deliver the goods on time. " * (number % 7 + 1) + "\n\n"
+        for number in range(1, sections + 1)
+    )
+
+
+def test_clauses_split_on_headings_with_an_unlabeled_preamble():
+    clauses = split_into_clauses(CONTRACT)
+    assert [clause.label for clause in clauses] == [None, "1", "2.1", "IV", "5"]
+    assert clauses[0].text.startswith("MASTER SERVICES AGREEMENT")
+    assert all(CONTRACT[clause.start:clause.end] == clause.text for clause in clauses)
+    assert "".join(clause.text for clause in clauses) == CONTRACT
+
+
+def test_documents_without_headings_split_on_blank_lines():
+    text = "First paragraph.\n\nSecond paragraph.\n\n\nThird paragraph."
+    clauses = split_into_clauses(text)
+    assert [clause.label for clause in clauses] == [None, None, None]
+    assert [clause.text.strip() for clause in clauses] == ["First paragraph.", "Second paragraph.", "Third paragraph."]
+
+
+def test_blank_documents_have_no_clauses():
+    assert split_into_clauses("  \n\n ") == []
+    assert split_into_chunks("") == []
+
+
+def test_oversized_clauses_split_on_paragraphs_then_sentences_then_hard_cuts():
+    paragraphs = "Section 1. Scope\n" + "\n\n".join("Short paragraph number %d." % number for number in range(10))
+    pieces = split_into_clauses(paragraphs, max_chars=60)
+    assert len(pieces) > 1
+    assert all(len(piece.text) <= 60 and piece.label == "1" for piece in pieces)
+    assert all(piece.text.rstrip().endswith(".") for piece in pieces)
+
+    sentences = "Section 2. Scope\n" + " ".join("Sentence number %d ends here." % number for number in range(10))
+    assert all(len(piece.text) <= 60 for piece in split_into_clauses(sentences, max_chars=60))
+
+    run_on = "Section 3. " + "x" * 250
+    pieces = split_into_clauses(run_on, max_chars=100)
+    assert [len(piece.text) for piece in pieces] == [100, 100, 61]
+    assert "".join(piece.text for piece in pieces) == run_on
+
+
+def test_chunks_pack_whole_clauses_within_the_budget():
+    text = long_document()
+    chunks = split_into_chunks(text, max_chars=500)
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    assert all(len(chunk.text) <= 500 and text[chunk.start:chunk.end] == chunk.text for chunk in chunks)
+    # Every clause lands in exactly one chunk, in order.
+    labels = [clause.label for chunk in chunks for clause in chunk.clauses]
+    assert labels == [str(number) for number in range(1, 61)]
+    # Greedy packing: the next chunk's first clause would not have fit.
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert following.clauses[0].end - chunk.start > 500
+
+
+def test_only_contiguous_clauses_share_a_chunk():
+    clauses = split_into_clauses(CONTRACT)
+    chunks = pack_clauses(CONTRACT, [clauses[1], clauses[3]], max_chars=len(CONTRACT))
+    assert [[clause.label for clause in chunk.clauses] for chunk in chunks] == [["1"], ["IV"]]
+
+
+@pytest.mark.parametrize("segment_chars", [1, 37, 400, 5000])
+def test_streamed_chunks_match_the_chunks_of_the_whole_text(segment_chars):
+    text = long_document(200)
+    chunker = StreamingChunker(max_chars=500)
+    streamed = []
+    for offset in range(0, len(text), segment_chars):
+        streamed.extend(chunker.feed(text[offset:offset + segment_chars]))
+    streamed.extend(chunker.finish())
+
+    assert chunker.text == text
+    expected = split_into_chunks(text, max_chars=500)
+    assert [(chunk.index, chunk.start, chunk.end, chunk.text) for chunk in streamed] == \
+           [(chunk.index, chunk.start, chunk.end, chunk.text) for chunk in expected]
+    assert [[clause.start for clause in chunk.clauses] for chunk in streamed] == \
+           [[clause.start for clause in chunk.clauses] for chunk in expected]
+
+
+def test_streaming_emits_chunks_before_the_document_ends():
+    chunker = StreamingChunker(max_chars=500)
+    text = long_document(200)
+    emitted_early = []
+    for offset in range(0, len(text) // 2, 100):
+        emitted_early.extend(chunker.feed(text[offset:offset + 100]))
+    assert emitted_early
+    assert emitted_early[-1].end <= len(text) // 2
@@ -0,0 +1,63 @@
+# tests/test_clause_graph.py
+
+from chunking import Clause, split_into_clauses
+from clause_graph import build_clause_graph, index_clauses
+
+CONTRACT = (
+    "1. Definitions.\nTerms used in Section 7.2A have the meanings given here.\n\n"
+    "2. Payment.\nSubject to Section 3, fees are due monthly. Notwithstanding Clause 3, late fees apply.\n\n"
+    "3. Termination.\nEither party may terminate under Section 2 or Section 9.\n\n"
+    "7. Liability.\n"
+    "7.2 Cap.\nLiability is capped pursuant to Section 1.\n"
+)
+
+
+def graph_of(text):
+    return build_clause_graph(text, split_into_clauses(text))
+
+
+def test_clauses_are_indexed_by_label():
+    graph = graph_of(CONTRACT)
+    assert sorted(graph.clauses) == ["1", "2", "3", "7", "7.2"]
+    assert graph.clause_text("3").startswith("3. Termination.")
+
+
+def test_pieces_of_an_oversized_clause_are_joined_and_restarted_numbering_keeps_the_first():
+    clauses = [Clause("1", "First ", 0, 6), Clause("1", "half.", 6, 11), Clause(None, "Schedule", 11, 19),
+               Clause("1", "Schedule item.", 19, 33)]
+    index = index_clauses(clauses)
+    assert list(index) == ["1"]
+    assert (index["1"].text, index["1"].start, index["1"].end) == ("First half.", 0, 11)
+
+
+def test_references_become_edges_resolved_to_parent_clauses():
+    graph = graph_of(CONTRACT)
+    edges = [(edge.source, edge.target, edge.relation, edge.reference) for edge in graph.edges]
+    assert edges == [
+        ("1", "7.2", "references", "Section 7.2A"),
+        ("2", "3", "subject_to", "Section 3"),
+        ("2", "3", "notwithstanding", "Clause 3"),
+        ("3", "2", "pursuant_to", "Section 2"),
+        ("7.2", "1", "pursuant_to", "Section 1"),
+    ]
+    assert graph.dangling_references == 1 # Section 9
+    assert all(CONTRACT[edge.start:edge.end] == edge.reference for edge in graph.edges)
+
+
+def test_connected_pairs_keep_the_strongest_relation_per_pair():
+    graph = graph_of(CONTRACT)
+    pairs = [(edge.source, edge.target, edge.relation) for edge in graph.connected_pairs()]
+    # 2 -> 3 and 3 -> 2 (or 1 -> 7.2 and 7.2 -> 1) are the same pair.
+    assert pairs == [("2", "3", "notwithstanding"), ("7.2", "1", "pursuant_to")]
+    assert len(graph.connected_pairs(max_pairs=1)) == 1
+    assert graph.stats() == {"clauses": 5, "references": 5, "connected_pairs": 2, "dangling_references": 1}
+
+
+def test_pairwise_prompts_run_on_connected_clauses(client):
+    response = client.post("/analyze-document-text", json={"text": CONTRACT, "prompt_type": "detailed_analysis"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["clause_graph"]["connected_pairs"] == 2
+    assert result["clause_graph"]["pairs_analyzed"] == 2
+    pairwise = [entry for entry in result["inter_clause_dependencies"] if "risk_comparison" in entry]
+    assert sorted((entry["related_clause_id"], entry["clause_id"]) for entry in pairwise) == [("2", "Clause 3"), ("7.2", "Section 1")]
@@ -0,0 +1,127 @@
+# tests/test_extraction.py
+
+import asyncio
+import io
+import queue
+import threading
+
+import docx
+import pytest
+
+from extraction import ExtractionError, ExtractionMemoryError, TextExtractor, _extract_into_queue, file_kind
+
+PARAGRAPHS = ["1. Term. This agreement runs for one year.", "2. Payment. Fees are due within 30 days.", "3. Notices."]
+
+
+def docx_bytes(paragraphs=PARAGRAPHS):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def pdf_bytes(pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = 2 + 2 * len(pages)
+    page_ids = []
+    for text in pages:
+        content = b"BT /F1 12 Tf 50 750 Td (" + text.encode("latin-1") + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /Resources << /Font << /F1 1 0 R >> >> /MediaBox [0 0 612 792]"
+                       b" /Contents %d 0 R >>" % (pages_id, len(objects)))
+        page_ids.append(len(objects))
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % page for page in page_ids), len(pages)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    output, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1) + b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return output + b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+
+
+def extract_in_process(kind, source, batch_size=2, max_text_chars=None):
+    """Runs the worker entry point in this process and returns the messages it queued."""
+    output_queue = queue.Queue()
+    _extract_into_queue(kind, source, output_queue, threading.Event(), batch_size, max_text_chars)
+    messages = []
+    while not output_queue.empty():
+        messages.append(output_queue.get())
+    return messages
+
+
+def test_supported_file_kinds():
+    assert file_kind("Lease.PDF") == "pdf"
+    assert file_kind("contract.docx") == "docx"
+    assert file_kind("notes.txt") is None
+    assert file_kind(None) is None
+
+
+def test_docx_paragraphs_are_queued_in_batches():
+    assert extract_in_process("docx", docx_bytes()) == [
+        ("segments", PARAGRAPHS[:2]),
+        ("segments", PARAGRAPHS[2:]),
+        ("done", None),
+    ]
+
+
+@pytest.mark.parametrize("kind, content", [("docx", docx_bytes()), ("pdf", pdf_bytes(["Page one.", "Page two."]))])
+def test_spooled_files_are_read_in_place(tmp_path, kind, content):
+    path = tmp_path / f"upload.{kind}"
+    path.write_bytes(content)
+    from_bytes = extract_in_process(kind, content)
+    assert extract_in_process(kind, str(path)) == from_bytes
+    assert from_bytes[-1] == ("done", None)
+
+
+def test_pdf_pages_are_extracted():
+    segments = [segment for message, payload in extract_in_process("pdf", pdf_bytes(["Page one.", "Page two."]))
+                if message == "segments" for segment in payload]
+    assert [segment.strip() for segment in segments] == ["Page one.", "Page two."]
+
+
+def test_extracted_text_is_capped():
+    messages = extract_in_process("docx", docx_bytes(), max_text_chars=60)
+    assert messages[-1][0] == "error"
+    assert messages[-1][1][0] == "memory"
+
+
+@pytest.mark.parametrize("source", [b"not a pdf", b""])
+def test_unreadable_documents_report_a_parse_error(tmp_path, source):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(source)
+    messages = extract_in_process("pdf", str(path))
+    assert [message for message, _ in messages] == ["error"]
+    assert messages[0][1][0] == "parse"
+
+
+def test_extractor_streams_segments_from_its_worker_pool(tmp_path):
+    path = tmp_path / "upload.docx"
+    path.write_bytes(docx_bytes())
+    extractor = TextExtractor(max_workers=1, batch_size=1, max_text_chars=1000)
+
+    async def collect(source, filename="upload.docx"):
+        return [segment async for segment in extractor.stream(filename, source)]
+
+    async def stop_after_first_segment():
+        async for segment in extractor.stream("upload.docx", str(path)):
+            return segment
+
+    try:
+        assert asyncio.run(collect(str(path))) == PARAGRAPHS
+        assert asyncio.run(collect(docx_bytes())) == PARAGRAPHS
+        assert asyncio.run(stop_after_first_segment()) == PARAGRAPHS[0]
+        with pytest.raises(ExtractionError):
+            asyncio.run(collect(b"not a docx"))
+        with pytest.raises(ExtractionError):
+            asyncio.run(collect(b"text", "notes.txt"))
+        extractor.max_text_chars = 10
+        with pytest.raises(ExtractionMemoryError):
+            asyncio.run(collect(str(path)))
+    finally:
+        extractor.shutdown()
+
@@ -0,0 +1,174 @@
+# tests/test_hedging.py
+
+import asyncio
+
+import pytest
+
+import hedging
+from hedging import CircuitBreaker, HedgeStats, LatencyTracker, hedged_call
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(hedging.time, "monotonic", fake)
+    return fake
+
+
+def fake_call(primary_seconds, hedge_seconds, fail=()):
+    """A call whose primary and hedged attempts take the given times; the attempts named in fail raise."""
+    started = []
+
+    async def call(is_hedge):
+        name = "hedge" if is_hedge else "primary"
+        started.append(name)
+        await asyncio.sleep(hedge_seconds if is_hedge else primary_seconds)
+        if name in fail:
+            raise RuntimeError(name)
+        return name
+
+    return call, started
+
+
+def test_percentiles_need_enough_samples_and_use_a_sliding_window():
+    tracker = LatencyTracker(window=10, min_samples=5)
+    for seconds in (1, 2, 3, 4):
+        tracker.record("model:detailed_analysis", seconds)
+    assert tracker.percentile("model:detailed_analysis", 95) is None
+    assert tracker.percentile("unknown", 95) is None
+
+    tracker.record("model:detailed_analysis", 5)
+    assert tracker.percentile("model:detailed_analysis", 50) == 3
+    assert tracker.percentile("model:detailed_analysis", 100) == 5
+    for seconds in range(20, 30):
+        tracker.record("model:detailed_analysis", seconds)
+    assert tracker.percentile("model:detailed_analysis", 0) == 20 # The early samples left the window
+    assert tracker.keys() == ["model:detailed_analysis"]
+
+
+def test_expected_remaining_averages_the_slower_calls():
+    tracker = LatencyTracker()
+    for seconds in (1.0, 2.0, 4.0, 6.0):
+        tracker.record("key", seconds)
+    assert tracker.expected_remaining("key", 3.0) == pytest.approx(2.0)
+    assert tracker.expected_remaining("key", 6.0) == 0.0
+    assert tracker.expected_remaining("unknown", 1.0) == 0.0
+
+
+def test_hedges_are_capped_at_the_budget():
+    stats = HedgeStats(budget=0.1)
+    assert not stats.try_hedge()
+    stats.calls = 20
+    assert [stats.try_hedge() for _ in range(3)] == [True, True, False]
+    stats.record_win(1.5)
+    summary = stats.stats()
+    assert (summary["hedges_fired"], summary["hedge_rate"], summary["hedge_win_rate"]) == (2, 0.1, 0.5)
+    assert summary["estimated_seconds_saved"] == 1.5
+
+
+@pytest.mark.parametrize("hedge_delay", [None, 0.2])
+def test_fast_calls_are_not_hedged(hedge_delay):
+    call, started = fake_call(0.01, 0.01)
+    assert asyncio.run(hedged_call(call, hedge_delay, lambda: True)) == ("primary", None)
+    assert started == ["primary"]
+
+
+def test_a_slow_primary_is_hedged_and_the_first_result_wins():
+    call, started = fake_call(1.0, 0.01)
+    assert asyncio.run(hedged_call(call, 0.01, lambda: True)) == ("hedge", "hedge")
+    assert started == ["primary", "hedge"]
+
+    call, started = fake_call(1.0, 0.01)
+    assert asyncio.run(hedged_call(call, 0.01, lambda: False)) == ("primary", None) # Over budget
+    assert started == ["primary"]
+
+
+@pytest.mark.parametrize("failing, winner", [("hedge", "primary"), ("primary", "hedge")])
+def test_the_other_call_is_awaited_when_one_fails(failing, winner):
+    call, _ = fake_call(0.1, 0.05, fail=(failing,))
+    assert asyncio.run(hedged_call(call, 0.01, lambda: True)) == (winner, winner)
+
+
+def test_the_primary_error_is_raised_when_both_calls_fail():
+    call, _ = fake_call(0.1, 0.05, fail=("primary", "hedge"))
+    with pytest.raises(RuntimeError, match="primary"):
+        asyncio.run(hedged_call(call, 0.01, lambda: True))
+
+
+def test_a_deadline_cancels_both_calls():
+    cancelled = []
+
+    async def call(is_hedge):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(is_hedge)
+            raise
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged_call(call, 0.01, lambda: True), 0.1)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert sorted(cancelled) == [False, True]
+
+
+def test_the_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    assert [breaker.record_failure() for _ in range(2)] == [False, False]
+    breaker.record_success() # Only consecutive failures count
+    assert [breaker.record_failure() for _ in range(3)] == [False, False, True]
+    assert breaker.state == "open"
+
+    clock.now += 10
+    assert not breaker.allow()
+    stats = breaker.stats()
+    assert (stats["state"], stats["open_for_seconds"], stats["opened"], stats["rejected"]) == ("open", 20.0, 1, 1)
+
+
+def test_a_probe_after_the_reset_time_closes_or_reopens_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert breaker.record_failure() # A failed probe opens the circuit again
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.stats()["open_for_seconds"] == 0.0
+
+
+@pytest.fixture
+def open_circuit(app_module, monkeypatch):
+    """An open circuit for the default model, and no similar chunks to fall back to."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=3600)
+    breaker.record_failure()
+    monkeypatch.setattr(app_module, "llm_circuits", {app_module.LLM_MODEL_NAME: breaker})
+    monkeypatch.setattr(app_module, "similarity_index", None)
+    return breaker
+
+
+def test_chunks_get_a_degraded_result_while_the_circuit_is_open(app_module, client, admin_headers, open_circuit):
+    text = "Section 1. Indemnity\nThe contractor indemnifies the owner against all losses whatsoever.\n"
+    response = client.post("/analyze-document-text", json={"text": text, "prompt_type": "detailed_analysis"})
+    assert response.status_code == 200
+    assert [(status["status"], status["fallback"]) for status in response.json()["chunk_status"]] == [("degraded", "local")]
+
+    response = client.post("/analyze-document-text", json={"text": text, "prompt_type": "jargon_simplification"})
+    assert response.status_code == 503
+    circuits = client.get("/admin/llm/stats", headers=admin_headers).json()["circuits"]
+    assert circuits[app_module.LLM_MODEL_NAME]["state"] == "open"
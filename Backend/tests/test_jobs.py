@@ -0,0 +1,118 @@
+# tests/test_jobs.py
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import jobs
+from jobs import JOB_FAILED, JOB_SUCCEEDED, JobScheduler
+from rate_limiter import PRIORITY_BULK, PRIORITY_INTERACTIVE, llm_priority
+
+CONTRACT = "".join(
+    f"Section {number}. Payment {number}\n" + f"Invoice {number} is payable within thirty days of receipt. " * 8 + "\n\n"
+    for number in range(1, 9)
+)
+
+
+def test_jobs_run_in_priority_order_with_their_priority_set():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_jobs=1)
+        ran = []
+
+        async def runner(job):
+            ran.append((job.kind, llm_priority.get()))
+            return job.kind
+
+        # The single worker only starts once the event loop gets control, so all three are queued by then.
+        submitted = [scheduler.submit("bulk", PRIORITY_BULK, runner), scheduler.submit("interactive", PRIORITY_INTERACTIVE, runner),
+                     scheduler.submit("bulk-2", PRIORITY_BULK, runner)]
+        await scheduler._queue.join()
+        return ran, submitted, scheduler.stats()
+
+    ran, submitted, stats = asyncio.run(scenario())
+    assert ran == [("interactive", PRIORITY_INTERACTIVE), ("bulk", PRIORITY_BULK), ("bulk-2", PRIORITY_BULK)]
+    assert [job.result for job in submitted] == ["bulk", "interactive", "bulk-2"]
+    assert all(job.status == JOB_SUCCEEDED and job.finished_at >= job.started_at for job in submitted)
+    assert stats["jobs"] == {JOB_SUCCEEDED: 3}
+
+
+def test_failed_jobs_keep_their_http_status():
+    async def scenario():
+        scheduler = JobScheduler(max_concurrent_jobs=2)
+
+        async def rejected(job):
+            raise HTTPException(status_code=422, detail="Unreadable")
+
+        async def crashed(job):
+            raise RuntimeError("boom")
+
+        submitted = [scheduler.submit("rejected", PRIORITY_BULK, rejected), scheduler.submit("crashed", PRIORITY_BULK, crashed)]
+        await scheduler._queue.join()
+        return submitted
+
+    rejected, crashed = asyncio.run(scenario())
+    assert rejected.status == crashed.status == JOB_FAILED
+    assert rejected.error == {"status_code": 422, "detail": "Unreadable"}
+    assert crashed.error["status_code"] == 500
+    assert "boom" in crashed.error["detail"]
+
+
+def test_finished_jobs_are_forgotten_after_the_retention_period(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+
+    async def scenario():
+        scheduler = JobScheduler(retention_seconds=60)
+
+        async def runner(job):
+            return None
+
+        first = scheduler.submit("first", PRIORITY_BULK, runner)
+        await scheduler._queue.join()
+        now[0] += 61
+        second = scheduler.submit("second", PRIORITY_BULK, runner)
+        await scheduler._queue.join()
+        return scheduler, first, second
+
+    scheduler, first, second = asyncio.run(scenario())
+    assert scheduler.get(first.job_id) is None
+    assert scheduler.get(second.job_id) is second
+
+
+def test_text_job_reports_progress_and_result(client, wait_for_job):
+    submitted = client.post("/jobs/analyze-document-text", json={"text": CONTRACT, "prompt_type": "detailed_analysis"})
+    assert submitted.status_code == 202
+    job_id = submitted.json()["job_id"]
+    assert submitted.json()["status_url"] == f"/jobs/{job_id}"
+
+    status = wait_for_job(job_id)
+    assert status["status"] == "succeeded"
+    assert status["kind"] == "analyze-document-text"
+    assert status["progress"]["chunks_completed"] == status["progress"]["total_chunks"] > 1
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.json()["document_id"]
+
+
+def test_upload_job_failures_are_reported_with_their_status(client, wait_for_job):
+    submitted = client.post("/jobs/upload-and-analyze", files={"file": ("broken.pdf", b"not a pdf")})
+    assert submitted.status_code == 202
+    job_id = submitted.json()["job_id"]
+    status = wait_for_job(job_id)
+    assert status["status"] == "failed"
+    assert status["error"]["status_code"] == 422
+    assert client.get(f"/jobs/{job_id}/result").status_code == 422
+
+
+@pytest.mark.parametrize("body, status_code", [
+    ({"text": CONTRACT, "prompt_type": "unknown"}, 400),
+    ({"text": CONTRACT, "prompt_type": "detailed_analysis", "previous_document_id": "missing"}, 404),
+])
+def test_invalid_jobs_are_rejected_before_they_are_queued(client, body, status_code):
+    assert client.post("/jobs/analyze-document-text", json=body).status_code == status_code
+
+
+def test_unknown_jobs(client):
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.get("/jobs/missing/result").status_code == 404
@@ -0,0 +1,131 @@
+# tests/test_llm_backends.py
+
+import asyncio
+import json
+
+import pytest
+
+from llm_backends import (LLMBackend, LLMBackendError, LLMRateLimitError, LLMRequestError, LLMResponse, RecordingBackend,
+                          SimulatedBackend, create_llm_backend, prompt_digest, synthesize_response)
+
+DETAILED_PROMPT = 'Return JSON with "risk_level", "simplified_explanation", "red_flags" and "vague_terms" for: {text}'
+
+
+def generate(backend, prompt, model_name="model"):
+    return asyncio.run(backend.generate(prompt, model_name))
+
+
+def test_synthesized_responses_are_deterministic_and_follow_the_prompt():
+    response = json.loads(synthesize_response(DETAILED_PROMPT))
+    assert synthesize_response(DETAILED_PROMPT) == json.dumps(response)
+    assert set(response) == {"risk_level", "simplified_explanation", "red_flags", "vague_terms"}
+    assert response["risk_level"] in ("High", "Medium", "Low", "Neutral")
+    assert all(set(entry) == {"type", "description"} for entry in response["red_flags"])
+    assert set(json.loads(synthesize_response("Summarize this contract."))) == {"summary"}
+
+
+def test_simulated_backend_replays_recorded_responses(tmp_path):
+    replay_path = tmp_path / "replay.jsonl"
+    replay_path.write_text(json.dumps({"prompt_sha256": prompt_digest("recorded"), "response": '{"summary": "recorded"}'}) + "\n")
+    backend = SimulatedBackend(latency_ms=0, jitter_ms=0, replay_path=str(replay_path))
+    assert generate(backend, "recorded").text == '{"summary": "recorded"}'
+    synthesized = generate(backend, DETAILED_PROMPT)
+    assert json.loads(synthesized.text)["risk_level"]
+    assert synthesized.total_tokens > 0
+    assert (backend.counters["replayed"], backend.counters["synthesized"]) == (1, 1)
+
+
+@pytest.mark.parametrize("options, error", [({"rate_limit_rate": 1.0}, LLMRateLimitError), ({"error_rate": 1.0}, LLMBackendError)])
+def test_simulated_failures(options, error):
+    backend = SimulatedBackend(latency_ms=0, jitter_ms=0, **options)
+    with pytest.raises(error):
+        generate(backend, DETAILED_PROMPT)
+
+
+def test_simulated_malformed_output_is_damaged_json():
+    backend = SimulatedBackend(latency_ms=0, jitter_ms=0, malformed_rate=1.0, seed=7)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            json.loads(generate(backend, DETAILED_PROMPT).text)
+    assert backend.counters["malformed"] == 5
+
+
+def test_recording_backend_writes_a_replay_file(tmp_path):
+    record_path = tmp_path / "recorded.jsonl"
+    backend = create_llm_backend("simulated", "", {"latency_ms": 0, "jitter_ms": 0}, record_path=str(record_path))
+    assert isinstance(backend, RecordingBackend)
+    assert backend.name == "simulated+recording"
+    response = generate(backend, DETAILED_PROMPT, "gemini-2.5-flash")
+
+    record = json.loads(record_path.read_text())
+    assert record == {"prompt_sha256": prompt_digest(DETAILED_PROMPT), "model": "gemini-2.5-flash", "response": response.text}
+    replaying = SimulatedBackend(latency_ms=0, jitter_ms=0, replay_path=str(record_path))
+    assert generate(replaying, DETAILED_PROMPT).text == response.text
+    assert replaying.counters["replayed"] == 1
+
+
+def test_unknown_backends_are_rejected():
+    with pytest.raises(ValueError):
+        create_llm_backend("openai", "")
+
+
+def test_gemini_errors_map_to_retryable_and_non_retryable_errors():
+    pytest.importorskip("google.generativeai")
+    from google.api_core import exceptions as google_exceptions
+    from llm_backends import GeminiBackend
+
+    class FailingModel:
+        def __init__(self, error):
+            self.error = error
+
+        async def generate_content_async(self, prompt, generation_config=None):
+            raise self.error
+
+    backend = GeminiBackend("test-key")
+    cases = [
+        (google_exceptions.ResourceExhausted("quota"), LLMRateLimitError),
+        (google_exceptions.ServiceUnavailable("unavailable"), LLMBackendError),
+        (google_exceptions.DeadlineExceeded("deadline"), LLMBackendError),
+        (ConnectionResetError("reset"), LLMBackendError),
+        (google_exceptions.InvalidArgument("bad request"), LLMRequestError),
+        (ValueError("response was blocked"), LLMRequestError),
+    ]
+    for error, expected in cases:
+        backend._models["model"] = FailingModel(error)
+        with pytest.raises(expected) as raised:
+            generate(backend, "prompt")
+        assert type(raised.value) is expected # LLMRequestError and LLMRateLimitError are LLMBackendErrors too
+
+
+class ScriptedBackend(LLMBackend):
+    """Raises the scripted errors in turn, then answers with a summary."""
+    name = "scripted"
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def generate(self, prompt, model_name):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return LLMResponse('{"summary": "Recovered."}')
+
+
+def test_transient_errors_and_429s_are_retried(client, app_module, monkeypatch):
+    backend = ScriptedBackend(LLMBackendError("unavailable"), LLMRateLimitError("quota"))
+    monkeypatch.setattr(app_module, "llm_backend", backend)
+    response = client.post("/analyze-document-text", json={"text": "The lessee pays the rent.", "prompt_type": "jargon_simplification"})
+    assert response.status_code == 200
+    assert response.json()["summary"] == "Recovered."
+    assert backend.calls == 3
+
+
+def test_rejected_calls_fail_right_away_and_count_against_the_circuit(client, app_module, monkeypatch):
+    backend = ScriptedBackend(LLMRequestError("InvalidArgument: bad request"))
+    monkeypatch.setattr(app_module, "llm_backend", backend)
+    failures = app_module.circuit_for(app_module.LLM_MODEL_NAME).counters["failures"]
+    response = client.post("/analyze-document-text", json={"text": "The lessor keeps the deposit.", "prompt_type": "jargon_simplification"})
+    assert response.status_code == 502
+    assert backend.calls == 1
+    assert app_module.circuit_for(app_module.LLM_MODEL_NAME).counters["failures"] == failures + 1
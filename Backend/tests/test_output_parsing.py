@@ -0,0 +1,101 @@
+# tests/test_output_parsing.py
+
+from typing import Dict, List
+
+import pytest
+from pydantic import BaseModel
+
+from output_parsing import OutputRepairError, OutputSchema, parse_json, repair_json
+
+
+class ExampleResult(BaseModel):
+    risk_level: str
+    simplified_explanation: str
+    red_flags: List[Dict[str, str]]
+
+
+SCHEMA = OutputSchema(ExampleResult, {"risk_level": ("Low", "Medium", "High")})
+
+
+def test_valid_json_is_not_repaired():
+    assert parse_json('{"a": [1, 2]}') == ({"a": [1, 2]}, [])
+
+
+def test_code_fence_and_surrounding_text():
+    parsed, repairs = parse_json('Here is the analysis:\n```json\n{"risk_level": "Low"}\n```\nThanks!')
+    assert parsed == {"risk_level": "Low"}
+    assert repairs == ["code_fence"]
+
+    parsed, repairs = parse_json('Sure! {"risk_level": "Low"} Let me know if you need more.')
+    assert parsed == {"risk_level": "Low"}
+    assert repairs == ["surrounding_text"]
+
+
+def test_trailing_commas():
+    parsed, repairs = parse_json('{"red_flags": [{"type": "a",}, {"type": "b"},],}')
+    assert parsed == {"red_flags": [{"type": "a"}, {"type": "b"}]}
+    assert repairs == ["trailing_commas"]
+
+
+def test_commas_and_brackets_inside_strings_are_kept():
+    text = '{"simplified_explanation": "Fees, taxes [and] {costs},", "red_flags": []'
+    parsed, repairs = parse_json(text)
+    assert parsed == {"simplified_explanation": "Fees, taxes [and] {costs},", "red_flags": []}
+    assert repairs == ["truncation"]
+
+
+def test_truncation_drops_the_half_written_entry():
+    text = '{"risk_level": "High", "red_flags": [{"type": "Auto-renewal", "description": "Renews"}, {"type": "Penal'
+    parsed, repairs = parse_json(text)
+    assert parsed == {"risk_level": "High", "red_flags": [{"type": "Auto-renewal", "description": "Renews"}]}
+    assert repairs == ["truncation"]
+
+
+def test_truncation_inside_a_top_level_field_drops_the_field():
+    parsed, _ = parse_json('{"risk_level": "High", "simplified_explanation": "The contract is one-si')
+    assert parsed == {"risk_level": "High"}
+
+
+def test_truncation_before_any_complete_field():
+    repaired, repairs = repair_json('{"risk_le')
+    assert repaired == "{}"
+    assert "truncation" in repairs
+
+
+def test_unrepairable_output_raises():
+    with pytest.raises(OutputRepairError):
+        parse_json("I could not analyze this clause.")
+
+
+def test_schema_unwraps_and_coerces_near_misses():
+    parsed, repairs = SCHEMA.parse('[{"Risk Level": "HIGH RISK", "simplifiedExplanation": ["One.", "Two."], '
+                                   '"red_flags": ["Unlimited liability", {"type": "Fee", "amount": 5}]}]')
+    assert repairs == ["unwrapped_list"]
+    result, coercions = SCHEMA.validate(parsed)
+    assert result == {
+        "risk_level": "High",
+        "simplified_explanation": "One.\n\nTwo.",
+        "red_flags": [{"description": "Unlimited liability"}, {"type": "Fee", "amount": "5"}],
+    }
+    assert coercions == ["joined_text", "normalized_choices", "renamed_fields", "stringified_values", "wrapped_entries"]
+
+
+def test_schema_unwraps_a_nested_result():
+    parsed, repairs = SCHEMA.parse('{"analysis": {"risk_level": "Low", "simplified_explanation": "Fine."}}')
+    assert repairs == ["unwrapped_object"]
+    result, coercions = SCHEMA.validate(parsed)
+    assert result["red_flags"] == []
+    assert coercions == ["missing_lists"]
+
+
+def test_ambiguous_choice_is_left_alone():
+    result, coercions = SCHEMA.validate({"risk_level": "Low to Medium", "simplified_explanation": "", "red_flags": []})
+    assert result["risk_level"] == "Low to Medium"
+    assert coercions == []
+
+
+def test_schema_rejects_what_it_cannot_coerce():
+    with pytest.raises(OutputRepairError):
+        SCHEMA.validate({"risk_level": "Low", "red_flags": []})
+    with pytest.raises(OutputRepairError):
+        SCHEMA.validate(["not", "an", "object"])
@@ -0,0 +1,84 @@
+# tests/test_preanalysis.py
+
+from preanalysis import (LexiconMatcher, apply_local_findings, iter_clause_references, preanalyze, shift_offsets,
+                         strip_local_findings)
+
+CLAUSE = (
+    "3. Fees.\nSubject to Section 7.2 and notwithstanding Clause 4, the Supplier shall use reasonable   efforts. "
+    "He or she must comply with 15 U.S.C. § 78j and the GDPR, and Section 10(b) of the Securities Exchange Act of 1934. "
+    "The chairman decides; he may act reasonably."
+)
+
+
+def spans(findings, key):
+    return [(entry[key], CLAUSE[entry["start"]:entry["end"]]) for entry in findings]
+
+
+def test_lexicon_matcher_finds_whole_words_leftmost_longest_across_whitespace():
+    matcher = LexiconMatcher({"terms": ["best efforts", "efforts", "best"], "other": ["est"]})
+    matches = matcher.find("Use BEST\n efforts, not bestow; the best.")
+    assert matches == {"terms": [(4, 17, "best efforts"), (35, 39, "best")]}
+
+
+def test_vague_and_biased_terms_carry_their_offsets():
+    findings = preanalyze(CLAUSE)
+    assert spans(findings["vague_terms"], "term") == [("reasonable   efforts", "reasonable   efforts"), ("reasonably", "reasonably")]
+    # "He or she" is neutral wording and suppresses the "he" inside it.
+    assert [(entry["phrase"], entry["suggestion"]) for entry in findings["biased_language"]] == [("chairman", "chair"), ("he", "they")]
+    assert all(CLAUSE[entry["start"]:entry["end"]] == entry["phrase"] for entry in findings["biased_language"])
+
+
+def test_external_references_are_classified_clear_or_ambiguous():
+    references = preanalyze(CLAUSE)["external_references"]
+    assert [(entry["reference"], entry["status"]) for entry in references] == [
+        ("15 U.S.C. § 78j", "clear"),
+        ("GDPR", "ambiguous"),
+        ("Section 10(b) of the Securities Exchange Act of 1934", "clear"),
+    ]
+    assert "GDPR" in references[1]["context"]
+
+
+def test_clause_references_skip_headings_citations_and_self_references():
+    text = "1. Scope.\nSee Clause 1 and Section 10(b) of the Securities Exchange Act of 1934.\n2. Term.\nExcept as provided in Section 1 or Clause 3, this applies."
+    references = [(reference.source, reference.target, reference.relation) for reference in iter_clause_references(text)]
+    assert references == [("2", "1", "except"), ("2", "3", "except")]
+
+
+def test_cross_references_become_dependencies():
+    dependencies = preanalyze(CLAUSE)["inter_clause_dependencies"]
+    assert [(entry["clause_id"], entry["dependency_type"], entry["related_clause_id"]) for entry in dependencies] == [
+        ("Section 7.2", "sets_condition_for", "3"),
+        ("Clause 4", "modifies", "3"),
+    ]
+    assert dependencies[0]["description"] == "Clause 3 is subject to Section 7.2."
+
+
+def test_offsets_are_shifted_for_chunks_of_a_longer_document():
+    local = preanalyze(CLAUSE)
+    shifted = preanalyze(CLAUSE, offset=1000)
+    assert [entry["start"] + 1000 for entry in local["vague_terms"]] == [entry["start"] for entry in shifted["vague_terms"]]
+    assert shift_offsets(local, 1000) == shifted
+    assert shift_offsets(local, 0) is local
+
+
+def test_local_findings_complete_and_strip_from_llm_output():
+    llm_output = {
+        "risk_level": "High",
+        "inter_clause_dependencies": [{"clause_id": "Section 9", "dependency_type": "modifies", "description": "LLM finding."}],
+        "red_flags": [],
+    }
+    completed = apply_local_findings(llm_output, CLAUSE)
+    assert len(completed["vague_terms"]) == 2
+    assert len(completed["external_references"]) == 3
+    assert [entry["clause_id"] for entry in completed["inter_clause_dependencies"]] == ["Section 9", "Section 7.2", "Clause 4"]
+    assert strip_local_findings(completed) == {**llm_output, "vague_terms": [], "biased_language": [], "external_references": []}
+
+
+def test_fast_mode_runs_only_the_local_detectors(client, app_module):
+    calls = app_module.llm_backend.counters["calls"]
+    response = client.post("/analyze-document-text", json={"text": CLAUSE, "fast_mode": True})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["mode"] == "fast"
+    assert len(result["external_references"]) == 3
+    assert app_module.llm_backend.counters["calls"] == calls
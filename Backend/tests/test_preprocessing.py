@@ -0,0 +1,101 @@
+# tests/test_preprocessing.py
+
+from preprocessing import DocumentPreprocessor, OffsetMap, map_result_offsets, preprocess_document, split_pages
+
+
+def page(number, body):
+    return f"ACME CORP CONFIDENTIAL\n\n{body}\n\n   Page {number} of 3\n\f"
+
+
+PAGES = [
+    page(1, "Section 1. Term\nThe agreement runs for one  year and renews\tautomatically."),
+    page(2, "Section 2. Payment\nFees are due on the first day of each month. The customer shall make reasonable termi-\nnation payments."),
+    page(3, "Section 3. Signatures\nSignature page follows.\nBy: ________\nName: Jane Roe"),
+]
+DOCUMENT = "".join(PAGES)
+
+
+def assert_maps_back(preprocessor, original):
+    """Every non-whitespace character of the cleaned text maps back to the same character of the original."""
+    for position, char in enumerate(preprocessor.text):
+        if not char.isspace():
+            assert original[preprocessor.offset_map.to_original(position)] == char
+
+
+def test_running_headers_page_numbers_and_spacing_are_removed():
+    preprocessor = preprocess_document(PAGES)
+    text = preprocessor.text
+    assert "ACME CORP" not in text and "Page 2 of 3" not in text
+    assert "one year and renews automatically." in text
+    assert "reasonable termination payments." in text
+    assert "\n\n\n" not in text and not text.startswith("\n")
+    assert preprocessor.removed == {"repeated_lines": 3, "page_numbers": 3, "boilerplate_lines": 0, "hyphenations": 1}
+    stats = preprocessor.stats()
+    assert stats["clean_chars"] == len(text) < stats["original_chars"] == len(DOCUMENT)
+    assert_maps_back(preprocessor, DOCUMENT)
+
+
+def test_clause_headings_are_never_running_headers():
+    pages = [f"Section 4. Term\nText of page {number}.\n\f" for number in range(3)]
+    assert preprocess_document(pages).text.count("Section 4. Term") == 3
+
+
+def test_boilerplate_is_only_dropped_on_request():
+    kept = preprocess_document(PAGES).text
+    dropped = preprocess_document(PAGES, drop_boilerplate=True)
+    assert "Signature page follows." in kept and "By: ________" in kept
+    assert "Signature page follows." not in dropped.text and "By: ________" not in dropped.text
+    assert "Name: Jane Roe" in dropped.text # Filled-in signature details stay
+    assert dropped.removed["boilerplate_lines"] == 2
+    assert_maps_back(dropped, DOCUMENT)
+
+
+def test_unpaged_documents_keep_their_edge_lines():
+    paragraphs = ["ACME CORP CONFIDENTIAL\n", "1. Term.\n", "ACME CORP CONFIDENTIAL\n", "2\n"]
+    preprocessor = preprocess_document(paragraphs, paged=False)
+    assert preprocessor.text == "".join(paragraphs)
+    assert preprocessor.offset_map.to_original(10) == 10
+
+
+def test_streamed_pages_are_returned_once_the_sample_is_in():
+    preprocessor = DocumentPreprocessor(sample_pages=2)
+    returned = [preprocessor.feed(PAGES[0]), preprocessor.feed(PAGES[1]), preprocessor.feed(PAGES[2]), preprocessor.finish()]
+    assert returned[0] == "" and returned[1] and returned[2] and returned[3] == ""
+    assert "".join(returned) == preprocessor.text
+    assert "ACME CORP" not in preprocessor.text
+    assert_maps_back(preprocessor, DOCUMENT)
+
+
+def test_split_pages_keeps_the_form_feeds():
+    assert split_pages(DOCUMENT) == PAGES
+    assert split_pages("no page breaks") == ["no page breaks"]
+
+
+def test_spans_never_end_in_a_removed_gap():
+    offset_map = OffsetMap(clean_starts=[0, 10], original_starts=[0, 30])
+    assert offset_map.to_original(5) == 5
+    assert offset_map.to_original(12) == 32
+    assert offset_map.span_to_original(8, 10) == (8, 10) # Not 30, the start of the next run
+    assert offset_map.span_to_original(4, 4) == (4, 4)
+
+
+def test_result_offsets_are_mapped_back():
+    offset_map = OffsetMap(clean_starts=[0, 10], original_starts=[0, 30])
+    result = {
+        "risk_level": "Low",
+        "vague_terms": [{"term": "reasonable", "start": 12, "end": 22}, {"term": "from the LLM"}],
+        "chunk_status": [{"start": 0, "end": 20, "status": "ok"}],
+    }
+    mapped = map_result_offsets(result, offset_map)
+    assert mapped["vague_terms"] == [{"term": "reasonable", "start": 32, "end": 42}, {"term": "from the LLM"}]
+    assert mapped["chunk_status"] == [{"start": 0, "end": 40, "status": "ok"}]
+    assert result["vague_terms"][0]["start"] == 12
+
+
+def test_api_offsets_refer_to_the_submitted_text(client):
+    response = client.post("/analyze-document-text", json={"text": DOCUMENT, "prompt_type": "detailed_analysis"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["preprocessing"]["removed"]["page_numbers"] == 3
+    terms = [(entry["term"], DOCUMENT[entry["start"]:entry["end"]]) for entry in result["vague_terms"] if "start" in entry]
+    assert terms and all(term == submitted for term, submitted in terms)
@@ -0,0 +1,102 @@
+# tests/test_rate_limiter.py
+
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import PRIORITY_BULK, PRIORITY_INTERACTIVE, LLMRateLimiter, LocalQuota, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake)
+    return fake
+
+
+def test_bucket_starts_full_and_refills_at_its_rate(clock):
+    bucket = TokenBucket(capacity=10, rate=2)
+    assert bucket.time_until(10) == 0.0
+    bucket.consume(10)
+    assert bucket.time_until(4) == pytest.approx(2.0)
+    clock.now += 1.5
+    assert bucket.time_until(4) == pytest.approx(0.5)
+    assert bucket.tokens == pytest.approx(3.0)
+
+
+def test_bucket_never_holds_more_than_its_capacity(clock):
+    bucket = TokenBucket(capacity=10, rate=2)
+    clock.now += 3600
+    assert bucket.time_until(11) == pytest.approx(0.5)
+    assert bucket.tokens == 10
+
+
+def test_bucket_debt_delays_later_calls(clock):
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.consume(15)
+    assert bucket.tokens == -5
+    assert bucket.time_until(1) == pytest.approx(6.0)
+
+
+def test_quota_takes_a_request_and_the_tokens_together(clock):
+    quota = LocalQuota(requests_per_minute=2, tokens_per_minute=600)
+    assert quota.try_acquire(500) == 0.0
+    # One request is left, but only 100 tokens: nothing is taken while waiting.
+    assert quota.try_acquire(200) == pytest.approx(10.0)
+    assert quota.stats()["requests_available"] == 1
+    assert quota.try_acquire(100) == 0.0
+    assert quota.try_acquire(1) == pytest.approx(30.0)
+
+
+def test_quota_pause_delays_admission(clock):
+    quota = LocalQuota(requests_per_minute=60, tokens_per_minute=6000)
+    quota.pause(5)
+    quota.pause(2) # A shorter pause doesn't shorten the current one
+    assert quota.try_acquire(1) == pytest.approx(5.0)
+    clock.now += 5
+    assert quota.try_acquire(1) == 0.0
+
+
+def test_usage_corrects_the_estimate():
+    async def scenario():
+        limiter = LLMRateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+        await limiter.acquire(100)
+        await limiter.record_usage(100, 400)
+        return await limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["tokens_estimated"] == 100
+    assert stats["tokens_actual"] == 400
+    assert stats["tokens_available"] == pytest.approx(600, abs=1)
+
+
+def test_waiting_interactive_calls_are_admitted_before_bulk_calls():
+    async def scenario():
+        limiter = LLMRateLimiter(requests_per_minute=2, tokens_per_minute=1000)
+        await limiter.acquire(1)
+        await limiter.acquire(1) # Uses up the requests of this minute
+        admitted = []
+
+        async def call(name, priority):
+            await limiter.acquire(1, priority)
+            admitted.append(name)
+
+        tasks = [asyncio.ensure_future(call("bulk", PRIORITY_BULK)),
+                 asyncio.ensure_future(call("interactive", PRIORITY_INTERACTIVE))]
+        await asyncio.sleep(0.01)
+        assert admitted == []
+        limiter.quota.requests.tokens = 2 # The bucket refills; penalize(0) wakes the dispatcher
+        await limiter.penalize(0)
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+        return admitted
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
@@ -0,0 +1,179 @@
+# tests/test_shared_state.py
+
+import asyncio
+
+import pytest
+
+import shared_state
+from rate_limiter import LocalQuota
+from shared_state import LocalLeases, RequestCoalescer, SQLiteLeases, SQLiteQuota, create_shared_state
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(shared_state.time, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def leases(request, tmp_path):
+    return LocalLeases() if request.param == "local" else SQLiteLeases(str(tmp_path / "state.sqlite3"))
+
+
+def test_a_lease_has_one_owner_until_it_expires(clock, leases):
+    assert leases.try_acquire("key", "worker-1", 10)
+    assert not leases.try_acquire("key", "worker-2", 10)
+    assert leases.holder("key") == "worker-1"
+
+    clock.now += 5
+    assert leases.try_acquire("key", "worker-1", 10) # Renewed until now + 10
+    clock.now += 9
+    assert not leases.try_acquire("key", "worker-2", 10)
+    clock.now += 1
+    assert leases.holder("key") is None
+    assert leases.try_acquire("key", "worker-2", 10)
+    assert leases.stats()["leases"] == 1
+
+
+def test_only_the_owner_releases_a_lease(clock, leases):
+    leases.try_acquire("key", "worker-1", 10)
+    leases.release("key", "worker-2")
+    assert leases.holder("key") == "worker-1"
+    leases.release("key", "worker-1")
+    assert leases.holder("key") is None
+    assert leases.stats()["leases"] == 0
+
+
+def test_sqlite_leases_are_shared_between_processes_opening_the_file(clock, tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first, second = SQLiteLeases(path), SQLiteLeases(path)
+    assert first.try_acquire("key", "worker-1", 10)
+    assert not second.try_acquire("key", "worker-2", 10)
+    assert second.holder("key") == "worker-1"
+
+
+def test_sqlite_quota_buckets_are_shared_and_refill(clock, tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first = SQLiteQuota(path, requests_per_minute=2, tokens_per_minute=600)
+    second = SQLiteQuota(path, requests_per_minute=2, tokens_per_minute=600)
+    assert first.try_acquire(100) <= 0
+    assert second.try_acquire(100) <= 0
+    assert first.try_acquire(100) == pytest.approx(30.0) # Waits for a request to refill
+    clock.now += 30
+    assert second.try_acquire(100) <= 0
+
+    second.consume_tokens(500) # min(600, 400 + 30 * 10) - 100 - 500
+    assert first.stats()["tokens_available"] == 0
+    clock.now += 30
+    assert first.try_acquire(400) == pytest.approx(10.0)
+
+
+def test_sqlite_quota_pauses_every_worker(clock, tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first = SQLiteQuota(path, requests_per_minute=60, tokens_per_minute=6000)
+    second = SQLiteQuota(path, requests_per_minute=60, tokens_per_minute=6000)
+    first.pause(5)
+    assert second.try_acquire(1) == pytest.approx(5.0)
+    assert second.stats()["paused_for_seconds"] == 5.0
+    clock.now += 5
+    assert second.try_acquire(1) <= 0
+
+
+def test_shared_state_backends(tmp_path):
+    quota, leases = create_shared_state("local", "", 60, 6000)
+    assert isinstance(quota, LocalQuota) and isinstance(leases, LocalLeases)
+    quota, leases = create_shared_state("sqlite", str(tmp_path / "state.sqlite3"), 60, 6000)
+    assert quota.blocking and leases.blocking
+    with pytest.raises(ValueError):
+        create_shared_state("redis", "", 60, 6000)
+
+
+class FakeCache:
+    """The shared result cache: a dict, with calls that store their output in it."""
+
+    def __init__(self):
+        self.entries = {}
+        self.calls = 0
+
+    async def lookup(self, key="key"):
+        return self.entries.get(key)
+
+    def call(self, output="output", seconds=0.05, key="key"):
+        async def make_call():
+            self.calls += 1
+            await asyncio.sleep(seconds)
+            self.entries[key] = output
+            return output
+        return make_call
+
+
+def coalescer(leases, owner="worker-1"):
+    return RequestCoalescer(leases, owner, lease_seconds=0.3, poll_seconds=0.01, max_poll_seconds=0.05)
+
+
+def test_concurrent_identical_calls_within_a_worker_share_one_call():
+    cache = FakeCache()
+    requests = coalescer(LocalLeases())
+
+    async def scenario():
+        return await asyncio.gather(*[requests.run("key", cache.call(), cache.lookup) for _ in range(3)])
+
+    assert asyncio.run(scenario()) == [("output", "call"), ("output", "local"), ("output", "local")]
+    assert cache.calls == 1
+    assert asyncio.run(requests.stats())["in_flight"] == 0
+
+
+def test_workers_read_another_workers_output_from_the_cache():
+    cache, leases = FakeCache(), LocalLeases()
+    first, second = coalescer(leases, "worker-1"), coalescer(leases, "worker-2")
+
+    async def scenario():
+        return await asyncio.gather(first.run("key", cache.call(), cache.lookup),
+                                    second.run("key", cache.call(), cache.lookup))
+
+    assert asyncio.run(scenario()) == [("output", "call"), ("output", "remote")]
+    assert cache.calls == 1
+    assert second.counters["coalesced_remote"] == 1
+
+
+def test_a_dead_workers_lease_is_taken_over_once_it_expires():
+    cache, leases = FakeCache(), LocalLeases()
+    leases.try_acquire("key", "crashed-worker", 0.1)
+    requests = coalescer(leases)
+    assert asyncio.run(requests.run("key", cache.call(seconds=0), cache.lookup)) == ("output", "call")
+    assert requests.counters["takeovers"] == 1
+    assert leases.holder("key") is None
+
+
+def test_failures_reach_the_waiters_and_cancelled_callers_hand_over():
+    cache = FakeCache()
+    requests = coalescer(LocalLeases())
+
+    async def failing_call():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("LLM call failed")
+
+    async def failing():
+        return await asyncio.gather(*[requests.run("key", failing_call, cache.lookup) for _ in range(2)],
+                                    return_exceptions=True)
+
+    assert [str(outcome) for outcome in asyncio.run(failing())] == ["LLM call failed"] * 2
+
+    async def cancelled():
+        first = asyncio.ensure_future(requests.run("key", cache.call(seconds=1), cache.lookup))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(requests.run("key", cache.call(seconds=0), cache.lookup))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(cancelled()) == ("output", "call")
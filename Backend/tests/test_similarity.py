@@ -0,0 +1,72 @@
+# tests/test_similarity.py
+
+from similarity import SimilarityIndex, minhash_signature, signature_similarity, similarity_tokens
+
+DELIVERY = ("The Supplier shall deliver the Goods to the Buyer within 30 days of the Order Date, and any delay beyond "
+            "10 business days entitles the Buyer to liquidated damages of 2% of the price per week.")
+# The same boilerplate with other numbers
+DELIVERY_OTHER_TERMS = ("The Supplier shall deliver the Goods to the Buyer within 45 days of the Order Date, and any delay beyond "
+                        "15 business days entitles the Buyer to liquidated damages of 5% of the price per week.")
+# The same opening, but a different remedy
+DELIVERY_OTHER_REMEDY = ("The Supplier shall deliver the Goods to the Customer within 30 days of the Order Date, and any delay beyond "
+                         "10 business days entitles the Customer to terminate this agreement without penalty.")
+GOVERNING_LAW = ("This Agreement is governed by the laws of the State of New York, and the parties submit to the exclusive "
+                 "jurisdiction of its courts.")
+SCOPE = SimilarityIndex.scope("detailed_analysis", "template", "model")
+
+
+def similarity(first, second):
+    return signature_similarity(minhash_signature(first), minhash_signature(second))
+
+
+def test_numbers_dates_case_and_punctuation_are_masked():
+    assert similarity_tokens("Pay $1,250.00 by 3 March 2024!") == ["pay", "#", "by", "#", "#", "#"]
+    # "May" is left alone, as it is far more often the verb
+    assert similarity_tokens("Either party may terminate in May") == ["either", "party", "may", "terminate", "in", "may"]
+    assert similarity(DELIVERY, DELIVERY.upper().replace(",", ";")) == 1.0
+
+
+def test_signatures_are_deterministic():
+    assert minhash_signature(DELIVERY) == minhash_signature(DELIVERY)
+    assert len(minhash_signature("")) == len(minhash_signature(DELIVERY))
+
+
+def test_boilerplate_with_other_terms_is_a_near_duplicate():
+    assert similarity(DELIVERY, DELIVERY_OTHER_TERMS) >= 0.85
+
+
+def test_clause_with_a_different_meaning_is_below_the_threshold():
+    assert similarity(DELIVERY, DELIVERY_OTHER_REMEDY) < 0.85
+    assert similarity(DELIVERY, GOVERNING_LAW) < 0.2
+
+
+def test_index_returns_the_stored_result_of_a_near_duplicate():
+    index = SimilarityIndex(":memory:", threshold=0.85)
+    index.add(SCOPE, minhash_signature(DELIVERY), {"risk_level": "Medium"})
+    index.add(SCOPE, minhash_signature(GOVERNING_LAW), {"risk_level": "Low"})
+    match = index.find(SCOPE, minhash_signature(DELIVERY_OTHER_TERMS))
+    assert match is not None
+    assert match.result == {"risk_level": "Medium"}
+    assert match.similarity >= 0.85
+    assert index.find(SCOPE, minhash_signature(DELIVERY_OTHER_REMEDY)) is None
+    # A lower threshold, as used for the degraded fallback, does match it.
+    assert index.find(SCOPE, minhash_signature(DELIVERY_OTHER_REMEDY), threshold=0.4).result == {"risk_level": "Medium"}
+
+
+def test_index_entries_are_scoped():
+    index = SimilarityIndex(":memory:")
+    index.add(SCOPE, minhash_signature(DELIVERY), {"risk_level": "Medium"})
+    other_model = SimilarityIndex.scope("detailed_analysis", "template", "other-model")
+    assert index.find(other_model, minhash_signature(DELIVERY)) is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    index = SimilarityIndex(":memory:", max_entries=2)
+    index.add(SCOPE, minhash_signature(DELIVERY), {"clause": "delivery"})
+    index.add(SCOPE, minhash_signature(GOVERNING_LAW), {"clause": "law"})
+    assert index.find(SCOPE, minhash_signature(DELIVERY)) is not None # Now more recently used than GOVERNING_LAW
+    index.add(SCOPE, minhash_signature(DELIVERY_OTHER_REMEDY), {"clause": "remedy"})
+    assert index.find(SCOPE, minhash_signature(GOVERNING_LAW)) is None
+    assert index.find(SCOPE, minhash_signature(DELIVERY)) is not None
+    assert index.stats()["entries"] == 2
+    assert index.stats()["evictions"] == 1
@@ -0,0 +1,72 @@
+# tests/test_streaming_api.py
+
+import io
+import json
+
+import docx
+
+CONTRACT = "".join(
+    f"Section {number}. Obligations {number}\n"
+    + f"The supplier shall deliver batch {number} within a reasonable time after each order. " * 6 + "\n\n"
+    for number in range(1, 13)
+)
+
+
+def events_of(response):
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def docx_upload(paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    output = io.BytesIO()
+    document.save(output)
+    return {"file": ("contract.docx", output.getvalue())}
+
+
+def test_text_stream_sends_each_chunk_then_the_merged_result(client):
+    events = events_of(client.post("/analyze-document-text/stream", json={"text": CONTRACT, "prompt_type": "detailed_analysis"}))
+    chunks, result = events[:-1], events[-1]
+    assert len(chunks) > 1
+    assert all(event["event"] == "chunk" and event["total"] == len(chunks) for event in chunks)
+    assert all(event["result"]["risk_level"] for event in chunks)
+    # The chunks cover the document without gaps, whatever order they completed in.
+    spans = sorted((event["start"], event["end"]) for event in chunks)
+    assert spans[0][0] == 0 and spans[-1][1] <= len(CONTRACT)
+    assert all(previous[1] == following[0] for previous, following in zip(spans, spans[1:]))
+    assert result["event"] == "result"
+    assert result["result"]["document_id"]
+
+
+def test_streamed_and_plain_analyses_cover_the_same_chunks(client):
+    body = {"text": CONTRACT.replace("supplier", "vendor"), "prompt_type": "risk_identification"}
+    events = events_of(client.post("/analyze-document-text/stream", json=body))
+    plain = client.post("/analyze-document-text", json=body).json()
+    streamed_spans = sorted((event["start"], event["end"]) for event in events[:-1])
+    assert streamed_spans == [(status["start"], status["end"]) for status in plain["chunk_status"]]
+    assert [(status["start"], status["end"]) for status in events[-1]["result"]["chunk_status"]] == streamed_spans
+
+
+def test_invalid_requests_fail_before_the_stream_starts(client):
+    response = client.post("/analyze-document-text/stream", json={"text": CONTRACT, "prompt_type": "unknown"})
+    assert response.status_code == 400
+    response = client.post("/upload-and-analyze/stream", files={"file": ("notes.txt", b"text")})
+    assert response.status_code == 400
+
+
+def test_upload_stream_analyzes_extracted_paragraphs(client):
+    response = client.post("/upload-and-analyze/stream", files=docx_upload(CONTRACT.split("\n\n")))
+    events = events_of(response)
+    assert [event["event"] for event in events[:-1]] == ["chunk"] * (len(events) - 1)
+    assert len(events) > 2
+    result = events[-1]["result"]
+    assert result["upload"]["bytes"] > 0
+    assert result["document_id"]
+
+
+def test_extraction_failures_end_the_stream_with_an_error_event(client):
+    events = events_of(client.post("/upload-and-analyze/stream", files={"file": ("broken.docx", b"not a docx")}))
+    assert events[-1]["event"] == "error"
+    assert events[-1]["status_code"] == 422
@@ -0,0 +1,137 @@
+# tests/test_uploads.py
+
+import asyncio
+import io
+import os
+
+import docx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+
+import uploads
+from uploads import MemoryBudget, RequestSizeLimitMiddleware, UploadTooLargeError, max_text_chars, spool_upload
+
+MB = 1024 * 1024
+
+
+def upload_file(content, filename="contract.pdf", size=None):
+    return UploadFile(io.BytesIO(content), filename=filename, size=size)
+
+
+def test_uploads_are_spooled_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "COPY_BLOCK_BYTES", 4)
+    spooled = asyncio.run(spool_upload(upload_file(b"0123456789"), max_bytes=MB, directory=str(tmp_path)))
+    assert (spooled.filename, spooled.size) == ("contract.pdf", 10)
+    assert spooled.path.startswith(str(tmp_path)) and spooled.path.endswith(".pdf")
+    with open(spooled.path, "rb") as spooled_file:
+        assert spooled_file.read() == b"0123456789"
+    spooled.remove()
+    assert not os.path.exists(spooled.path)
+    spooled.remove() # Removing twice is harmless
+
+
+@pytest.mark.parametrize("declared_size", [None, 11])
+def test_oversized_uploads_are_rejected_and_leave_no_file(tmp_path, monkeypatch, declared_size):
+    monkeypatch.setattr(uploads, "COPY_BLOCK_BYTES", 4)
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(spool_upload(upload_file(b"0123456789a", size=declared_size), max_bytes=10, directory=str(tmp_path)))
+    assert os.listdir(tmp_path) == []
+
+
+def test_text_cap_follows_the_request_memory_reservation():
+    assert max_text_chars(64 * MB) == 16 * MB
+
+
+def test_memory_budget_admits_requests_first_come_first_served():
+    async def scenario():
+        budget = MemoryBudget(100)
+        order = []
+        release_first = asyncio.Event()
+
+        async def request(name, nbytes, hold=None):
+            async with budget.reserve(nbytes):
+                order.append(name)
+                if hold is not None:
+                    await hold.wait()
+
+        first = asyncio.ensure_future(request("first", 80, release_first))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(request("second", 50))
+        third = asyncio.ensure_future(request("third", 10)) # Fits, but queues behind "second"
+        await asyncio.sleep(0)
+        assert budget.stats()["waiting_requests"] == 2
+        assert budget.reserved_bytes == 80
+        release_first.set()
+        await asyncio.gather(first, second, third)
+        return order, budget.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["first", "second", "third"]
+    assert stats["reserved_bytes"] == 0
+    assert stats["peak_reserved_bytes"] == 80
+    assert (stats["admitted_requests"], stats["requests_that_waited"]) == (3, 2)
+
+
+def test_cancelled_waiters_give_up_their_place():
+    async def scenario():
+        budget = MemoryBudget(100)
+        async with budget.reserve(100):
+            waiting = asyncio.ensure_future(budget.reserve(50).__aenter__())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert budget.stats()["waiting_requests"] == 0
+        return budget.reserved_bytes
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_single_requests_larger_than_the_budget_still_run():
+    async def scenario():
+        budget = MemoryBudget(100)
+        async with budget.reserve(500):
+            return budget.reserved_bytes
+
+    assert asyncio.run(scenario()) == 100
+
+
+@pytest.fixture
+def limited_client():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"bytes": len(await request.body())}
+
+    return TestClient(RequestSizeLimitMiddleware(app, default_limit=2 * MB, path_limits={"/upload": MB}))
+
+
+def test_request_bodies_over_the_path_limit_get_413(limited_client):
+    assert limited_client.post("/upload", content=b"x" * MB).json() == {"bytes": MB}
+    response = limited_client.post("/upload", content=b"x" * (MB + 1))
+    assert response.status_code == 413
+    assert "1 MB" in response.json()["detail"]
+
+
+def test_bodies_without_content_length_are_counted(limited_client):
+    def body():
+        for _ in range(3):
+            yield b"x" * (MB // 2)
+
+    assert limited_client.post("/upload", content=body()).status_code == 413
+
+
+def test_api_reports_the_upload_size_and_removes_the_spooled_file(client, app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    document = docx.Document()
+    document.add_paragraph("1. Term. This agreement runs for one year.")
+    content = io.BytesIO()
+    document.save(content)
+
+    response = client.post("/upload-and-analyze", files={"file": ("contract.docx", content.getvalue())})
+    assert response.status_code == 200
+    assert response.json()["upload"]["bytes"] == len(content.getvalue())
+    assert os.listdir(tmp_path) == []
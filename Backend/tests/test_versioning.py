@@ -0,0 +1,143 @@
+# tests/test_versioning.py
+
+from chunking import pack_clauses, split_into_clauses
+from versioning import DocumentVersion, StoredChunk, clause_hash, drop_stale_cross_clause_entries, plan_reanalysis
+
+CLAUSES = [
+    "1. Term. This agreement runs for one year.\n\n",
+    "2. Payment. Fees are due within 30 days.\n\n",
+    "3. Termination. Either party may terminate on notice.\n\n",
+    "4. Liability. Liability is capped at the fees paid.\n",
+]
+ONE_CLAUSE_PER_CHUNK = 80
+TWO_CLAUSES_PER_CHUNK = 120
+
+
+def analyzed_version(text, max_chars, failed_chunks=()):
+    """A stored version of text as finalize_chunked_analysis saves it, with a dummy result per chunk."""
+    chunks = pack_clauses(text, split_into_clauses(text, max_chars), max_chars)
+    stored = [
+        StoredChunk([clause_hash(clause) for clause in chunk.clauses], [clause.label for clause in chunk.clauses], chunk.text,
+                    None if chunk.index in failed_chunks else {"risk_level": "Low", "chunk": chunk.index}, chunk.start)
+        for chunk in chunks
+    ]
+    return DocumentVersion("previous", "detailed_analysis", stored)
+
+
+def plan(previous, text, max_chars):
+    return plan_reanalysis(text, split_into_clauses(text, max_chars), previous, max_chars)
+
+
+def reused_labels(result):
+    return [[clause.label for clause in reused.clauses] for reused in result.reused]
+
+
+def new_labels(result):
+    return [[clause.label for clause in chunk.clauses] for chunk in result.new_chunks]
+
+
+def test_unchanged_document_reuses_every_chunk():
+    text = "".join(CLAUSES)
+    result = plan(analyzed_version(text, ONE_CLAUSE_PER_CHUNK), text, ONE_CLAUSE_PER_CHUNK)
+    assert reused_labels(result) == [["1"], ["2"], ["3"], ["4"]]
+    assert result.new_chunks == []
+    assert result.changed_labels == set()
+    assert result.changed_clauses == []
+
+
+def test_whitespace_only_changes_are_not_changes():
+    previous = analyzed_version("".join(CLAUSES), ONE_CLAUSE_PER_CHUNK)
+    text = "".join(CLAUSES).replace("runs for one year", "runs  for\none year")
+    result = plan(previous, text, ONE_CLAUSE_PER_CHUNK)
+    assert len(result.reused) == 4
+    assert result.new_chunks == []
+
+
+def test_edited_clause_is_reanalyzed_and_the_rest_reused():
+    previous = analyzed_version("".join(CLAUSES), ONE_CLAUSE_PER_CHUNK)
+    edited = CLAUSES[:2] + ["3. Termination. Either party may terminate for convenience.\n\n"] + CLAUSES[3:]
+    result = plan(previous, "".join(edited), ONE_CLAUSE_PER_CHUNK)
+    assert reused_labels(result) == [["1"], ["2"], ["4"]]
+    assert new_labels(result) == [["3"]]
+    assert result.changed_labels == {"3"}
+    assert [clause.label for clause in result.changed_clauses] == ["3"]
+
+
+def test_chunk_with_an_edited_clause_is_not_reused():
+    previous = analyzed_version("".join(CLAUSES), TWO_CLAUSES_PER_CHUNK)
+    edited = CLAUSES[:1] + ["2. Payment. Fees are due within 60 days.\n\n"] + CLAUSES[2:]
+    result = plan(previous, "".join(edited), TWO_CLAUSES_PER_CHUNK)
+    assert reused_labels(result) == [["3", "4"]]
+    # The unchanged clause 1 shared a chunk with the edit, so it is analyzed again, but isn't itself changed.
+    assert new_labels(result) == [["1", "2"]]
+    assert [clause.label for clause in result.changed_clauses] == ["2"]
+
+
+def test_reused_chunks_move_to_their_new_offsets():
+    previous = analyzed_version("".join(CLAUSES), ONE_CLAUSE_PER_CHUNK)
+    edited = ["1. Term. This agreement runs for one year and renews automatically.\n\n"] + CLAUSES[1:]
+    text = "".join(edited)
+    result = plan(previous, text, ONE_CLAUSE_PER_CHUNK)
+    assert reused_labels(result) == [["2"], ["3"], ["4"]]
+    for reused in result.reused:
+        assert text[reused.start:].startswith(reused.stored.text.strip())
+        assert reused.start != reused.stored.start
+
+
+def test_inserted_and_removed_clauses_are_changed():
+    previous = analyzed_version("".join(CLAUSES), ONE_CLAUSE_PER_CHUNK)
+    edited = CLAUSES[:1] + ["2. Audit. Records may be audited yearly.\n\n"] + [
+        clause.replace(f"{number}.", f"{number + 1}.", 1) for number, clause in ((2, CLAUSES[1]), (3, CLAUSES[2]))
+    ]
+    result = plan(previous, "".join(edited), ONE_CLAUSE_PER_CHUNK)
+    # Renumbering changes a clause's text, so only clause 1 is reused; removed clause 4 counts as changed.
+    assert reused_labels(result) == [["1"]]
+    assert result.changed_labels == {"2", "3", "4"}
+
+
+def test_chunks_whose_analysis_failed_are_reanalyzed():
+    text = "".join(CLAUSES)
+    result = plan(analyzed_version(text, ONE_CLAUSE_PER_CHUNK, failed_chunks={1}), text, ONE_CLAUSE_PER_CHUNK)
+    assert reused_labels(result) == [["1"], ["3"], ["4"]]
+    assert new_labels(result) == [["2"]]
+    # The clause is unchanged, only its analysis is missing.
+    assert result.changed_labels == set()
+    assert result.changed_clauses == []
+
+
+def test_reordered_clauses_in_one_chunk_are_not_reused():
+    previous = analyzed_version("".join(CLAUSES), TWO_CLAUSES_PER_CHUNK)
+    text = "".join([CLAUSES[1], CLAUSES[0]] + CLAUSES[2:])
+    result = plan(previous, text, TWO_CLAUSES_PER_CHUNK)
+    assert reused_labels(result) == [["3", "4"]]
+    assert sorted(label for labels in new_labels(result) for label in labels) == ["1", "2"]
+
+
+def test_drop_stale_cross_clause_entries():
+    result = {
+        "risk_level": "High",
+        "inter_clause_dependencies": [
+            {"clause_id": "Section 3", "depends_on": "Clause 2", "description": "Termination needs unpaid fees."},
+            {"clause_id": "4", "description": "The cap applies to all claims."},
+        ],
+        "compounding_risks": [
+            {"clauses_involved": ["1", "4"], "description": "A long term with a low cap."},
+            {"clauses_involved": ["3."], "description": "Terminating mid-term forfeits the fees under Section 2."},
+        ],
+    }
+    refreshed, stale_refs = drop_stale_cross_clause_entries(result, {"2"})
+    assert refreshed["inter_clause_dependencies"] == [result["inter_clause_dependencies"][1]]
+    assert refreshed["compounding_risks"] == [result["compounding_risks"][0]]
+    assert stale_refs == {"2"}
+    assert refreshed["risk_level"] == "High"
+    # The stored result itself is left alone.
+    assert len(result["inter_clause_dependencies"]) == 2
+
+
+def test_drop_stale_cross_clause_entries_matches_clause_ids():
+    result = {"compounding_risks": [{"clauses_involved": ["Article IV", "7"], "description": "Overlapping indemnities."}]}
+    refreshed, stale_refs = drop_stale_cross_clause_entries(result, {"IV"})
+    assert refreshed["compounding_risks"] == []
+    assert stale_refs == {"IV"}
+    assert "inter_clause_dependencies" not in refreshed
+    assert drop_stale_cross_clause_entries(result, {"5"}) == (result, set())
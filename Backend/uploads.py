@@ -0,0 +1,213 @@
+# uploads.py
+
+"""
+Bounded-memory handling of uploaded files.
+
+Uploads are never read into memory as a whole: oversized requests are rejected from their
+Content-Length before the body is read, the multipart parser spools file parts to disk, and
+spool_upload copies each file part into its own temp file in small blocks, enforcing the size
+limit as it goes. The extraction workers then memory-map that file instead of receiving a copy.
+
+The text extracted from a document does live in the API process while it is analyzed, so each
+upload reserves a fixed per-request amount from a process-wide MemoryBudget for as long as it
+runs. The per-request amount is enforced by capping the extracted text, which makes the number of
+concurrent uploads the process can hold simply budget // per-request reservation.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+COPY_BLOCK_BYTES = 1024 * 1024
+# Copies of a document's text held while it is analyzed (extracted pages, preprocessed text, chunk
+# texts, the stored version), at about one byte per character of mostly ASCII text
+TEXT_BYTES_PER_CHAR = 4
+# Headroom for the multipart framing and the other form fields of a single-file upload
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+@dataclass
+class SpooledUpload:
+    """An uploaded file copied to a temp file; remove() deletes it once the analysis is done."""
+    filename: str
+    path: str
+    size: int
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def spool_upload(file, max_bytes: int, directory: Optional[str] = None) -> SpooledUpload:
+    """
+    Copies an UploadFile to a named temp file in COPY_BLOCK_BYTES blocks, so at most one block is
+    held in memory. Raises UploadTooLargeError as soon as more than max_bytes have been copied.
+    """
+    if getattr(file, "size", None) is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"File is larger than the {max_bytes // (1024 * 1024)} MB upload limit.")
+    suffix = os.path.splitext(file.filename or "")[1]
+    handle, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=directory)
+    size = 0
+    loop = asyncio.get_running_loop()
+    try:
+        with os.fdopen(handle, "wb") as spooled:
+            while True:
+                block = await file.read(COPY_BLOCK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"File is larger than the {max_bytes // (1024 * 1024)} MB upload limit.")
+                await loop.run_in_executor(None, spooled.write, block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledUpload(file.filename, path, size)
+
+
+def max_text_chars(request_memory_bytes: int) -> int:
+    """Extracted text cap that keeps a document within its per-request memory reservation."""
+    return request_memory_bytes // TEXT_BYTES_PER_CHAR
+
+
+class MemoryBudget:
+    """
+    Process-wide budget (in bytes) for the documents held by in-flight requests. reserve() waits,
+    first come first served, until the requested amount is free, so a burst of uploads queues up
+    instead of exhausting the worker.
+    """
+
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.reserved_bytes = 0
+        self.peak_reserved_bytes = 0
+        self.admitted = 0
+        self.waited = 0
+        self._waiters: deque = deque()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[float]:
+        """Holds nbytes of the budget for the duration of the block; yields the seconds spent waiting."""
+        nbytes = min(nbytes, self.total_bytes) # A single request can always run on its own
+        started = time.monotonic()
+        if self._waiters or self.reserved_bytes + nbytes > self.total_bytes:
+            self.waited += 1
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((nbytes, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release(nbytes) # Admitted just as the request was cancelled
+                else:
+                    self._waiters.remove((nbytes, waiter))
+                    self._wake()
+                raise
+        else:
+            self._acquire(nbytes)
+        try:
+            yield time.monotonic() - started
+        finally:
+            self._release(nbytes)
+
+    def _acquire(self, nbytes: int) -> None:
+        self.reserved_bytes += nbytes
+        self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+        self.admitted += 1
+
+    def _release(self, nbytes: int) -> None:
+        self.reserved_bytes -= nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.reserved_bytes + self._waiters[0][0] <= self.total_bytes:
+            nbytes, waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._acquire(nbytes)
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "total_bytes": self.total_bytes,
+            "reserved_bytes": self.reserved_bytes,
+            "peak_reserved_bytes": self.peak_reserved_bytes,
+            "waiting_requests": len(self._waiters),
+            "admitted_requests": self.admitted,
+            "requests_that_waited": self.waited,
+        }
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware that answers 413 for request bodies over a per-path limit (default_limit for
+    other paths) before the app reads them: from Content-Length when the client sends one, and
+    otherwise by counting the body as it is received.
+    """
+
+    def __init__(self, app, default_limit: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.default_limit = default_limit
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.default_limit)
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        forwarded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal forwarded
+            if exceeded and not forwarded:
+                return # The app's error response for the cut-off body is replaced by the 413 below
+            forwarded = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not forwarded:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = json.dumps({"detail": f"Request body exceeds the {limit // (1024 * 1024)} MB limit."}).encode("utf-8")
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
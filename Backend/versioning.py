@@ -0,0 +1,196 @@
+# versioning.py
+
+"""
+Document versions and clause-level diffing for incremental re-analysis.
+
+Every analyzed document is stored as a list of chunks, each remembering the hashes of the clauses
+it covers and its analysis result. When a revised version is submitted, its clauses are diffed
+against the previous version: chunks whose clauses are all unchanged keep their stored results,
+and only added or changed clauses are packed into new chunks for the LLM.
+"""
+
+import difflib
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cache import normalize_text
+from chunking import Chunk, Clause, pack_clauses
+
+# Fields of an analysis result that describe relationships between clauses.
+CROSS_CLAUSE_FIELDS = ("inter_clause_dependencies", "compounding_risks")
+
+# Explicit clause references inside free-text descriptions, e.g. "Section 7.2" or "Clause 4".
+CLAUSE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:article|section|clause|schedule|exhibit|annex|§)\s*([0-9]{1,3}(?:\.[0-9]{1,3})*[a-z]?|[ivxlc]{1,6})\b",
+    re.IGNORECASE,
+)
+
+
+def clause_hash(clause: Clause) -> str:
+    return hashlib.sha256(normalize_text(clause.text).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class StoredChunk:
+    """
+    An analyzed chunk: the clauses it covered and the validated LLM result for it. Chunks whose
+    analysis failed are stored with no result, so the next version analyzes them again.
+    """
+    clause_hashes: List[str]
+    clause_labels: List[Optional[str]]
+    text: str
+    result: Optional[Dict[str, Any]]
+    start: int = 0 # Offset of the chunk in its document, for moving locally computed offsets on reuse
+
+
+@dataclass
+class DocumentVersion:
+    document_id: str
+    prompt_type: str
+    chunks: List[StoredChunk]
+    previous_document_id: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    name: Optional[str] = None # Filename or caller-chosen label
+    # Pairwise clause analyses by pair_key(), carried over on re-analysis for pairs whose clauses are unchanged
+    clause_pairs: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+def pair_key(first_label: str, second_label: str) -> str:
+    """Key of an unordered pair of clause labels."""
+    return "|".join(sorted((first_label, second_label)))
+
+
+class DocumentVersionStore:
+    """
+    Keeps the most recently analyzed document versions in memory, bounded by max_documents.
+    analysis_store.AnalysisStore is the persistent store with the same save/get interface.
+    """
+
+    def __init__(self, max_documents: int = 256):
+        self.max_documents = max_documents
+        self._documents: "OrderedDict[str, DocumentVersion]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, prompt_type: str, chunks: List[StoredChunk], previous_document_id: Optional[str] = None,
+             name: Optional[str] = None, clause_pairs: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        document_id = uuid.uuid4().hex
+        with self._lock:
+            self._documents[document_id] = DocumentVersion(document_id, prompt_type, chunks, previous_document_id, name=name,
+                                                           clause_pairs=clause_pairs or {})
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return document_id
+
+    def get(self, document_id: str) -> Optional[DocumentVersion]:
+        with self._lock:
+            version = self._documents.get(document_id)
+            if version is not None:
+                self._documents.move_to_end(document_id)
+            return version
+
+
+@dataclass
+class ReusedChunk:
+    """A chunk of the previous version whose clauses all appear unchanged (and in order) in the new version."""
+    stored: StoredChunk
+    clauses: List[Clause]
+
+    @property
+    def start(self) -> int:
+        return self.clauses[0].start
+
+
+@dataclass
+class ReanalysisPlan:
+    reused: List[ReusedChunk]
+    new_chunks: List[Chunk]
+    changed_labels: Set[str]
+    changed_clauses: List[Clause]
+
+
+def plan_reanalysis(text: str, clauses: List[Clause], previous: DocumentVersion, max_chars: int) -> ReanalysisPlan:
+    """
+    Diffs the clauses of a new document version against a stored previous version.
+    Returns which stored chunks can be reused and which new chunks need LLM analysis.
+    """
+    new_hashes = [clause_hash(clause) for clause in clauses]
+    old_hashes: List[str] = []
+    old_labels: List[Optional[str]] = []
+    for stored in previous.chunks:
+        old_hashes.extend(stored.clause_hashes)
+        old_labels.extend(stored.clause_labels)
+
+    # Map every unchanged old clause to its position in the new version.
+    old_to_new: Dict[int, int] = {}
+    changed_labels: Set[str] = set()
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(old_end - old_start):
+                old_to_new[old_start + offset] = new_start + offset
+        else:
+            changed_labels.update(label for label in old_labels[old_start:old_end] if label)
+            changed_labels.update(clause.label for clause in clauses[new_start:new_end] if clause.label)
+
+    reused: List[ReusedChunk] = []
+    covered: Set[int] = set()
+    old_position = 0
+    for stored in previous.chunks:
+        old_indices = range(old_position, old_position + len(stored.clause_hashes))
+        old_position += len(stored.clause_hashes)
+        if stored.result is None:
+            continue
+        new_indices = [old_to_new.get(index) for index in old_indices]
+        if new_indices and None not in new_indices and new_indices == list(range(new_indices[0], new_indices[0] + len(new_indices))):
+            reused.append(ReusedChunk(stored, [clauses[index] for index in new_indices]))
+            covered.update(new_indices)
+
+    # Contiguous runs of uncovered clauses are packed into fresh chunks.
+    pending = [clause for index, clause in enumerate(clauses) if index not in covered]
+    new_chunks = pack_clauses(text, pending, max_chars)
+    unchanged = set(old_to_new.values())
+    changed_clauses = [clause for index, clause in enumerate(clauses) if index not in unchanged]
+    return ReanalysisPlan(reused, new_chunks, changed_labels, changed_clauses)
+
+
+def _entry_clause_refs(entry: Any) -> Set[str]:
+    """Collects the clause labels an analysis entry refers to (clause ids and references in its text)."""
+    refs: Set[str] = set()
+    if isinstance(entry, dict):
+        for key, value in entry.items():
+            if key in ("clause_id", "clauses_involved"):
+                for ref in (value if isinstance(value, list) else [value]):
+                    if isinstance(ref, str):
+                        match = CLAUSE_REFERENCE_PATTERN.search(ref)
+                        refs.add((match.group(1) if match else ref.strip().rstrip(".)")).upper())
+    for match in CLAUSE_REFERENCE_PATTERN.finditer(json.dumps(entry, ensure_ascii=False)):
+        refs.add(match.group(1).upper())
+    return refs
+
+
+def drop_stale_cross_clause_entries(result: Dict[str, Any], changed_labels: Set[str]) -> Tuple[Dict[str, Any], Set[str]]:
+    """
+    Returns a copy of a stored result without the cross-clause entries that touch a changed clause,
+    together with the changed clause labels those dropped entries referred to.
+    """
+    refreshed = dict(result)
+    stale_refs: Set[str] = set()
+    for field_name in CROSS_CLAUSE_FIELDS:
+        if field_name not in result:
+            continue
+        kept = []
+        for entry in result[field_name]:
+            touched = _entry_clause_refs(entry) & changed_labels
+            if touched:
+                stale_refs.update(touched)
+            else:
+                kept.append(entry)
+        refreshed[field_name] = kept
+    return refreshed, stale_refs
@@ -1,12 +1,53 @@
 // Frontend/src/App.jsx
 import React, { useState, useCallback } from 'react';
-import axios from 'axios';
 import './App.css'; // Import the CSS file
 
 // --- IMPORT YOUR PIXEL ART IMAGE HERE ---
 import scalesPixel from './assets/Scales.png'; // Updated to use your Scales.png file
 // -----------------------------------------
 
+const RISK_LEVEL_ORDER = { neutral: 0, low: 1, medium: 2, high: 3 };
+
+// Reads an NDJSON analysis stream from the backend, calling onEvent for every parsed event line.
+async function readAnalysisStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop(); // Keep any incomplete trailing line for the next read
+    lines.filter((line) => line.trim()).forEach((line) => onEvent(JSON.parse(line)));
+  }
+  if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
+// Folds one chunk's findings into the partial result shown while the rest of the document is analyzed.
+function mergePartialResult(previous, chunkResult) {
+  if (!previous) return { ...chunkResult };
+  const merged = { ...previous };
+  Object.entries(chunkResult).forEach(([key, value]) => {
+    if (Array.isArray(value)) {
+      merged[key] = [...(previous[key] || []), ...value];
+    } else if (key === 'risk_level') {
+      const rank = (level) => RISK_LEVEL_ORDER[(level || '').toLowerCase()] ?? 0;
+      if (rank(value) > rank(previous.risk_level)) merged[key] = value;
+    } else if (key === 'simplified_explanation') {
+      merged[key] = [previous[key], value].filter(Boolean).join('\n\n');
+    } else if (!(key in merged)) {
+      merged[key] = value;
+    }
+  });
+  return merged;
+}
+
+function errorDetailText(detail, fallback) {
+  if (!detail) return fallback;
+  return typeof detail === 'string' ? detail : JSON.stringify(detail);
+}
+
 function App() {
   const [inputText, setInputText] = useState('');
   const [selectedPrompt, setSelectedPrompt] = useState('detailed_analysis'); // Default prompt type
@@ -14,28 +55,49 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [selectedFile, setSelectedFile] = useState(null);
+  const [progress, setProgress] = useState(null); // { done, total } while a streamed analysis is running
 
   // IMPORTANT: Ensure this URL matches your FastAPI server's address and port
   const API_BASE_URL = 'http://127.0.0.1:8000';
 
+  // Calls one of the backend's streaming endpoints and renders each chunk's findings as soon as it arrives.
+  const runStreamingAnalysis = useCallback(async (url, fetchOptions, fallbackError) => {
+    const response = await fetch(url, { method: 'POST', ...fetchOptions });
+    if (!response.ok) {
+      const body = await response.json().catch(() => ({}));
+      throw new Error(errorDetailText(body.detail, fallbackError));
+    }
+    await readAnalysisStream(response, (event) => {
+      if (event.event === 'chunk') {
+        setAnalysisResult((previous) => mergePartialResult(previous, event.result));
+        setProgress((previous) => ({ done: (previous?.done || 0) + 1, total: event.total }));
+      } else if (event.event === 'result') {
+        setAnalysisResult(event.result); // The merged result replaces the partial one
+      } else if (event.event === 'error') {
+        throw new Error(errorDetailText(event.detail, fallbackError));
+      }
+    });
+  }, []);
+
   const handleTextAnalysis = useCallback(async () => {
     setError(null);
     setLoading(true);
     setAnalysisResult(null); // Clear previous results
+    setProgress(null);
     try {
-      // Ensure this endpoint matches your FastAPI's @app.post("/analyze-document-text")
-      const response = await axios.post(`${API_BASE_URL}/analyze-document-text`, {
-        text: inputText,
-        prompt_type: selectedPrompt,
-      });
-      setAnalysisResult(response.data);
+      // Ensure this endpoint matches your FastAPI's @app.post("/analyze-document-text/stream")
+      await runStreamingAnalysis(`${API_BASE_URL}/analyze-document-text/stream`, {
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text: inputText, prompt_type: selectedPrompt }),
+      }, 'An unexpected error occurred during text analysis.');
     } catch (err) {
       console.error('Error during text analysis:', err);
-      setError(err.response?.data?.detail || 'An unexpected error occurred during text analysis.');
+      setError(err.message || 'An unexpected error occurred during text analysis.');
     } finally {
       setLoading(false);
+      setProgress(null);
     }
-  }, [inputText, selectedPrompt]);
+  }, [inputText, selectedPrompt, runStreamingAnalysis]);
 
   const handleFileChange = useCallback((event) => {
     setSelectedFile(event.target.files[0]);
@@ -51,25 +113,25 @@ function App() {
     setError(null);
     setLoading(true);
     setAnalysisResult(null); // Clear previous results
+    setProgress(null);
 
     const formData = new FormData();
     formData.append('file', selectedFile);
 
     try {
-      // Ensure this endpoint matches your FastAPI's @app.post("/upload-and-analyze")
-      const response = await axios.post(`${API_BASE_URL}/upload-and-analyze`, formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-      });
-      setAnalysisResult(response.data);
+      // Ensure this endpoint matches your FastAPI's @app.post("/upload-and-analyze/stream")
+      // The browser sets the multipart Content-Type (with boundary) for FormData bodies.
+      await runStreamingAnalysis(`${API_BASE_URL}/upload-and-analyze/stream`, {
+        body: formData,
+      }, 'An unexpected error occurred during file upload and analysis.');
     } catch (err) {
       console.error('Error during file upload and analysis:', err);
-      setError(err.response?.data?.detail || 'An unexpected error occurred during file upload and analysis.');
+      setError(err.message || 'An unexpected error occurred during file upload and analysis.');
     } finally {
       setLoading(false);
+      setProgress(null);
     }
-  }, [selectedFile]);
+  }, [selectedFile, runStreamingAnalysis]);
 
   return (
     <div className="app-container">
@@ -119,6 +181,12 @@ function App() {
 
       {error && <div className="error-message">Error: {error}</div>}
 
+      {loading && progress && (
+        <div className="progress-message">
+          Analyzed {progress.done}{progress.total ? ` of ${progress.total}` : ''} section{progress.total === 1 ? '' : 's'}, results update as they arrive...
+        </div>
+      )}
+
       {/* Empty State / Getting Started Message */}
       {!loading && !analysisResult && !error && (
         <div className="initial-message">
@@ -138,7 +206,7 @@ function App() {
 
       {analysisResult && (
         <div className="results-section analysis-results-box">
-          <h2>Analysis Results:</h2>
+          <h2>{loading ? 'Partial Analysis Results:' : 'Analysis Results:'}</h2>
 
           {/* Always display Risk Level if available */}
           {analysisResult.risk_level && (